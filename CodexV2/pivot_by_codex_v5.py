@@ -14,20 +14,50 @@ Backend: FastAPI (Python)
 Frontend: Modern HTML/CSS/JavaScript
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse, Response
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
+import numpy as np
 import json
 import uuid
 from datetime import datetime, timedelta
 from pathlib import Path
 import io
+import os
+import asyncio
+import bisect
+import hashlib
+import operator
+import re
+import sqlite3
+import tempfile
+import threading
+import time
 import traceback
-from typing import List, Dict, Any, Optional
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator
 import uvicorn
 
+try:
+    import pyarrow as pa  # Optional: compact string columns and Arrow output
+    HAS_PYARROW = True
+except ImportError:
+    pa = None
+    HAS_PYARROW = False
+
+try:
+    import openpyxl  # Optional: XLSX exports
+    HAS_OPENPYXL = True
+except ImportError:
+    openpyxl = None
+    HAS_OPENPYXL = False
+
 app = FastAPI(title="Pivot Codex V5", description="Advanced Pivot Table Creator")
 
 # CORS middleware for local development
@@ -39,28 +69,359 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Metrics: request latencies and the time spent in each stage of the work,
+# served in the Prometheus text format at /metrics. Recording one value is a
+# binary search and two additions under a lock, cheap enough to stay on.
+# Upper bounds (seconds) of the histogram buckets
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    """Prometheus label set, e.g. {route="/api/x",method="GET"}"""
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+class Histogram:
+    """Prometheus histogram with one series per combination of label values"""
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # label values: [count per bucket (last one +Inf)..., sum]
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, *labels: str):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+    
+    @contextmanager
+    def time(self, *labels: str):
+        """Observe the duration of the with-block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self._series.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames + ("le",), labels + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {series[-1]}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+def render_metric(name: str, kind: str, documentation: str,
+                  samples: List[Tuple[Dict[str, str], float]]) -> List[str]:
+    """Prometheus lines of a gauge or counter from (labels, value) samples"""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        lines.append(f'{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}')
+    return lines
+
+REQUEST_SECONDS = Histogram('pivot_request_duration_seconds',
+                            'HTTP request latency, until the whole response is sent',
+                            ('method', 'route', 'status'))
+STAGE_SECONDS = Histogram('pivot_stage_duration_seconds',
+                          'Time spent in each stage of parsing, filtering, pivoting and serializing',
+                          ('function', 'stage'))
+
+def route_template(scope: Dict) -> str:
+    """Path template of the route that handled a request, so labels stay few"""
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+    endpoint = scope.get('endpoint')  # older Starlette only records the endpoint
+    if endpoint is not None:
+        for route in app.routes:
+            if getattr(route, 'endpoint', getattr(route, 'app', None)) is endpoint:
+                return route.path
+    return 'unmatched'
+
+class MetricsMiddleware:
+    """Times every HTTP request (streamed bodies included) by route and status"""
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, scope['method'],
+                                    route_template(scope), str(status))
+
+app.add_middleware(MetricsMiddleware)
+
 # Global state management
 class AppState:
-    def __init__(self):
-        self.dataframes = {}  # session_id: dataframe
+    def __init__(self, backend: Optional['StateBackend'] = None, views: Optional['ViewStore'] = None):
+        # Where sessions live beyond this process (see StateBackend)
+        self.backend = backend or create_state_backend()
+        self.datasets = DatasetStore(self.backend)  # shared by every session that uploaded the same file
+        self.session_versions = {}  # session_id: dataset version
         self.pivot_configs = {}  # session_id: list of pivot configs
-        self.saved_views_file = "saved_pivot_views_v5.json"
+        self.config_revisions = {}  # session_id: backend revision of the configs held here
+        self.views = views or ViewStore(VIEWS_DB, LEGACY_VIEWS_FILE)  # saved views of every session
+        self.last_access = {}  # session_id: time.monotonic() of last use
+        self.spilled = {}  # session_id: SpilledSession (pivot results moved to disk)
+        self._pivot_sizes = {}  # pivot_id: (ids of the PIVOT_RESULT_KEYS values, bytes)
+        self._memory_lock = None  # asyncio.Lock: one enforcement of the limits at a time
+        self._memory_tasks = set()  # enforcements scheduled by schedule_memory_limits
         
     def get_session_data(self, session_id: str):
-        if session_id not in self.dataframes:
+        self.touch(session_id)
+        # Another worker may have attached (new) data to the session
+        version = self.backend.session_version(session_id)
+        if version is not None and version != self.session_versions.get(session_id):
+            self._attach(session_id, version)
+        if session_id not in self.session_versions:
             return None
-        return self.dataframes[session_id]
+        return self.datasets.get(self.session_versions[session_id])
     
-    def set_session_data(self, session_id: str, df: pd.DataFrame):
-        self.dataframes[session_id] = df
+    def set_session_data(self, session_id: str, df: pd.DataFrame, schema: Optional[Dict] = None,
+                         version: Optional[str] = None):
+        if session_id in self.spilled:
+            # Reload first so existing pivots keep their results
+            self.restore_session(session_id)
+        # Raw columns are kept as uploaded; each is typed on first use
+        dataset = self.datasets.add(df if isinstance(df, Dataset) else Dataset(df, schema, version))
+        self._attach(session_id, dataset.version)
+        self.backend.set_session_version(session_id, dataset.version)
         if session_id not in self.pivot_configs:
             self.pivot_configs[session_id] = []
+        self.touch(session_id)
+    
+    def _attach(self, session_id: str, version: str):
+        """Point a session at a stored dataset, releasing the one it used before"""
+        previous = self.session_versions.get(session_id)
+        self.session_versions[session_id] = version
+        self.last_access[session_id] = time.monotonic()
+        self.datasets.acquire(version, session_id)
+        if previous is not None and previous != version:
+            self.datasets.release(previous, session_id)
+    
+    def set_pivot_result(self, session_id: str, pivot_id: str, result: Dict):
+        """Record a create_pivot_table result on the pivot, if it still exists"""
+        configs = self.get_pivot_configs(session_id)
+        for config in configs:
+            if config['id'] != pivot_id:
+                continue
+            if result['success']:
+                config['pivot_df'] = result['pivot_df']
+                config['selection'] = result['selection']
+                config['error_bounds'] = result.get('error_bounds')  # set while a preview is shown
+                config['error_log'] = ''
+                config['generated_code'] = generate_python_code(config, self.get_schema(session_id))
+            else:
+                config['error_log'] = result.get('error', 'Unknown error')
+            self.set_pivot_configs(session_id, configs)
+            pivot_events.publish(session_id, pivot_id)
+    
+    def get_schema(self, session_id: str):
+        dataset = self.get_session_data(session_id)
+        return dataset.schema if dataset is not None else {}
     
     def get_pivot_configs(self, session_id: str):
+        self.touch(session_id)
+        revision = self.backend.configs_revision(session_id)
+        if revision != self.config_revisions.get(session_id, 0):
+            self._reload_configs(session_id, revision)
         return self.pivot_configs.get(session_id, [])
     
     def set_pivot_configs(self, session_id: str, configs: List[Dict]):
         self.pivot_configs[session_id] = configs
+        self.config_revisions[session_id] = self.backend.save_configs(session_id, self.serializable_configs(configs))
+        self.touch(session_id)
+    
+    def _reload_configs(self, session_id: str, revision: int):
+        """Take the configs another worker saved, keeping the results held
+        here for pivots whose definition did not change"""
+        held = {c['id']: c for c in self.pivot_configs.get(session_id, [])}
+        configs = self.backend.load_configs(session_id) or []
+        for config in configs:
+            config.update(dict.fromkeys(PIVOT_RESULT_KEYS))
+            old = held.get(config['id'])
+            if old is not None and canonical_pivot_config(old) == canonical_pivot_config(config):
+                config.update({k: old.get(k) for k in PIVOT_RESULT_KEYS})
+        self.pivot_configs[session_id] = configs
+        self.config_revisions[session_id] = revision
+    
+    def serializable_configs(self, configs: List[Dict]) -> List[Dict]:
+        """Configs without their results, with dates as ISO strings"""
+        return [self.serialize_dates({k: v for k, v in config.items() if k not in PIVOT_RESULT_KEYS})
+                for config in configs]
+    
+    # Memory management: sessions idle past the TTL, and the least recently
+    # used ones while over the budget, are spilled to disk and reloaded on
+    # their next access. A shared dataset goes to disk once no session in
+    # memory uses it. Files are written and read in worker threads: request
+    # handlers call load_session first, and spilling runs after the response
+    # (schedule_memory_limits), so the event loop never waits for the disk.
+    def touch(self, session_id: str):
+        """Mark a session as used, reloading it first if it was spilled"""
+        if session_id in self.spilled:
+            self.restore_session(session_id)
+        if session_id in self.session_versions or session_id in self.pivot_configs:
+            self.last_access[session_id] = time.monotonic()
+    
+    def pivot_nbytes(self, config: Dict) -> int:
+        """Memory held by a pivot's results (measured once per result)"""
+        key = tuple(id(config.get(k)) for k in PIVOT_RESULT_KEYS)
+        cached = self._pivot_sizes.get(config['id'])
+        if cached is None or cached[0] != key:
+            cached = (key, sum(frame_nbytes(config.get(k)) for k in PIVOT_RESULT_KEYS))
+            self._pivot_sizes[config['id']] = cached
+        return cached[1]
+    
+    def session_status(self, session_id: str) -> str:
+        """'spilled', 'loaded' or 'no data' (pivots configured before any upload)"""
+        if session_id in self.spilled:
+            return 'spilled'
+        return 'loaded' if session_id in self.session_versions else 'no data'
+    
+    def session_memory(self, session_id: str) -> Dict:
+        """Bytes held in memory by each pivot of a session (its dataset is accounted separately)"""
+        pivots = [{'id': c['id'], 'name': c.get('name'), 'bytes': self.pivot_nbytes(c)}
+                  for c in self.pivot_configs.get(session_id, [])]
+        return {
+            'dataset_version': self.session_versions.get(session_id),
+            'pivots': pivots,
+            'total_bytes': sum(p['bytes'] for p in pivots)
+        }
+    
+    def memory_in_use(self) -> int:
+        """Bytes held by datasets in memory and by the pivots of sessions in memory"""
+        return (self.datasets.nbytes() +
+                sum(self.session_memory(s)['total_bytes'] for s in self.pivot_configs if s not in self.spilled))
+    
+    async def spill_session(self, session_id: str) -> Optional[int]:
+        """Move a session's pivot results (and its dataset, if no other session
+        in memory uses it) to disk; returns the bytes freed, None on failure
+        or when the session was used while its results were being written"""
+        version = self.session_versions.get(session_id)
+        if version is None or session_id in self.spilled:
+            return None
+        results = {}
+        for config in self.pivot_configs.get(session_id, []):
+            result = {k: config.get(k) for k in PIVOT_RESULT_KEYS}
+            if any(v is not None for v in result.values()):
+                results[config['id']] = result
+        freed = self.session_memory(session_id)['total_bytes']
+        accessed = self.last_access.get(session_id)
+        try:
+            spilled = await asyncio.to_thread(SpilledSession, results)
+        except Exception as e:
+            print(f"Error spilling session {session_id}: {e}")
+            return None
+        if (self.last_access.get(session_id) != accessed or session_id in self.spilled
+                or self.session_versions.get(session_id) != version):
+            spilled.remove()
+            return None
+        self.spilled[session_id] = spilled
+        for config in self.pivot_configs.get(session_id, []):
+            if config['id'] in results:
+                config.update(dict.fromkeys(PIVOT_RESULT_KEYS))
+        
+        idle = lambda: all(s in self.spilled for s in self.datasets.sessions(version))
+        if idle():
+            freed += await self.datasets.spill(version, idle)
+        return freed
+    
+    def restore_session(self, session_id: str, results: Optional[Dict[str, Dict]] = None):
+        """Reload a spilled session's pivot results (its dataset reloads when
+        first used); results already read from its spill file may be given"""
+        spilled = self.spilled.pop(session_id)
+        try:
+            if results is None:
+                results = spilled.load()
+        finally:
+            spilled.remove()
+        for config in self.pivot_configs.get(session_id, []):
+            if config['id'] in results:
+                config.update(results[config['id']])
+    
+    async def load_session(self, session_id: str):
+        """Read a spilled session's results and its dataset back in a worker
+        thread, so that the (synchronous) accessors find them in memory"""
+        spilled = self.spilled.get(session_id)
+        if spilled is not None:
+            results = await asyncio.to_thread(spilled.load)
+            # Unless another request restored or dropped the session meanwhile
+            if self.spilled.get(session_id) is spilled:
+                self.restore_session(session_id, results)
+        version = self.session_versions.get(session_id)
+        if version is not None:
+            await self.datasets.load(version)
+    
+    def drop_session(self, session_id: str):
+        """Forget a session entirely"""
+        spilled = self.spilled.pop(session_id, None)
+        if spilled is not None:
+            spilled.remove()
+        for config in self.pivot_configs.pop(session_id, []):
+            self._pivot_sizes.pop(config['id'], None)
+        version = self.session_versions.pop(session_id, None)
+        if version is not None:
+            self.datasets.release(version, session_id)
+        self.last_access.pop(session_id, None)
+    
+    async def enforce_memory_limits(self, keep: Optional[str] = None):
+        """Apply the idle TTLs and the memory budget; `keep` is never spilled"""
+        if self._memory_lock is None:
+            self._memory_lock = asyncio.Lock()
+        async with self._memory_lock:
+            now = time.monotonic()
+            for session_id, last in list(self.last_access.items()):
+                idle = now - last
+                if session_id == keep:
+                    continue
+                in_memory = session_id in self.session_versions and session_id not in self.spilled
+                if not in_memory and idle > SPILL_TTL_SECONDS:
+                    self.drop_session(session_id)
+                elif in_memory and idle > SESSION_TTL_SECONDS:
+                    await self.spill_session(session_id)
+            
+            total = self.memory_in_use()
+            loaded = [s for s in self.session_versions if s not in self.spilled and s != keep]
+            for session_id in sorted(loaded, key=lambda s: self.last_access.get(s, 0)):
+                if total <= MEMORY_BUDGET_BYTES:
+                    break
+                freed = await self.spill_session(session_id)
+                if freed is not None:
+                    total -= freed
+    
+    def schedule_memory_limits(self, keep: Optional[str] = None):
+        """Enforce the memory limits in the background, after the current
+        request (or job callback) is done; must be called on the event loop"""
+        task = asyncio.get_running_loop().create_task(self.enforce_memory_limits(keep))
+        self._memory_tasks.add(task)
+        task.add_done_callback(self._memory_tasks.discard)
     
     def serialize_dates(self, obj):
         if isinstance(obj, dict):
@@ -71,40 +432,39 @@ class AppState:
             return obj.isoformat()
         return obj
     
-    def save_views(self, session_id: str):
+    def save_views(self, session_id: str, name: str = 'default',
+                   namespace: Optional[str] = None) -> Optional[int]:
+        """Save the session's pivots as a view (in the session's own namespace
+        by default); returns the view's new version, None on failure"""
         try:
             configs = self.get_pivot_configs(session_id)
             # Remove non-serializable data
-            clean_configs = []
-            for config in configs:
-                clean_config = {k: v for k, v in config.items() 
-                              if k not in ['pivot_df', 'filtered_df']}
-                clean_configs.append(self.serialize_dates(clean_config))
-            
-            with open(self.saved_views_file, 'w') as f:
-                json.dump(clean_configs, f, indent=2)
-            return True
+            clean_configs = self.serializable_configs(configs)
+            return self.views.save(namespace or session_id, name, clean_configs)
         except Exception as e:
             print(f"Error saving views: {e}")
-            return False
+            return None
     
-    def load_views(self, session_id: str):
+    def load_views(self, session_id: str, name: str = 'default', namespace: Optional[str] = None,
+                   version: Optional[int] = None) -> bool:
+        """Replace the session's pivots by a saved view. A session without its
+        own default view gets the shared one."""
         try:
-            with open(self.saved_views_file, 'r') as f:
-                loaded_configs = json.load(f)
-                # Add missing fields
-                for config in loaded_configs:
-                    config['pivot_df'] = None
-                    config['filtered_df'] = None
-                    config['id'] = str(uuid.uuid4())
-                self.set_pivot_configs(session_id, loaded_configs)
+            loaded_configs = self.views.load(namespace or session_id, name, version)
+            if loaded_configs is None and namespace is None and name == 'default':
+                loaded_configs = self.views.load(SHARED_VIEWS_NAMESPACE, name, version)
+            if loaded_configs is None:
+                return False
+            # Add missing fields
+            for config in loaded_configs:
+                config.update(dict.fromkeys(PIVOT_RESULT_KEYS))
+                config['id'] = str(uuid.uuid4())
+            self.set_pivot_configs(session_id, loaded_configs)
             return True
         except Exception as e:
             print(f"Error loading views: {e}")
             return False
 
-state = AppState()
-
 # Static files directory
 static_dir = Path(__file__).parent.parent / "static"
 
@@ -121,211 +481,2869 @@ def default_pivot_config():
         'custom_fill_value': None,
         'margins_enabled': False,
         'margins_name': 'All_Totals',
+        'subtotals_enabled': False,
         'pivot_df': None,
-        'filtered_df': None,
+        'selection': None,
+        'error_bounds': None,
         'generated_code': None,
         'error_log': '',
         'created_at': datetime.now().isoformat(),
         'updated_at': datetime.now().isoformat()
     }
 
-def process_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    """Process uploaded dataframe with date parsing and cleanup"""
-    df_processed = df.copy()
+# Placeholders the tracker export uses for "no date" (MySQL zero date and its PHP rendering)
+INVALID_DATES = ["0000-00-00", "-0001-11-30"]
+
+# Date formats tried during schema inference, most common first
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%d-%m-%Y',
+    '%d-%m-%Y %H:%M:%S',
+    '%d-%b-%Y',
+    '%b-%Y',
+    '%m/%d/%Y',
+    '%Y/%m/%d',
+]
+
+# Number of values sampled per column when inferring the schema
+SCHEMA_SAMPLE_SIZE = 1000
+
+def is_text_dtype(dtype) -> bool:
+    """True for object and string columns (the only ones worth date-sniffing)"""
+    return dtype == object or pd.api.types.is_string_dtype(dtype)
+
+def sample_column(series: pd.Series, sample_size: int = SCHEMA_SAMPLE_SIZE) -> pd.Series:
+    """Evenly spaced sample of the real values of a column (nulls and INVALID_DATES dropped)"""
+    if len(series) > sample_size:
+        positions = np.linspace(0, len(series) - 1, sample_size).astype(np.int64)
+        sample = series.iloc[positions]
+    else:
+        sample = series
+    sample = sample.dropna()
+    values = sample[~sample.isin(INVALID_DATES)]
+    if values.empty and len(sample) < len(series):
+        # Sparse columns are mostly empty or placeholders; look for the few real values
+        values = series[series.notna() & ~series.isin(INVALID_DATES)].head(sample_size)
+    return values
+
+def detect_date_format(values: pd.Series) -> Optional[str]:
+    """Return the first DATE_FORMATS entry that parses every sampled value"""
+    probe = values.iloc[0]
+    for fmt in DATE_FORMATS:
+        # Cheap check on a single value before parsing the whole sample
+        try:
+            datetime.strptime(probe, fmt)
+        except ValueError:
+            continue
+        parsed = pd.to_datetime(values, format=fmt, errors='coerce')
+        if parsed.notna().all():
+            return fmt
+    return None
+
+# Spellings read_csv treats as booleans
+BOOLEAN_VALUES = {'True': True, 'TRUE': True, 'true': True,
+                  'False': False, 'FALSE': False, 'false': False}
+
+def infer_column_schema(series: pd.Series, sample_size: int = SCHEMA_SAMPLE_SIZE) -> Dict:
+    """Infer the type of a single column from a sample of its values.
+    
+    Types are 'datetime' (with the detected format), 'numeric', 'boolean'
+    and 'text'. Already typed columns are reported as they are.
+    """
+    if not is_text_dtype(series.dtype):
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return {'type': 'datetime', 'format': None}
+        if pd.api.types.is_bool_dtype(series):
+            return {'type': 'boolean', 'format': None}
+        if pd.api.types.is_numeric_dtype(series):
+            return {'type': 'numeric', 'format': None}
+        return {'type': 'text', 'format': None}
+    
+    values = sample_column(series, sample_size)
+    if values.empty:
+        if series.notna().any():
+            # Nothing but INVALID_DATES placeholders: an (empty) ISO date column
+            return {'type': 'datetime', 'format': DATE_FORMATS[0]}
+        # Entirely empty column, which read_csv loads as float NaN
+        return {'type': 'numeric', 'format': None}
+    
+    values = values.astype(str).str.strip()
+    if values.isin(list(BOOLEAN_VALUES)).all():
+        return {'type': 'boolean', 'format': None}
+    if parse_numeric_column(values) is not None:
+        return {'type': 'numeric', 'format': None}
+    fmt = detect_date_format(values)
+    if fmt:
+        return {'type': 'datetime', 'format': fmt}
+    return {'type': 'text', 'format': None}
+
+def infer_schema(df: pd.DataFrame, sample_size: int = SCHEMA_SAMPLE_SIZE) -> Dict[str, Dict]:
+    """Infer a per-column schema (type and date format) from sampled values"""
+    return {col: infer_column_schema(df[col], sample_size) for col in df.columns}
+
+def parse_date_column(series: pd.Series, fmt: str) -> Optional[pd.Series]:
+    """Parse a column with an explicit format, or return None if any real value fails.
+    
+    This mirrors the old errors='ignore' behaviour where a column was only
+    converted when every value was a date.
+    """
+    cleaned = series.mask(series.isin(INVALID_DATES))
+    parsed = pd.to_datetime(cleaned, format=fmt, errors='coerce')
+    if (parsed.isna() & cleaned.notna()).any():
+        return None
+    return parsed
+
+def parse_numeric_column(series: pd.Series) -> Optional[pd.Series]:
+    """Convert a text column to int/float as read_csv would, or return None if any value is not a number"""
+    values = pd.to_numeric(series.to_numpy(dtype=object, na_value=np.nan), errors='coerce')
+    parsed = pd.Series(values, index=series.index, name=series.name)
+    if (parsed.isna() & series.notna()).any():
+        return None
+    return parsed
+
+def parse_boolean_column(series: pd.Series) -> Optional[pd.Series]:
+    """Convert a text column of True/False spellings, or return None if any value is something else"""
+    parsed = series.map(BOOLEAN_VALUES)
+    if (parsed.isna() & series.notna()).any():
+        return None
+    # Like read_csv, a boolean column with missing values stays object
+    return parsed.astype(bool) if parsed.notna().all() else parsed.astype(object)
+
+def convert_column(series: pd.Series, col_schema: Dict) -> Tuple[pd.Series, Dict]:
+    """Convert a raw text column to its typed form according to its schema entry.
+    
+    Returns the typed column and the schema entry actually applied: a column
+    whose values do not all fit the inferred type stays text.
+    """
+    if not is_text_dtype(series.dtype):
+        return series, col_schema
+    
+    kind = col_schema.get('type')
+    parsed = None
+    if kind == 'datetime' and col_schema.get('format'):
+        parsed = parse_date_column(series, col_schema['format'])
+    elif kind == 'numeric':
+        parsed = parse_numeric_column(series)
+    elif kind == 'boolean':
+        parsed = parse_boolean_column(series)
+    if parsed is not None:
+        return parsed, col_schema
+    
+    text = series.mask(series.isin(INVALID_DATES)).astype(TEXT_DTYPE)
+    return text, {'type': 'text', 'format': None}
+
+def process_dataframe(df: pd.DataFrame, schema: Optional[Dict] = None) -> pd.DataFrame:
+    """Process uploaded dataframe with date parsing and cleanup.
+    
+    Each column is converted with its sampled schema entry (dates with their
+    detected format) instead of trying pd.to_datetime on every text column.
+    Entries for columns that turn out not to fit are downgraded to 'text' in
+    the given schema.
+    """
+    if schema is None:
+        schema = infer_schema(df)
+    df_processed = df.copy(deep=False)
+    
+    for col in df_processed.columns:
+        df_processed[col], schema[col] = convert_column(df_processed[col], schema[col])
+    
+    return df_processed
+
+def config_columns(config: Dict) -> List[str]:
+    """Columns a pivot configuration refers to (index, columns, values and filters)"""
+    cols = list(config.get('index_cols') or []) + list(config.get('column_cols') or [])
+    cols += [item.get('value_col') for item in config.get('value_agg_list', [])]
+    cols += [f.get('column') for f in config.get('filters', [])]
+    return [col for col in dict.fromkeys(cols) if col]
+
+# Date buckets: virtual columns "column@bucket" holding the period each date
+# of a date column falls in, usable like any column in pivots and filters.
+# Each is stored as a categorical of integer codes over its periods' labels,
+# which sort chronologically ("2025-05", "2025-Q2", "2025-W19", ...)
+DATE_BUCKETS = ('day', 'week', 'month', 'quarter', 'year')
+# strftime formats giving the same labels, for generated code (quarters use Period's %q)
+BUCKET_FORMATS = {'day': '%Y-%m-%d', 'week': '%G-W%V', 'month': '%Y-%m', 'year': '%Y'}
+
+def split_bucket(col: str) -> Tuple[str, Optional[str]]:
+    """Date column and bucket of a virtual column name; (col, None) otherwise"""
+    base, sep, bucket = col.rpartition('@')
+    if sep and base and bucket in DATE_BUCKETS:
+        return base, bucket
+    return col, None
+
+def period_numbers(dates: np.ndarray, bucket: str) -> np.ndarray:
+    """Number of the period each datetime64 falls in, counted from the one
+    holding 1970-01-01 (weeks start on Mondays); undefined for NaT"""
+    if bucket == 'day':
+        return dates.astype('datetime64[D]').astype(np.int64)
+    if bucket == 'week':
+        # 1970-01-01 was a Thursday, three days after the week's Monday
+        return (dates.astype('datetime64[D]').astype(np.int64) + 3) // 7
+    if bucket == 'year':
+        return dates.astype('datetime64[Y]').astype(np.int64)
+    months = dates.astype('datetime64[M]').astype(np.int64)
+    return months // 3 if bucket == 'quarter' else months
+
+def period_starts(numbers: np.ndarray, bucket: str) -> np.ndarray:
+    """First day (datetime64[D]) of each numbered period"""
+    numbers = np.asarray(numbers, dtype=np.int64)
+    if bucket == 'day':
+        return numbers.astype('datetime64[D]')
+    if bucket == 'week':
+        return (numbers * 7 - 3).astype('datetime64[D]')
+    if bucket == 'quarter':
+        return (numbers * 3).astype('datetime64[M]').astype('datetime64[D]')
+    unit = 'Y' if bucket == 'year' else 'M'
+    return numbers.astype(f'datetime64[{unit}]').astype('datetime64[D]')
+
+def period_labels(numbers: np.ndarray, bucket: str) -> List[str]:
+    """Label of each numbered period"""
+    starts = period_starts(numbers, bucket)
+    if bucket == 'week':
+        # ISO weeks: a week belongs to the year of its Thursday
+        weeks = pd.DatetimeIndex(starts).isocalendar()
+        return [f'{year}-W{week:02d}' for year, week in zip(weeks['year'], weeks['week'])]
+    if bucket == 'quarter':
+        return [f'{label[:4]}-Q{(int(label[5:7]) - 1) // 3 + 1}' for label in np.datetime_as_string(starts, unit='M')]
+    return np.datetime_as_string(starts, unit={'day': 'D', 'month': 'M', 'year': 'Y'}[bucket]).tolist()
+
+def bucket_label(value, bucket: str) -> Optional[str]:
+    """Label of the period a date (or a date string) falls in, None for values
+    that are not dates"""
+    try:
+        date = pd.Timestamp(value)
+    except (ValueError, TypeError):
+        return None
+    if pd.isna(date):
+        return None
+    return period_labels(period_numbers(np.array([date.to_datetime64()]), bucket), bucket)[0]
+
+def date_buckets(series: pd.Series, bucket: str) -> pd.Series:
+    """Periods of a date column's values, as an ordered categorical"""
+    dates = series.to_numpy()
+    missing = np.isnat(dates)
+    numbers = period_numbers(dates, bucket)
+    periods, codes = np.unique(numbers[~missing], return_inverse=True)
+    all_codes = np.full(len(dates), -1, dtype=np.int32)
+    all_codes[~missing] = codes
+    dtype = pd.CategoricalDtype(period_labels(periods, bucket), ordered=True)
+    return pd.Series(pd.Categorical.from_codes(all_codes, dtype=dtype), index=series.index,
+                     name=f'{series.name}@{bucket}')
+
+# Dataset storage
+PANDAS_3 = int(pd.__version__.split('.')[0]) >= 3
+
+def raw_string_dtype():
+    """Most compact string dtype available for raw CSV columns"""
+    if PANDAS_3:
+        # The default string dtype is Arrow-backed when pyarrow is installed
+        return str
+    if not HAS_PYARROW:
+        return object
+    try:
+        return pd.api.types.pandas_dtype('string[pyarrow_numpy]')
+    except (ImportError, TypeError):
+        return object
+
+RAW_STRING_DTYPE = raw_string_dtype()
+# Dtype of typed text columns, matching what read_csv produces
+TEXT_DTYPE = str if PANDAS_3 else object
+
+# Column profiles
+# Most frequent values listed per column
+PROFILE_TOP_VALUES = 20
+# Histogram bins of numeric and date columns
+PROFILE_HISTOGRAM_BINS = 20
+
+def profile_column(counts: pd.Series, n_rows: int, dtype) -> Dict:
+    """Summary of a column for the filter UI, from its value counts.
+    
+    The distinct values and their counts give the null count, the top values,
+    min/max and a (weighted) histogram without scanning the column again.
+    """
+    values = counts.index
+    non_null = int(counts.sum())
+    profile = {
+        'dtype': str(dtype),
+        'count': non_null,
+        'null_count': n_rows - non_null,
+        'distinct': len(counts),
+        'top_values': [{'value': value, 'count': int(n)} for value, n in
+                       zip(json_safe_values(values[:PROFILE_TOP_VALUES].to_series()),
+                           counts.to_numpy()[:PROFILE_TOP_VALUES])],
+        'min': None,
+        'max': None,
+        'histogram': None
+    }
+    is_date = pd.api.types.is_datetime64_any_dtype(values.dtype)
+    is_number = pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype)
+    if not len(counts) or not (is_date or is_number):
+        return profile
+    
+    profile['min'], profile['max'] = json_safe_values(pd.Series([values.min(), values.max()], dtype=values.dtype))
+    if is_date:
+        # Nanoseconds since the earliest date, which floats hold exactly enough
+        nanos = values.to_numpy().astype('datetime64[ns]').astype(np.int64)
+        origin = nanos.min()
+        points = (nanos - origin).astype(float)
+    else:
+        points = values.to_numpy(dtype=float, na_value=np.nan)
+    finite = np.isfinite(points)
+    if finite.any():
+        hist, edges = np.histogram(points[finite], bins=PROFILE_HISTOGRAM_BINS,
+                                   weights=counts.to_numpy()[finite])
+        if is_date:
+            edges = [edge.isoformat() for edge in pd.to_datetime(edges.astype(np.int64) + origin, unit='ns')]
+        else:
+            edges = edges.tolist()
+        profile['histogram'] = {'edges': edges, 'counts': hist.astype(np.int64).tolist()}
+    return profile
+
+class Dataset:
+    """Uploaded data held as compact raw text columns.
+    
+    A column is converted to its typed form (according to the inferred schema)
+    the first time a pivot refers to it, and cached from then on. Columns no
+    pivot touches are never converted. Date buckets ("column@month", see
+    DATE_BUCKETS) are computed and cached the same way. Safe to share
+    between worker threads.
+    """
+    def __init__(self, df: pd.DataFrame, schema: Optional[Dict] = None, version: Optional[str] = None):
+        # Identifies the content; identical uploads share a version (and cached results)
+        self.version = version or uuid.uuid4().hex
+        self.schema = schema if schema is not None else infer_schema(df)
+        self.columns = df.columns.tolist()
+        self.index = df.index
+        self._raw = {col: df[col] for col in self.columns}
+        self._typed = {}
+        self._buckets = {}  # "column@bucket": its periods
+        self._nbytes = {}  # col: memory held by the stored column
+        self._lock = threading.Lock()  # guards the four dicts above, not conversions
+        self._profile = None
+        self._profile_lock = threading.Lock()
+        self._cube = None
+        self._cubed = False
+        self._cube_lock = threading.Lock()
+    
+    @property
+    def shape(self):
+        return (len(self.index), len(self.columns))
+    
+    def has_column(self, col: str) -> bool:
+        """Whether col is a column or a date bucket of a date column"""
+        if col in self.schema:
+            return True
+        base, bucket = split_bucket(col)
+        return bucket is not None and self.schema.get(base, {}).get('type') == 'datetime'
+    
+    def bucket_columns(self) -> List[str]:
+        """Date buckets of the date columns, for the pivot UI"""
+        return [f'{col}@{bucket}' for col in self.columns
+                if self.schema[col].get('type') == 'datetime' for bucket in DATE_BUCKETS]
+    
+    def _bucket(self, col: str, cache: bool = True) -> pd.Series:
+        """A date bucket, computed on first use from the converted date column"""
+        with self._lock:
+            if col in self._buckets:
+                return self._buckets[col]
+        base, bucket = split_bucket(col)
+        dates = self.column(base, cache)
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            raise KeyError(col)
+        with STAGE_SECONDS.time('Dataset.column', 'bucket'):
+            periods = date_buckets(dates, bucket)
+        if cache:
+            with self._lock:
+                periods = self._buckets.setdefault(col, periods)
+        return periods
+    
+    def column(self, col: str, cache: bool = True) -> pd.Series:
+        """Typed column, converted on first use"""
+        if col not in self.schema and self.has_column(col):
+            return self._bucket(col, cache)
+        with self._lock:
+            if col in self._typed:
+                return self._typed[col]
+            raw = self._raw[col]
+        with STAGE_SECONDS.time('Dataset.column', 'convert'):
+            typed, applied = convert_column(raw, self.schema[col])
+        if cache:
+            with self._lock:
+                if col in self._typed:  # converted meanwhile by another thread
+                    return self._typed[col]
+                self._typed[col] = typed
+                self.schema[col] = applied
+                del self._raw[col]
+                self._nbytes.pop(col, None)
+        return typed
+    
+    def _storage(self) -> Tuple[Dict[str, pd.Series], Dict[str, pd.Series]]:
+        """Consistent snapshot of the (typed, raw) columns"""
+        with self._lock:
+            return dict(self._typed), dict(self._raw)
+    
+    def frame(self, columns: Optional[List[str]] = None, cache: bool = True) -> pd.DataFrame:
+        """DataFrame of the given typed columns (all columns by default)"""
+        if columns is None:
+            columns = self.columns
+        data = {col: self.column(col, cache) for col in dict.fromkeys(columns)}
+        return pd.DataFrame(data, index=self.index, copy=False)
+    
+    def iter_chunks(self, positions: np.ndarray, columns: Optional[List[str]] = None,
+                    chunk_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Rows at the given positions, a chunk at a time.
+        
+        Converted columns come out typed; columns no pivot has touched come
+        out as their uploaded text, so exporting never converts them.
+        """
+        if columns is None:
+            columns = self.columns
+        chunk_rows = chunk_rows or EXPORT_CHUNK_ROWS
+        typed, raw = self._storage()
+        for start in range(0, len(positions), chunk_rows):
+            chunk = positions[start:start + chunk_rows]
+            data = {}
+            for col in dict.fromkeys(columns):
+                if col in typed:
+                    data[col] = typed[col].take(chunk)
+                else:
+                    values = raw[col].take(chunk)
+                    data[col] = values.mask(values.isin(INVALID_DATES))
+            yield pd.DataFrame(data, index=self.index.take(chunk), copy=False)
+    
+    def csv_date_formats(self) -> Dict[str, str]:
+        """Fixed CSV formats for converted date columns, so every export chunk prints alike"""
+        formats = {}
+        typed, _ = self._storage()
+        for col, series in typed.items():
+            if pd.api.types.is_datetime64_any_dtype(series):
+                values = series.dropna()
+                dates_only = (values == values.dt.normalize()).all()
+                formats[col] = '%Y-%m-%d' if dates_only else '%Y-%m-%d %H:%M:%S'
+        return formats
+    
+    def stored(self, col: str) -> pd.Series:
+        """A column as currently held: typed if converted, raw text otherwise"""
+        if col not in self.schema and self.has_column(col):
+            return self._bucket(col)
+        with self._lock:
+            return self._typed[col] if col in self._typed else self._raw[col]
+    
+    def nbytes(self) -> int:
+        """Approximate memory held by the columns (each measured once)"""
+        with self._lock:
+            buckets = list(self._buckets)
+        for col in self.columns + buckets:
+            if col not in self._nbytes:
+                self._nbytes[col] = frame_nbytes(self.stored(col))
+        return sum(self._nbytes.values()) + (self._cube.nbytes if self._cube is not None else 0)
+    
+    def to_file(self, path: Path) -> Dict[str, Any]:
+        """Write the columns as stored to Parquet (pickle without pyarrow).
+        
+        Returns what Dataset.from_file needs besides the file to rebuild the
+        dataset exactly, converted columns included.
+        """
+        typed, raw = self._storage()
+        stored = {col: typed[col] if col in typed else raw[col] for col in self.columns}
+        frame = pd.DataFrame(stored, index=self.index, copy=False)
+        if path.suffix == '.parquet':
+            frame.to_parquet(path)
+        else:
+            frame.to_pickle(path)
+        return {
+            'schema': dict(self.schema),
+            'version': self.version,
+            'dtypes': {col: series.dtype for col, series in stored.items()},
+            'typed': list(typed)
+        }
+    
+    @classmethod
+    def from_file(cls, path: Path, schema: Dict, version: str, dtypes: Dict, typed: List[str]) -> 'Dataset':
+        """Rebuild a dataset written by to_file"""
+        frame = pd.read_parquet(path) if path.suffix == '.parquet' else pd.read_pickle(path)
+        dataset = cls(frame, schema, version)
+        for col in dataset.columns:
+            series = dataset._raw[col]
+            if series.dtype != dtypes[col]:
+                series = series.astype(dtypes[col])
+            if col in typed:
+                del dataset._raw[col]
+                dataset._typed[col] = series
+            else:
+                dataset._raw[col] = series
+        return dataset
+    
+    def head(self, n: int = 5) -> pd.DataFrame:
+        """First rows with every column typed, without converting whole columns"""
+        data = {}
+        typed, raw = self._storage()
+        for col in self.columns:
+            if col in typed:
+                data[col] = typed[col].head(n)
+            else:
+                data[col], _ = convert_column(raw[col].head(n), self.schema[col])
+        return pd.DataFrame(data)
+    
+    def rows(self, positions: np.ndarray, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Rows at the given positions with every column typed, converting only those rows"""
+        if columns is None:
+            columns = self.columns
+        data = {}
+        typed, raw = self._storage()
+        for col in dict.fromkeys(columns):
+            if col in typed:
+                data[col] = typed[col].take(positions)
+            elif col in raw:
+                data[col], _ = convert_column(raw[col].take(positions), self.schema[col])
+            else:
+                data[col] = self.column(col).take(positions)
+        return pd.DataFrame(data, index=self.index.take(positions), copy=False)
+    
+    @property
+    def profiled(self) -> bool:
+        return self._profile is not None
+    
+    def profile(self, progress: Optional[Callable[[float, str], None]] = None) -> Dict[str, Dict]:
+        """Profile of every column (see profile_column), computed once.
+        
+        Unconverted columns are counted as text and only their distinct values
+        are converted, so profiling neither parses every row nor grows the
+        dataset.
+        """
+        with self._profile_lock:
+            if self._profile is None:
+                profile = {}
+                typed, raw = self._storage()
+                for i, col in enumerate(self.columns):
+                    if progress is not None:
+                        progress(i / len(self.columns), f'Profiling {col}')
+                    if col in typed:
+                        series, applied = typed[col], self.schema[col]
+                        counts = series.value_counts()
+                    else:
+                        raw_counts = raw[col].value_counts(dropna=False)
+                        series, applied = convert_column(raw_counts.index.to_series(), self.schema[col])
+                        # Texts converting to the same value are counted together
+                        counts = pd.Series(raw_counts.to_numpy(), index=series.to_numpy())
+                        counts = counts.groupby(level=0).sum().sort_values(ascending=False, kind='stable')
+                    profile[col] = {'type': applied.get('type'),
+                                    **profile_column(counts, len(self.index), series.dtype)}
+                self._profile = profile
+            return self._profile
+    
+    @property
+    def cubed(self) -> bool:
+        return self._cubed
+    
+    @property
+    def cube(self) -> Optional['RollupCube']:
+        """The rollup cube, None until built or when it does not apply"""
+        return self._cube
+    
+    def build_cube(self, progress: Optional[Callable[[float, str], None]] = None) -> Optional['RollupCube']:
+        """Rollup cube over CUBE_DIMENSIONS and CUBE_MEASURES, built once"""
+        with self._cube_lock:
+            if not self._cubed:
+                self._cube = RollupCube.build(self, CUBE_DIMENSIONS, CUBE_MEASURES, progress)
+                self._cubed = True
+            return self._cube
+    
+    def dtypes(self) -> Dict[str, str]:
+        """Actual dtype of converted columns, schema type of the others"""
+        typed, _ = self._storage()
+        return {col: str(typed[col].dtype) if col in typed else self.schema[col]['type']
+                for col in self.columns}
+
+class DatasetStore:
+    """Datasets keyed by version, shared by every session that uploaded the same file.
+    
+    Each dataset is reference-counted by the sessions using it and dropped
+    (with any spill file) when the last one lets go. A dataset no session in
+    memory needs can be spilled to disk; get() reloads it. New datasets are
+    also saved to the state backend, which get() falls back to, so datasets
+    uploaded through another worker are found there.
+    """
+    def __init__(self, backend: 'StateBackend'):
+        self.backend = backend
+        self._datasets = {}  # version: Dataset
+        self._spilled = {}  # version: SpilledDataset
+        self._sessions = {}  # version: set of session ids
+    
+    def __contains__(self, version: str) -> bool:
+        return version in self._datasets or version in self._spilled
+    
+    def add(self, dataset: Dataset) -> Dataset:
+        """Store a dataset, or return the one already stored under its version"""
+        existing = self.get(dataset.version)
+        if existing is not None:
+            return existing
+        self.backend.save_dataset(dataset)
+        self._datasets[dataset.version] = dataset
+        return dataset
+    
+    def get(self, version: str) -> Optional[Dataset]:
+        if version in self._spilled:
+            spilled = self._spilled.pop(version)
+            try:
+                self._datasets[version] = spilled.load()
+            finally:
+                spilled.remove()
+        elif version not in self._datasets:
+            dataset = self.backend.load_dataset(version)
+            if dataset is not None:
+                self._datasets[version] = dataset
+        return self._datasets.get(version)
+    
+    def acquire(self, version: str, session_id: str):
+        self._sessions.setdefault(version, set()).add(session_id)
+    
+    def release(self, version: str, session_id: str):
+        sessions = self._sessions.get(version, set())
+        sessions.discard(session_id)
+        if not sessions:
+            self._sessions.pop(version, None)
+            self._datasets.pop(version, None)
+            spilled = self._spilled.pop(version, None)
+            if spilled is not None:
+                spilled.remove()
+    
+    def sessions(self, version: str) -> set:
+        return self._sessions.get(version, set())
+    
+    async def spill(self, version: str, still_idle: Callable[[], bool]) -> int:
+        """Move a dataset to disk, writing it in a worker thread; returns the
+        bytes freed. It stays in memory if still_idle() no longer holds once
+        the file is written."""
+        dataset = self._datasets.get(version)
+        if dataset is None:
+            return 0
+        try:
+            spilled = await asyncio.to_thread(SpilledDataset, dataset)
+        except Exception as e:
+            print(f"Error spilling dataset {version}: {e}")
+            return 0
+        if self._datasets.get(version) is not dataset or not still_idle():
+            spilled.remove()
+            return 0
+        self._spilled[version] = spilled
+        del self._datasets[version]
+        return dataset.nbytes()
+    
+    async def load(self, version: str):
+        """Bring a dataset into memory like get(), reading the file in a worker thread"""
+        spilled = self._spilled.get(version)
+        if spilled is not None:
+            try:
+                dataset = await asyncio.to_thread(spilled.load)
+            except Exception:
+                if self._spilled.get(version) is not spilled:
+                    return  # reloaded or released meanwhile, which removed the file
+                # As in get(), an unreadable spill file is given up
+                del self._spilled[version]
+                spilled.remove()
+                raise
+            if self._spilled.get(version) is spilled:
+                del self._spilled[version]
+                spilled.remove()
+                self._datasets[version] = dataset
+        elif version not in self._datasets:
+            dataset = await asyncio.to_thread(self.backend.load_dataset, version)
+            if dataset is not None and version not in self:
+                self._datasets[version] = dataset
+    
+    def remove_spilled(self):
+        """Delete the spill files of every spilled dataset (and forget those datasets)"""
+        for version in list(self._spilled):
+            self._spilled.pop(version).remove()
+            self._sessions.pop(version, None)
+    
+    def nbytes(self) -> int:
+        """Memory held by the datasets in memory"""
+        return sum(dataset.nbytes() for dataset in self._datasets.values())
+    
+    def stats(self) -> List[Dict]:
+        """Size, location and users of every stored dataset"""
+        stats = []
+        for version in sorted(set(self._datasets) | set(self._spilled)):
+            dataset = self._datasets.get(version)
+            spilled = self._spilled.get(version)
+            stats.append({
+                'version': version,
+                'status': 'spilled' if spilled is not None else 'loaded',
+                'bytes': dataset.nbytes() if dataset is not None else 0,
+                'spilled_bytes': spilled.nbytes() if spilled is not None else 0,
+                'sessions': sorted(self.sessions(version))
+            })
+        return stats
+
+# State backends: where sessions, their pivot configurations and their
+# datasets live beyond this process. Pivot results are not shared; each
+# worker computes (and caches) its own.
+STATE_BACKEND = os.environ.get('PIVOT_STATE_BACKEND', 'memory')
+STATE_DIR = Path(os.environ.get('PIVOT_STATE_DIR', 'pivot_state_v5'))
+
+class StateBackend:
+    """Interface of the shared state. This base class shares nothing: all
+    state stays in the memory of the (single) worker process."""
+    def session_version(self, session_id: str) -> Optional[str]:
+        """Version of the dataset attached to a session"""
+        return None
+    
+    def set_session_version(self, session_id: str, version: str):
+        pass
+    
+    def configs_revision(self, session_id: str) -> int:
+        """Changes whenever a session's pivot configs are saved (0: never saved)"""
+        return 0
+    
+    def load_configs(self, session_id: str) -> Optional[List[Dict]]:
+        return None
+    
+    def save_configs(self, session_id: str, configs: List[Dict]) -> int:
+        """Store JSON-serializable configs; returns their new revision"""
+        return 0
+    
+    def load_dataset(self, version: str) -> Optional['Dataset']:
+        return None
+    
+    def save_dataset(self, dataset: 'Dataset'):
+        pass
+
+class DiskStateBackend(StateBackend):
+    """State on local disk, shared by every worker process of the server.
+    
+    Sessions and their pivot configs are kept in SQLite. Datasets are
+    written once, as uploaded, to uncompressed Arrow IPC (Feather v2)
+    files that workers memory-map, so the raw text columns are read
+    without copying them.
+    """
+    def __init__(self, root: Path):
+        if not HAS_PYARROW:
+            raise RuntimeError("The disk state backend requires pyarrow")
+        self.dataset_dir = root / 'datasets'
+        self.dataset_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = root / 'state.sqlite3'
+        with self._db() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS datasets (
+                    version TEXT PRIMARY KEY,
+                    schema TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    version TEXT,
+                    configs TEXT NOT NULL DEFAULT '[]',
+                    revision INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT NOT NULL
+                );
+            """)
+    
+    @contextmanager
+    def _db(self):
+        """A connection whose statements commit together"""
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+    
+    def _dataset_path(self, version: str) -> Path:
+        return self.dataset_dir / f'{version}.arrow'
+    
+    def session_version(self, session_id: str) -> Optional[str]:
+        with self._db() as db:
+            row = db.execute('SELECT version FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        return row[0] if row else None
+    
+    def set_session_version(self, session_id: str, version: str):
+        with self._db() as db:
+            previous = db.execute('SELECT version FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+            db.execute("""
+                INSERT INTO sessions (session_id, version, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at
+            """, (session_id, version, datetime.now().isoformat()))
+            # The previous dataset goes once no session refers to it any more
+            if previous and previous[0] and previous[0] != version:
+                used = db.execute('SELECT 1 FROM sessions WHERE version = ? LIMIT 1', (previous[0],)).fetchone()
+                if not used:
+                    db.execute('DELETE FROM datasets WHERE version = ?', (previous[0],))
+                    self._dataset_path(previous[0]).unlink(missing_ok=True)
+    
+    def configs_revision(self, session_id: str) -> int:
+        with self._db() as db:
+            row = db.execute('SELECT revision FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        return row[0] if row else 0
+    
+    def load_configs(self, session_id: str) -> Optional[List[Dict]]:
+        with self._db() as db:
+            row = db.execute('SELECT configs FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_configs(self, session_id: str, configs: List[Dict]) -> int:
+        with self._db() as db:
+            db.execute("""
+                INSERT INTO sessions (session_id, configs, revision, updated_at) VALUES (?, ?, 1, ?)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    configs = excluded.configs, revision = sessions.revision + 1, updated_at = excluded.updated_at
+            """, (session_id, json.dumps(configs, default=str), datetime.now().isoformat()))
+            return db.execute('SELECT revision FROM sessions WHERE session_id = ?', (session_id,)).fetchone()[0]
+    
+    def load_dataset(self, version: str) -> Optional['Dataset']:
+        with self._db() as db:
+            row = db.execute('SELECT schema FROM datasets WHERE version = ?', (version,)).fetchone()
+        path = self._dataset_path(version)
+        if row is None or not path.exists():
+            return None
+        import pyarrow.feather as feather
+        
+        table = feather.read_table(str(path), memory_map=True)
+        text_dtype = pd.api.types.pandas_dtype(RAW_STRING_DTYPE)
+        frame = table.to_pandas(types_mapper=lambda t: text_dtype if pa.types.is_string(t) or pa.types.is_large_string(t) else None)
+        return Dataset(frame, json.loads(row[0]), version)
+    
+    def save_dataset(self, dataset: 'Dataset'):
+        path = self._dataset_path(dataset.version)
+        with self._db() as db:
+            if db.execute('SELECT 1 FROM datasets WHERE version = ?', (dataset.version,)).fetchone() and path.exists():
+                return
+        import pyarrow.feather as feather
+        
+        typed, raw = dataset._storage()
+        if typed:
+            raise ValueError("Datasets are saved as uploaded, before any column is converted")
+        table = pa.Table.from_pandas(pd.DataFrame(raw, copy=False), preserve_index=False)
+        # Written under a temporary name so other workers never map a partial file
+        partial = path.with_suffix(f'.{uuid.uuid4().hex}.partial')
+        feather.write_feather(table, str(partial), compression='uncompressed')
+        os.replace(partial, path)
+        with self._db() as db:
+            db.execute('INSERT OR REPLACE INTO datasets (version, schema, created_at) VALUES (?, ?, ?)',
+                       (dataset.version, json.dumps(dataset.schema), datetime.now().isoformat()))
+
+def create_state_backend() -> StateBackend:
+    """The backend selected by PIVOT_STATE_BACKEND ('memory' or 'disk')"""
+    if STATE_BACKEND == 'disk':
+        return DiskStateBackend(STATE_DIR)
+    if STATE_BACKEND != 'memory':
+        raise ValueError(f"Unknown PIVOT_STATE_BACKEND: {STATE_BACKEND}")
+    return StateBackend()
+
+# Saved views: named sets of pivot configurations, kept in SQLite per
+# namespace (a session id by default, or any user or team name)
+VIEWS_DB = Path(os.environ.get('PIVOT_VIEWS_DB', 'saved_pivot_views_v5.sqlite3'))
+# The single JSON file views used to be saved in, imported once into SHARED_VIEWS_NAMESPACE
+LEGACY_VIEWS_FILE = Path('saved_pivot_views_v5.json')
+SHARED_VIEWS_NAMESPACE = 'shared'
+# Earlier versions kept per view
+VIEW_HISTORY_LIMIT = 50
+
+class ViewStore:
+    """Saved views with their version history.
+    
+    Saving a view writes that view only, in one transaction, so concurrent
+    saves of different views never overwrite each other. Every lookup goes
+    through a primary key or index, so it does not slow down as views pile up.
+    """
+    def __init__(self, db_path: Path, legacy_file: Optional[Path] = None):
+        self.db_path = db_path
+        self.legacy_file = legacy_file
+        self._ready = False  # the database is created on first use
+        self._lock = threading.Lock()
+    
+    def _create(self):
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS views (
+                    namespace TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    pivot_count INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (namespace, name)
+                );
+                CREATE INDEX IF NOT EXISTS views_by_update ON views (namespace, updated_at);
+                CREATE TABLE IF NOT EXISTS view_versions (
+                    namespace TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    configs TEXT NOT NULL,
+                    pivot_count INTEGER NOT NULL,
+                    saved_at TEXT NOT NULL,
+                    PRIMARY KEY (namespace, name, version)
+                );
+            """)
+        self._ready = True
+        if self.legacy_file is not None and self.legacy_file.exists():
+            self._import_legacy(self.legacy_file)
+    
+    @contextmanager
+    def _connect(self):
+        """A connection whose statements commit together"""
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+    
+    def _db(self):
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    self._create()
+        return self._connect()
+    
+    def _import_legacy(self, path: Path):
+        """Keep the views of the old JSON file as the shared 'default' view"""
+        if self.load(SHARED_VIEWS_NAMESPACE, 'default') is not None:
+            return
+        try:
+            with open(path, 'r') as f:
+                configs = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error importing {path}: {e}")
+            return
+        self.save(SHARED_VIEWS_NAMESPACE, 'default', configs)
+    
+    def save(self, namespace: str, name: str, configs: List[Dict]) -> int:
+        """Store a new version of a view; returns its version number"""
+        now = datetime.now().isoformat()
+        with self._db() as db:
+            # Take the write lock before reading so concurrent saves (other
+            # workers included) get distinct versions
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT version FROM views WHERE namespace = ? AND name = ?',
+                             (namespace, name)).fetchone()
+            version = row[0] + 1 if row else 1
+            db.execute("""
+                INSERT INTO view_versions (namespace, name, version, configs, pivot_count, saved_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (namespace, name, version, json.dumps(configs, default=str), len(configs), now))
+            db.execute("""
+                INSERT INTO views (namespace, name, version, pivot_count, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (namespace, name) DO UPDATE SET
+                    version = excluded.version, pivot_count = excluded.pivot_count, updated_at = excluded.updated_at
+            """, (namespace, name, version, len(configs), now))
+            db.execute('DELETE FROM view_versions WHERE namespace = ? AND name = ? AND version <= ?',
+                       (namespace, name, version - VIEW_HISTORY_LIMIT))
+        return version
+    
+    def load(self, namespace: str, name: str, version: Optional[int] = None) -> Optional[List[Dict]]:
+        """Pivot configs of a view (its latest version by default), None if unknown"""
+        with self._db() as db:
+            if version is None:
+                row = db.execute('SELECT version FROM views WHERE namespace = ? AND name = ?',
+                                 (namespace, name)).fetchone()
+                if row is None:
+                    return None
+                version = row[0]
+            row = db.execute('SELECT configs FROM view_versions WHERE namespace = ? AND name = ? AND version = ?',
+                             (namespace, name, version)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def list(self, namespace: str, limit: int = 100, offset: int = 0) -> List[Dict]:
+        """Views of a namespace, most recently saved first"""
+        with self._db() as db:
+            rows = db.execute("""
+                SELECT name, version, pivot_count, updated_at FROM views WHERE namespace = ?
+                ORDER BY updated_at DESC LIMIT ? OFFSET ?
+            """, (namespace, limit, offset)).fetchall()
+        return [{'name': name, 'version': version, 'pivot_count': pivot_count, 'updated_at': updated_at}
+                for name, version, pivot_count, updated_at in rows]
+    
+    def history(self, namespace: str, name: str) -> List[Dict]:
+        """Versions of a view still kept, newest first"""
+        with self._db() as db:
+            rows = db.execute("""
+                SELECT version, saved_at, pivot_count FROM view_versions
+                WHERE namespace = ? AND name = ? ORDER BY version DESC
+            """, (namespace, name)).fetchall()
+        return [{'version': version, 'saved_at': saved_at, 'pivot_count': pivot_count}
+                for version, saved_at, pivot_count in rows]
+    
+    def delete(self, namespace: str, name: str) -> bool:
+        """Remove a view and its history; False if there was no such view"""
+        with self._db() as db:
+            deleted = db.execute('DELETE FROM views WHERE namespace = ? AND name = ?', (namespace, name)).rowcount
+            db.execute('DELETE FROM view_versions WHERE namespace = ? AND name = ?', (namespace, name))
+        return deleted > 0
+
+# Range operators compare against one constant, parsed once per filter
+RANGE_OPERATORS = {'>': operator.gt, '<': operator.lt, '>=': operator.ge, '<=': operator.le}
+
+def as_mask(result) -> np.ndarray:
+    """Boolean numpy mask from a comparison result, treating missing values as no match"""
+    if isinstance(result, np.ndarray):
+        return result.astype(bool, copy=False)
+    if result.dtype == bool:
+        return result.to_numpy()
+    return result.to_numpy(dtype=bool, na_value=False)
+
+def compile_filter(f: Dict, series: pd.Series,
+                   index: Optional['ValueIndex'] = None) -> Optional[Callable[[pd.Series], np.ndarray]]:
+    """Compile one filter into a predicate returning a boolean mask for a column.
+    
+    The filter value is parsed once here, according to the column's dtype.
+    With the column's value index, equality and membership compare codes.
+    On a date bucket, dates stand for the period they fall in, and ranges
+    compare periods. Returns None for unknown operators (which never
+    filtered anything).
+    """
+    op = f['operator']
+    value = f.get('value', '')
+    is_date = pd.api.types.is_datetime64_any_dtype(series)
+    if index is not None and len(index.codes) != len(series):
+        index = None
+    bucket = split_bucket(str(series.name))[1] if isinstance(series.dtype, pd.CategoricalDtype) else None
+    if bucket is not None and op not in ('contains', 'not_contains'):
+        if op in ('in', 'not_in'):
+            value = ','.join(bucket_label(v.strip(), bucket) or v.strip() for v in str(value).split(','))
+        else:
+            value = bucket_label(value, bucket) or value
+    
+    if op in ('==', '!='):
+        target = pd.to_datetime(value) if is_date else value
+        def equals(s):
+            if index is not None:
+                return index.equals(target)
+            return as_mask(s == target)
+        if op == '==':
+            return equals
+        # Missing values are never equal, so they always pass '!='
+        return lambda s: ~equals(s)
+    
+    if op in RANGE_OPERATORS and bucket is not None:
+        # Period labels sort chronologically: compare each label once, then look up codes
+        compare = RANGE_OPERATORS[op]
+        target = str(value)
+        def in_range(s):
+            labels = np.asarray(s.cat.categories.astype(str), dtype=object)
+            passes = np.append(compare(labels, target).astype(bool), False)  # code -1: missing
+            return passes[s.cat.codes.to_numpy()]
+        return in_range
+    
+    if op in RANGE_OPERATORS:
+        compare = RANGE_OPERATORS[op]
+        target = pd.to_datetime(value) if is_date else float(value)
+        return lambda s: as_mask(compare(s, target))
+    
+    if op in ('contains', 'not_contains'):
+        pattern = str(value)
+        def contains(s):
+            # Format and match each distinct value once instead of every row
+            codes, uniques = pd.factorize(s, use_na_sentinel=False)
+            hits = pd.Series(uniques, dtype=s.dtype).astype(str).str.contains(pattern, na=False)
+            return as_mask(hits)[codes]
+        if op == 'contains':
+            return contains
+        return lambda s: ~contains(s)
+    
+    if op in ('in', 'not_in'):
+        values = [v.strip() for v in str(value).split(',')]
+        def isin(s):
+            if index is not None:
+                return index.isin(values)
+            return as_mask(s.isin(values))
+        if op == 'in':
+            return isin
+        return lambda s: ~isin(s)
+    
+    return None
+
+def compile_filters(df: pd.DataFrame, filters: List[Dict],
+                    dataset_version: Optional[str] = None) -> List[Tuple[Dict, str, Callable]]:
+    """Compile the active filters of a pivot, skipping incomplete or invalid ones.
+    
+    With the dataset version, filters on columns that have a value index use it.
+    """
+    compiled = []
+    for f in filters:
+        if not f.get('column') or not f.get('operator'):
+            continue
+        
+        col = f['column']
+        if col not in df.columns:
+            continue
+        
+        index = None
+        if dataset_version and f['operator'] in INDEXED_OPERATORS:
+            index = value_index_cache.get((dataset_version, col))
+        try:
+            predicate = compile_filter(f, df[col], index)
+        except Exception as e:
+            print(f"Error applying filter {f}: {e}")
+            continue
+        if predicate is not None:
+            compiled.append((f, col, predicate))
+    return compiled
+
+def filter_cache_key(dataset_version: str, f: Dict) -> Tuple:
+    """Key of one filter's mask: dataset version, column, operator and value"""
+    return (dataset_version, f['column'], f['operator'], json.dumps(f.get('value', ''), sort_keys=True, default=str))
+
+def filter_mask(df: pd.DataFrame, filters: List[Dict], dataset_version: Optional[str] = None) -> Optional[np.ndarray]:
+    """Combined boolean mask of all filters, or None when no filter applies.
+    
+    When df is a full dataset frame and its version is given, each filter's
+    mask is cached as a packed bitmap, so editing one filter only evaluates
+    that filter and other pivots using the same filter reuse its mask.
+    """
+    mask = None
+    for f, col, predicate in compile_filters(df, filters, dataset_version):
+        key = filter_cache_key(dataset_version, f) if dataset_version else None
+        packed = mask_cache.get(key) if key else None
+        if packed is not None:
+            hits = np.unpackbits(packed, count=len(df)).view(bool)
+        else:
+            try:
+                hits = predicate(df[col])
+            except Exception as e:
+                print(f"Error applying filter {f}: {e}")
+                continue
+            if key:
+                mask_cache.put(key, np.packbits(hits))
+        if mask is None:
+            mask = hits.copy()
+        else:
+            mask &= hits
+    return mask
+
+class RowSelection:
+    """The rows of a dataset that pass a pivot's filters, stored compactly.
+    
+    A sparse selection is kept as int32 row positions and a dense one as a
+    packed bitmap (one bit per row), whichever is smaller; no filter at all
+    keeps nothing. Rows are only materialized on demand (exports, paging).
+    The version of the dataset the rows were selected from is kept, as the
+    positions mean nothing in other data.
+    """
+    def __init__(self, mask: Optional[np.ndarray], n_rows: int, dataset_version: Optional[str] = None):
+        self.n_rows = n_rows
+        self.dataset_version = dataset_version
+        self._positions = None
+        self._bitmap = None
+        if mask is None:
+            self.count = n_rows
+        else:
+            self.count = int(np.count_nonzero(mask))
+            if self.count * 4 <= (n_rows + 7) // 8:
+                self._positions = np.flatnonzero(mask).astype(np.int32 if n_rows < 2**31 else np.int64)
+            else:
+                self._bitmap = np.packbits(mask)
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    @property
+    def nbytes(self) -> int:
+        for stored in (self._positions, self._bitmap):
+            if stored is not None:
+                return stored.nbytes
+        return 0
+    
+    def positions(self) -> np.ndarray:
+        """Row positions of the selection, in dataset order"""
+        if self._positions is not None:
+            return self._positions
+        if self._bitmap is not None:
+            return np.flatnonzero(np.unpackbits(self._bitmap, count=self.n_rows))
+        return np.arange(self.n_rows)
+    
+    def take(self, df: pd.DataFrame) -> pd.DataFrame:
+        """The selected rows of a frame holding every row of the dataset"""
+        if self._positions is None and self._bitmap is None:
+            return df
+        return df.take(self.positions())
+
+def apply_filters(df: pd.DataFrame, filters: List[Dict], dataset_version: Optional[str] = None) -> pd.DataFrame:
+    """Apply filters to dataframe.
+    
+    All filters are combined into one boolean mask and the result is built
+    with a single take, instead of materializing a new frame per filter.
+    """
+    mask = filter_mask(df, filters, dataset_version)
+    if mask is None:
+        return df
+    return df.take(np.flatnonzero(mask))
+
+# Totals and subtotals: a pivot's rows are grouped once, by all its row and
+# column fields, keeping beside each value a few partial aggregates that
+# every coarser grouping (a total or subtotal) rolls up from. Medians and
+# distinct counts do not roll up; their totals group the rows again.
+# How the partials of an aggregation that keeps its own partial roll up
+DIRECT_ROLLUPS = {'count': 'sum', 'size': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+# Partial aggregates kept for the other aggregations that roll up
+PARTIAL_AGGREGATES = {'mean': ('sum', 'count'), 'var': ('count', 'mean', 'var'), 'std': ('count', 'mean', 'var')}
+
+def rollup_kind(series: pd.Series, func: str) -> Optional[str]:
+    """How an aggregation of a column rolls up: 'direct', 'partial', or None
+    when its totals need the rows"""
+    numeric = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+    if func in ('count', 'size'):
+        return 'direct'
+    if func == 'sum' and numeric:
+        return 'direct'
+    if func in ('min', 'max') and (numeric or pd.api.types.is_datetime64_any_dtype(series)):
+        return 'direct'
+    if func in PARTIAL_AGGREGATES and numeric:
+        return 'partial'
+    return None
+
+class PartialAggregates:
+    """A pivot's values aggregated per combination of its row and column
+    fields, in one pass over the rows, and rolled up to any coarser grouping"""
+    def __init__(self, rows: pd.DataFrame, groups: List[str], agg_dict: Dict[str, str]):
+        self.rows = rows
+        self.groups = groups
+        self.agg_dict = agg_dict
+        self.kinds = {col: rollup_kind(rows[col], func) for col, func in agg_dict.items()}
+        named = {}
+        for i, (col, func) in enumerate(agg_dict.items()):
+            named[f'{i}'] = (col, func)
+            if self.kinds[col] == 'partial':
+                named.update({f'{i} {partial}': (col, partial) for partial in PARTIAL_AGGREGATES[func]})
+        aggregated = rows.groupby(groups, sort=True, observed=True).agg(**named)
+        # The values at the finest grouping, exactly as pivot_table has them
+        self.cells = aggregated[[f'{i}' for i in range(len(agg_dict))]].set_axis(list(agg_dict), axis=1)
+        self.partials = aggregated.reset_index()
+        self._complete_rows = None
+    
+    @property
+    def complete_rows(self) -> pd.DataFrame:
+        """Rows counted in the cells, for totals that need the rows"""
+        if self._complete_rows is None:
+            columns = self.groups + [col for col, kind in self.kinds.items() if kind is None and col not in self.groups]
+            rows = self.rows[columns]
+            complete = rows[self.groups].notna().all(axis=1).to_numpy()
+            self._complete_rows = rows if complete.all() else rows[complete]
+        return self._complete_rows
+    
+    def rollup(self, keys: List[str]) -> pd.DataFrame:
+        """Values per combination of keys (a subset of the groups); with no
+        keys, one row of grand totals"""
+        frame = self.partials
+        by = [frame[key] for key in keys] or [np.zeros(len(frame), dtype=np.int8)]
+        grouped = frame.groupby(by, sort=True, observed=True)
+        values = {}
+        for i, (col, func) in enumerate(self.agg_dict.items()):
+            kind = self.kinds[col]
+            if kind == 'direct':
+                values[col] = grouped[f'{i}'].agg(DIRECT_ROLLUPS[func])
+            elif func == 'mean':
+                values[col] = grouped[f'{i} sum'].sum() / grouped[f'{i} count'].sum()
+            elif kind == 'partial':
+                # Chan et al.'s pairwise update of counts, means and squared deviations
+                count, mean = frame[f'{i} count'], frame[f'{i} mean']
+                weighted = (count * mean).fillna(0)
+                n = grouped[f'{i} count'].sum()
+                grand_mean = weighted.groupby(by, sort=True, observed=True).transform('sum') / \
+                    count.groupby(by, sort=True, observed=True).transform('sum')
+                squares = (frame[f'{i} var'] * (count - 1)).fillna(0) + (count * (mean - grand_mean) ** 2).fillna(0)
+                var = (squares.groupby(by, sort=True, observed=True).sum() / (n - 1)).where(n > 1)
+                values[col] = np.sqrt(var) if func == 'std' else var
+            else:
+                rows = self.complete_rows
+                row_by = [rows[key] for key in keys] or [np.zeros(len(rows), dtype=np.int8)]
+                values[col] = rows.groupby(row_by, sort=True, observed=True)[col].agg(func)
+        return pd.DataFrame(values)
+
+def totals_pivot_table(rows: pd.DataFrame, config: Dict, agg_dict: Dict[str, str]) -> pd.DataFrame:
+    """pivot_table of rows with its totals (margins) and, optionally,
+    subtotals after each group of every outer row field, rolled up from one
+    grouping of the rows.
+    
+    Totals are laid out as pandas lays out margins. They cover every row of
+    the table, including rows missing another value (which pandas leaves
+    out). A pivot with column fields only gets one total column.
+    """
+    index_cols = list(config.get('index_cols', []))
+    column_cols = list(config.get('column_cols', []))
+    fill_value = config.get('custom_fill_value') if config.get('fill_value_enabled') else None
+    margins = config.get('margins_enabled', False)
+    subtotals = config.get('subtotals_enabled', False) and len(index_cols) > 1
+    name = config.get('margins_name', 'All_Totals')
+    if not isinstance(name, str):
+        raise ValueError("margins_name argument must be a string")
+    
+    partials = PartialAggregates(rows, index_cols + column_cols, agg_dict)
+    body = partials.cells.dropna(how='all')
+    for level in body.index.names:
+        if name in body.index.get_level_values(level):
+            raise ValueError(f'Conflicting name "{name}" in margins')
+    
+    if not index_cols:
+        table = body.sort_index(axis=1)
+        if fill_value is not None:
+            table = table.fillna(fill_value)
+        table = table.T
+        if margins:
+            total = name if len(column_cols) == 1 else (name,) + ('',) * (len(column_cols) - 1)
+            table[total] = partials.rollup([]).iloc[0]
+        return table.dropna(how='all', axis=1)
+    
+    def row_arrays(index: pd.Index, depth: int) -> List:
+        """Row labels of cells rolled up to the first depth row fields: their
+        values, then the total's name"""
+        arrays = [index.get_level_values(i) for i in range(depth)]
+        if depth < len(index_cols):
+            arrays += [[name] * len(index)] + [[''] * len(index)] * (len(index_cols) - depth - 1)
+        return arrays
+    
+    def labeled(cells: pd.DataFrame, depth: int) -> pd.DataFrame:
+        """Cells rolled up to the first depth row fields (and the column
+        fields), laid out as rows of the table"""
+        arrays = row_arrays(cells.index, depth)
+        arrays += [cells.index.get_level_values(depth + i) for i in range(len(column_cols))]
+        cells = cells.set_axis(pd.MultiIndex.from_arrays(arrays, names=index_cols + column_cols))
+        if column_cols:
+            cells = cells.unstack(list(range(len(index_cols), len(index_cols) + len(column_cols))),
+                                  fill_value=fill_value)
+        if len(index_cols) == 1:
+            cells.index = cells.index.get_level_values(0)
+        return cells
+    
+    def totals_column(depth: int) -> pd.DataFrame:
+        """Each value's total over the column fields, for rows rolled up to
+        the first depth row fields"""
+        cells = partials.rollup(index_cols[:depth])
+        arrays = row_arrays(cells.index, depth)
+        if len(index_cols) == 1:
+            labels = pd.Index(arrays[0], name=index_cols[0])
+        else:
+            labels = pd.MultiIndex.from_arrays(arrays, names=index_cols)
+        columns = pd.MultiIndex.from_tuples([(value, name) + ('',) * (len(column_cols) - 1) for value in cells.columns],
+                                            names=[None] + column_cols)
+        return cells.set_axis(labels).set_axis(columns, axis=1)
+    
+    # The body, then subtotals from the innermost, then the grand totals
+    depths = [len(index_cols)]
+    if subtotals:
+        depths += list(range(len(index_cols) - 1, 0, -1))
+    if margins:
+        depths.append(0)
+    table = labeled(body, len(index_cols)).sort_index(axis=1)
+    result = pd.concat([table] + [labeled(partials.rollup(index_cols[:depth] + column_cols), depth)
+                                  for depth in depths[1:]])
+    columns = list(table.columns)
+    if margins and column_cols:
+        result = pd.concat([result, pd.concat([totals_column(depth) for depth in depths])], axis=1)
+        # Each value's columns are followed by its total
+        columns = []
+        for value in table.columns.get_level_values(0).unique():
+            columns += [col for col in table.columns if col[0] == value]
+            columns.append((value, name) + ('',) * (len(column_cols) - 1))
+    
+    # Each subtotal row follows the last row of its group
+    def subtotal_labels(key: Tuple, following: Optional[Tuple]) -> List[Tuple]:
+        return [key[:depth] + (name,) + ('',) * (len(index_cols) - depth - 1)
+                for depth in range(len(index_cols) - 1, 0, -1)
+                if following is None or following[:depth] != key[:depth]]
+    
+    order = []
+    for i, key in enumerate(table.index):
+        order.append(key)
+        if subtotals:
+            order += subtotal_labels(key, table.index[i + 1] if i + 1 < len(table) else None)
+    if margins:
+        order.append(name if len(index_cols) == 1 else (name,) + ('',) * (len(index_cols) - 1))
+    if len(index_cols) > 1:
+        order = pd.MultiIndex.from_tuples(order, names=index_cols)
+    if column_cols:
+        columns = pd.MultiIndex.from_tuples(columns, names=table.columns.names)
+    result = result.reindex(index=order, columns=columns)
+    if fill_value is not None:
+        result = result.fillna(fill_value)
+    return result.dropna(how='all', axis=1)
+
+def pivot_frame(rows: pd.DataFrame, config: Dict, agg_dict: Dict[str, str]) -> pd.DataFrame:
+    """pivot_table of rows as configured; totals and subtotals are rolled up
+    instead of aggregating the rows again"""
+    if config.get('margins_enabled', False) or config.get('subtotals_enabled', False):
+        return totals_pivot_table(rows, config, agg_dict)
+    return pd.pivot_table(
+        rows,
+        values=list(agg_dict.keys()),
+        index=config.get('index_cols', []) or None,
+        columns=config.get('column_cols', []) or None,
+        aggfunc=agg_dict,
+        fill_value=config.get('custom_fill_value') if config.get('fill_value_enabled') else None,
+        observed=True
+    )
+
+def create_pivot_table(df: pd.DataFrame, config: Dict, dataset_version: Optional[str] = None,
+                       progress: Optional[Callable[[float, str], None]] = None,
+                       selection: Optional[RowSelection] = None) -> Dict:
+    """Create pivot table based on configuration.
+    
+    df must hold every row of the dataset: the returned selection refers to
+    rows by position. Pass dataset_version so that filter masks can be
+    cached across calls, and progress to be told (fraction, stage) as the
+    work advances; a progress callback may stop the work by raising
+    JobCancelled. A selection already computed for the config's filters
+    skips filtering.
+    """
+    if progress is None:
+        progress = lambda fraction, stage: None
+    try:
+        # Apply filters first; the result keeps only which rows passed
+        if selection is None:
+            progress(0.0, 'Filtering')
+            with STAGE_SECONDS.time('create_pivot_table', 'filter'):
+                selection = RowSelection(filter_mask(df, config.get('filters', []), dataset_version), len(df),
+                                         dataset_version)
+        
+        if len(selection) == 0:
+            return {
+                'success': False,
+                'error': 'No data after applying filters',
+                'pivot_df': None,
+                'selection': selection
+            }
+        
+        # Prepare aggregation dictionary
+        agg_dict = {}
+        for item in config.get('value_agg_list', []):
+            if item.get('value_col'):
+                agg_dict[item['value_col']] = item.get('agg_func', 'sum')
+        
+        if not agg_dict:
+            return {
+                'success': False,
+                'error': 'No value columns specified',
+                'pivot_df': None,
+                'selection': selection
+            }
+        
+        # Create pivot table
+        progress(0.3, 'Pivoting')
+        with STAGE_SECONDS.time('create_pivot_table', 'take'):
+            rows = selection.take(df)
+        with STAGE_SECONDS.time('create_pivot_table', 'pivot_table'):
+            pivot_df = pivot_frame(rows, config, agg_dict)
+        
+        return {
+            'success': True,
+            'pivot_df': pivot_df,
+            'selection': selection,
+            'error': None
+        }
+        
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'pivot_df': None,
+            'selection': None
+        }
+
+# Rollup cube: counts, sums, mins and maxes of a few measure columns per
+# combination of a few low-cardinality dimensions (columns or date buckets),
+# built once per dataset. Pivots whose groupings, filters and
+# aggregations fit inside it are rolled up from the cube without scanning rows.
+# Dimensions, e.g. "Extra2,Extra5,ScheduledOn@month"; empty disables the cube
+CUBE_DIMENSIONS = [d.strip() for d in os.environ.get('PIVOT_CUBE_DIMENSIONS', '').split(',') if d.strip()]
+# Columns whose count (and, for numbers and dates, sum/min/max) the cube stores
+CUBE_MEASURES = [m.strip() for m in os.environ.get('PIVOT_CUBE_MEASURES', '').split(',') if m.strip()]
+# Dimensions with more distinct values than this are left out of the cube
+CUBE_MAX_DISTINCT = 1000
+# A cube with more rows than this fraction of the dataset's is not kept
+CUBE_MAX_ROW_FRACTION = 0.25
+# How a cube cell's aggregate rolls up into a coarser cell, per pivot aggregation
+CUBE_ROLLUPS = {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+
+class RollupCube:
+    """Aggregates of the measure columns per distinct combination of dimension values.
+    
+    A dimension is a column name, or "column@bucket" for the buckets of a date
+    column. Rows with missing dimension values keep their own cells, so any
+    subset of the dimensions rolls up to exactly what the rows would give.
+    """
+    def __init__(self, frame: pd.DataFrame, columns: List[str], dimensions: List[str],
+                 aggregates: Dict[Tuple[str, str], str], dates_only: Dict[str, bool]):
+        self.frame = frame
+        self.columns = set(columns)  # every column of the dataset
+        self.dimensions = dimensions
+        self.aggregates = aggregates  # (measure column, aggregation): cube column
+        self.dates_only = dates_only  # bucketed date column: whether it holds no times of day
+        self._nbytes = None
+    
+    @classmethod
+    def build(cls, dataset: 'Dataset', dimensions: List[str], measures: List[str],
+              progress: Optional[Callable[[float, str], None]] = None) -> Optional['RollupCube']:
+        """Cube of a dataset, None when no dimension applies or the cube would
+        not be much smaller than the data"""
+        if progress is None:
+            progress = lambda fraction, stage: None
+        n_rows = dataset.shape[0]
+        data = {}
+        dates_only = {}
+        for i, dimension in enumerate(dict.fromkeys(dimensions)):
+            col, bucket = split_bucket(dimension)
+            if col not in dataset.schema:
+                continue
+            progress(0.5 * i / len(dimensions), f'Converting {col}')
+            if bucket:
+                dates = dataset.column(col)
+                if not pd.api.types.is_datetime64_any_dtype(dates):
+                    print(f"Error building cube: {dimension} is not a date bucket")
+                    continue
+                values = dates.dropna()
+                dates_only[col] = bool((values == values.dt.normalize()).all())
+            series = dataset.column(dimension)
+            if series.nunique() > CUBE_MAX_DISTINCT:
+                print(f"Cube dimension {dimension} has more than {CUBE_MAX_DISTINCT} values; left out")
+                continue
+            data[dimension] = series.rename(dimension)
+        kept = list(data)
+        if not kept:
+            return None
+        
+        # Measures get their own frame columns, as a measure may also be a dimension
+        named = {}
+        for i, col in enumerate(dict.fromkeys(m for m in measures if m in dataset.schema)):
+            progress(0.5, f'Converting {col}')
+            series = dataset.column(col)
+            data[f'measure {i}'] = series
+            named[(col, 'count')] = (f'measure {i}', 'count')
+            is_date = pd.api.types.is_datetime64_any_dtype(series)
+            is_number = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+            if is_number:
+                named[(col, 'sum')] = (f'measure {i}', 'sum')
+            if is_number or is_date:
+                named[(col, 'min')] = (f'measure {i}', 'min')
+                named[(col, 'max')] = (f'measure {i}', 'max')
+        aggregates = {key: f'{key[1]}({key[0]})' for key in named}
+        
+        progress(0.6, 'Aggregating')
+        frame = pd.DataFrame(data, copy=False)
+        grouped = frame.groupby(kept, dropna=False, sort=False, observed=True)
+        if named:
+            cube = grouped.agg(**{aggregates[key]: spec for key, spec in named.items()})
+        else:
+            cube = grouped.size().to_frame('rows')
+        cube = cube.reset_index()
+        if len(cube) > CUBE_MAX_ROW_FRACTION * n_rows:
+            print(f"Cube of {len(cube)} cells for {n_rows} rows not kept")
+            return None
+        return cls(cube, dataset.columns, kept, aggregates, dates_only)
+    
+    @property
+    def nbytes(self) -> int:
+        if self._nbytes is None:
+            self._nbytes = frame_nbytes(self.frame)
+        return self._nbytes
+    
+    def filter_target(self, f: Dict) -> Optional[Tuple[str, Dict]]:
+        """Cube column and filter that select the same cells as the filter
+        selects rows, None when the cube cannot tell"""
+        col, op = f['column'], f['operator']
+        if col in self.dimensions:
+            return col, f
+        # A range filter on a bucketed date fits when it splits no period
+        buckets = [d for d in self.dimensions if d != col and split_bucket(d)[0] == col]
+        if not buckets or op not in RANGE_OPERATORS:
+            return None
+        try:
+            target = pd.Timestamp(pd.to_datetime(f.get('value', '')))
+        except (ValueError, TypeError):
+            return None
+        if pd.isna(target):
+            return None
+        if op in ('<=', '>'):
+            # Up to the end of the target day, for dates without times of day
+            if not self.dates_only.get(col) or target != target.normalize():
+                return None
+            target += pd.Timedelta(days=1)
+            op = '<' if op == '<=' else '>='
+        for dimension in buckets:
+            bucket = split_bucket(dimension)[1]
+            number = period_numbers(np.array([target.to_datetime64()]), bucket)
+            if pd.Timestamp(period_starts(number, bucket)[0]) == target:
+                return dimension, {**f, 'operator': op, 'value': period_labels(number, bucket)[0]}
+        return None
+    
+    def select(self, filters: List[Dict]) -> Optional[pd.DataFrame]:
+        """Cells passing the filters, None when a filter does not fit the cube"""
+        mask = None
+        for f in filters:
+            if not f.get('column') or not f.get('operator') or split_bucket(f['column'])[0] not in self.columns:
+                continue
+            target = self.filter_target(f)
+            if target is None:
+                return None
+            column, f = target
+            try:
+                predicate = compile_filter(f, self.frame[column])
+                if predicate is None:
+                    continue
+                hits = predicate(self.frame[column])
+            except Exception:
+                return None  # the row scan reports the error
+            mask = hits if mask is None else mask & hits
+        return self.frame if mask is None else self.frame[mask]
+
+def rollup_pivot_table(cube: RollupCube, config: Dict) -> Optional[Dict]:
+    """Pivot table rolled up from the cube, in the form create_pivot_table
+    returns; None when the pivot does not fit inside the cube.
+    
+    The result has no row selection: the rows are never looked at.
+    """
+    groups = config.get('index_cols', []) + config.get('column_cols', [])
+    if not groups or any(col not in cube.dimensions for col in groups):
+        return None
+    agg_dict = {}
+    for item in config.get('value_agg_list', []):
+        if item.get('value_col'):
+            agg_dict[item['value_col']] = item.get('agg_func', 'sum')
+    if not agg_dict or any(col in groups or (col, func) not in cube.aggregates
+                           for col, func in agg_dict.items()):
+        return None
+    
+    with STAGE_SECONDS.time('rollup_pivot_table', 'filter'):
+        cells = cube.select(config.get('filters', []))
+    if cells is None:
+        return None
+    if not len(cells):
+        return {'success': False, 'error': 'No data after applying filters', 'pivot_df': None, 'selection': None}
+    
+    # Each value column holds the cells' aggregates, rolled up as a pivot of the cells
+    data = {col: cells[col] for col in groups}
+    data.update({col: cells[cube.aggregates[(col, func)]] for col, func in agg_dict.items()})
+    try:
+        with STAGE_SECONDS.time('rollup_pivot_table', 'pivot_table'):
+            pivot_df = pivot_frame(pd.DataFrame(data, copy=False), config,
+                                   {col: CUBE_ROLLUPS[func] for col, func in agg_dict.items()})
+    except Exception:
+        return None
+    return {'success': True, 'pivot_df': pivot_df, 'selection': None, 'error': None}
+
+def generate_python_code(config: Dict, schema: Optional[Dict] = None) -> str:
+    """Generate Python code for the pivot configuration"""
+    code_lines = [
+        "import pandas as pd",
+        "",
+        "# Load your data",
+        "df = pd.read_csv('your_file.csv', low_memory=False)",
+        "",
+        "# Process data (date parsing, etc.)",
+    ]
+    used_cols = [split_bucket(col)[0] for col in config_columns(config)]
+    date_formats = {col: s['format'] for col, s in (schema or {}).items()
+                    if col in used_cols and s.get('type') == 'datetime' and s.get('format')}
+    if date_formats:
+        code_lines.append(f"date_formats = {date_formats!r}")
+        code_lines.extend([
+            "for col, fmt in date_formats.items():",
+            f"    df[col] = pd.to_datetime(df[col].replace({INVALID_DATES!r}, pd.NA), format=fmt, errors='coerce')",
+            ""
+        ])
+    else:
+        code_lines.extend([
+            "for col in df.columns:",
+            "    if df[col].dtype == object:",
+            "        df[col] = df[col].replace('0000-00-00', pd.NA)",
+            "        try:",
+            "            df[col] = pd.to_datetime(df[col])",
+            "        except Exception:",
+            "            pass",
+            ""
+        ])
+    
+    # Date buckets, labelled as the app labels them
+    buckets = [col for col in config_columns(config) if split_bucket(col)[1] and col not in (schema or {})]
+    if buckets:
+        code_lines.append("# Date buckets")
+        for col in buckets:
+            base, bucket = split_bucket(col)
+            if bucket == 'quarter':
+                code_lines.append(f"df[{col!r}] = df[{base!r}].dt.to_period('Q').dt.strftime('%Y-Q%q')")
+            else:
+                code_lines.append(f"df[{col!r}] = df[{base!r}].dt.strftime({BUCKET_FORMATS[bucket]!r})")
+        code_lines.append("")
+    
+    # Add filters
+    if config.get('filters'):
+        code_lines.append("# Apply filters")
+        for f in config['filters']:
+            if f.get('column') and f.get('operator') and f.get('value'):
+                col = f['column']
+                op = f['operator']
+                value = f['value']
+                
+                if op == '==':
+                    code_lines.append(f"df = df[df['{col}'] == '{value}']")
+                elif op == '!=':
+                    code_lines.append(f"df = df[df['{col}'] != '{value}']")
+                elif op == 'contains':
+                    code_lines.append(f"df = df[df['{col}'].str.contains('{value}', na=False)]")
+                # Add more operators as needed
+        code_lines.append("")
+    
+    # Add pivot table creation
+    agg_dict = {}
+    for item in config.get('value_agg_list', []):
+        if item.get('value_col'):
+            agg_dict[item['value_col']] = item.get('agg_func', 'sum')
+    
+    index_cols = list(config.get('index_cols', []))
+    column_cols = list(config.get('column_cols', []))
+    fill_value = config.get('custom_fill_value') if config.get('fill_value_enabled') else None
+    margins = config.get('margins_enabled', False)
+    subtotals = config.get('subtotals_enabled', False) and len(index_cols) > 1
+    name = config.get('margins_name', 'All_Totals')
+    if not (margins or subtotals):
+        code_lines.extend([
+            "# Create pivot table",
+            "pivot_df = pd.pivot_table(",
+            "    df,",
+            f"    values={list(agg_dict.keys())},",
+            f"    index={index_cols},",
+            f"    columns={column_cols},",
+            f"    aggfunc={agg_dict},",
+            f"    fill_value={fill_value!r}",
+            ")",
+            ""
+        ])
+        code_lines.append("print(pivot_df)")
+        return "\n".join(code_lines)
+    
+    # Totals as the app computes them: over every row whose row and column
+    # fields are set, also rows missing a value (which dropna=True leaves out)
+    code_lines.extend([
+        "# Create pivot table with totals over every row whose row and column fields are set",
+        f"df = df.dropna(subset={index_cols + column_cols})",
+        "def pivot(index):",
+        "    return pd.pivot_table(",
+        "        df,",
+        f"        values={list(agg_dict.keys())},",
+        "        index=index,",
+        f"        columns={column_cols},",
+        f"        aggfunc={agg_dict},",
+        f"        margins={margins},",
+        f"        margins_name={name!r},",
+        "        dropna=False",
+        "    ).dropna(how='all').dropna(how='all', axis=1)",
+        "",
+    ])
+    if index_cols:
+        code_lines.append(f"pivot_df = pivot({index_cols})")
+    else:
+        # pivot_table repeats the total after every column; the app has one total column
+        total = name if len(column_cols) == 1 else (name,) + ('',) * (len(column_cols) - 1)
+        code_lines.extend([
+            f"pivot_df = df.groupby({column_cols}).agg({agg_dict}).dropna(how='all').sort_index(axis=1)",
+            f"pivot_df = pivot_df.fillna({fill_value!r}).T" if fill_value is not None else "pivot_df = pivot_df.T",
+            f"pivot_df[{total!r}] = df.agg({agg_dict})" if margins else None,
+            "pivot_df = pivot_df.dropna(how='all', axis=1)",
+        ])
+        code_lines = [line for line in code_lines if line is not None]
+    if subtotals:
+        depth = len(index_cols)
+        code_lines.extend([
+            "",
+            "# Subtotals: a row after each group of every outer row field",
+            "body = [key for key in pivot_df.index if key[0] != " + repr(name) + "]",
+            "parts = [pivot_df]",
+            f"for depth in range({depth - 1}, 0, -1):",
+            f"    sub = pivot({index_cols}[:depth])",
+            f"    sub = sub[sub.index.get_level_values(0) != {name!r}]",
+            "    keys = [key if isinstance(key, tuple) else (key,) for key in sub.index]",
+            f"    sub.index = pd.MultiIndex.from_tuples([key + ({name!r},) + ('',) * ({depth} - depth - 1) for key in keys])",
+            "    parts.append(sub)",
+            "order = []",
+            "for i, key in enumerate(body):",
+            "    order.append(key)",
+            "    following = body[i + 1] if i + 1 < len(body) else None",
+            f"    order += [key[:depth] + ({name!r},) + ('',) * ({depth} - depth - 1) for depth in range({depth - 1}, 0, -1)",
+            "              if following is None or following[:depth] != key[:depth]]",
+            "order += [key for key in pivot_df.index if key[0] == " + repr(name) + "]",
+            "pivot_df = pd.concat(parts).reindex(index=pd.MultiIndex.from_tuples(order, names=pivot_df.index.names),",
+            "                                    columns=pivot_df.columns)",
+        ])
+    if fill_value is not None:
+        code_lines.append(f"pivot_df = pivot_df.fillna({fill_value!r})")
+    code_lines.append("")
+    code_lines.append("print(pivot_df)")
+    
+    return "\n".join(code_lines)
+
+# Result caching
+# Memory budget of the pivot result cache, shared by all sessions
+PIVOT_CACHE_MAX_BYTES = int(os.environ.get('PIVOT_CACHE_MAX_MB', '512')) * 1024 * 1024
+
+def frame_nbytes(obj) -> int:
+    """Approximate memory held by a DataFrame/Series/RowSelection (0 for anything else)"""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    if isinstance(obj, RowSelection):
+        return obj.nbytes
+    return 0
+
+def result_nbytes(result: Dict) -> int:
+    """Approximate memory held by a create_pivot_table result"""
+    return sum(frame_nbytes(v) for v in result.values())
+
+class LRUCache:
+    """Least-recently-used cache bounded by the total size of its entries"""
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int]):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # key: (value, size)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+pivot_cache = LRUCache(PIVOT_CACHE_MAX_BYTES, result_nbytes)
+
+# Memory budget of the per-filter mask cache (packed bitmaps, one bit per row)
+MASK_CACHE_MAX_BYTES = int(os.environ.get('PIVOT_MASK_CACHE_MAX_MB', '128')) * 1024 * 1024
+mask_cache = LRUCache(MASK_CACHE_MAX_BYTES, lambda packed: packed.nbytes)
+
+# Memory budget of the row order cache (filtered and/or sorted row positions)
+ROW_ORDER_CACHE_MAX_BYTES = int(os.environ.get('PIVOT_ROW_ORDER_CACHE_MAX_MB', '128')) * 1024 * 1024
+row_order_cache = LRUCache(ROW_ORDER_CACHE_MAX_BYTES, lambda positions: positions.nbytes)
+
+# Distinct value indexes
+# Memory budget of the value index cache (per-row codes and sorted distinct values)
+VALUE_INDEX_CACHE_MAX_BYTES = int(os.environ.get('PIVOT_VALUE_INDEX_CACHE_MAX_MB', '128')) * 1024 * 1024
+# Text columns with more distinct values than this are not indexed
+VALUE_INDEX_MAX_DISTINCT = 65_536
+# Filter operators answered from a value index when the column has one
+INDEXED_OPERATORS = ('==', '!=', 'in', 'not_in')
+
+class ValueIndex:
+    """Sorted dictionary of a text column's distinct values, with a code per row.
+    
+    Values are ordered case-insensitively, so finding the values starting with
+    a prefix takes two binary searches. The codes let equality and membership
+    filters compare small integers instead of strings.
+    """
+    def __init__(self, series: pd.Series):
+        codes, uniques = pd.factorize(series)
+        labels = np.array([str(value) for value in uniques], dtype=str)
+        keys = np.array([label.casefold() for label in labels], dtype=str)
+        order = np.argsort(keys, kind='stable')
+        self.labels = labels[order]
+        self.keys = keys[order]
+        self.lookup = {label: code for code, label in enumerate(self.labels.tolist())}
+        # rank[-1] maps missing values (code -1) to -1
+        rank = np.empty(len(order) + 1, dtype=np.int32 if len(order) >= 2 ** 15 else np.int16)
+        rank[order] = np.arange(len(order))
+        rank[-1] = -1
+        self.codes = rank[codes]
+        self.counts = np.bincount(self.codes[self.codes >= 0], minlength=len(order))
+    
+    @classmethod
+    def build(cls, series: pd.Series) -> Optional['ValueIndex']:
+        """Index of a text or categorical column, None for other columns or
+        too many distinct values"""
+        if not (is_text_dtype(series.dtype) or isinstance(series.dtype, pd.CategoricalDtype)):
+            return None
+        if series.nunique() > VALUE_INDEX_MAX_DISTINCT:
+            return None
+        return cls(series)
+    
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.labels.nbytes + self.keys.nbytes + self.counts.nbytes
+    
+    def search(self, prefix: str) -> Tuple[int, int]:
+        """Range of sorted positions of the values starting with prefix (any case)"""
+        key = prefix.casefold()
+        start = int(np.searchsorted(self.keys, key, side='left'))
+        stop = int(np.searchsorted(self.keys, key + '\U0010ffff', side='left'))
+        return start, stop
+    
+    def equals(self, value) -> np.ndarray:
+        code = self.lookup.get(value) if isinstance(value, str) else None
+        if code is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+    
+    def isin(self, values: List) -> np.ndarray:
+        member = np.zeros(len(self.labels) + 1, dtype=bool)  # last slot: missing values
+        member[[self.lookup[v] for v in values if isinstance(v, str) and v in self.lookup]] = True
+        return member[self.codes]
+
+value_index_cache = LRUCache(VALUE_INDEX_CACHE_MAX_BYTES, lambda index: index.nbytes())
+
+# Sampled previews: estimates of a pivot from a stratified sample of the rows,
+# shown while the exact pivot is computed
+# Rows drawn for a sample, and the dataset size from which pivots get previews
+PREVIEW_SAMPLE_ROWS = int(os.environ.get('PIVOT_PREVIEW_SAMPLE_ROWS', '100000'))
+PREVIEW_MIN_ROWS = int(os.environ.get('PIVOT_PREVIEW_MIN_ROWS', '1000000'))
+# Memory budget of the sample cache (sampled rows of the columns previews used)
+SAMPLE_CACHE_MAX_BYTES = int(os.environ.get('PIVOT_SAMPLE_CACHE_MAX_MB', '128')) * 1024 * 1024
+# A strata column with more distinct values than this gives a uniform sample
+PREVIEW_MAX_STRATA = 1000
+# Rows drawn from each stratum at least (all rows of smaller strata)
+PREVIEW_MIN_STRATUM_ROWS = 30
+# Aggregations a preview can estimate; other pivots wait for the exact result
+PREVIEW_AGGREGATIONS = ('count', 'size', 'sum', 'mean', 'min', 'max')
+# Normal quantile of the error bounds (95% confidence intervals)
+PREVIEW_Z = 1.96
+
+class StratifiedSample:
+    """Rows drawn at random from each stratum (distinct value of one column).
+    
+    Strata contribute rows in proportion to their size, but at least
+    PREVIEW_MIN_STRATUM_ROWS, so small groups are still estimated (exactly,
+    when drawn whole). A drawn row stands for weight rows of its stratum.
+    The sampled rows of a column are converted the first time it is used.
+    """
+    def __init__(self, dataset: 'Dataset', strata: Optional[str], target: Optional[int] = None):
+        n_rows = dataset.shape[0]
+        target = target or PREVIEW_SAMPLE_ROWS
+        codes = np.zeros(n_rows, dtype=np.intp)
+        if strata is not None:
+            # Stratifying by the uploaded text needs no conversion
+            values, _ = pd.factorize(dataset.stored(strata), use_na_sentinel=False)
+            if values.max(initial=0) < PREVIEW_MAX_STRATA:
+                codes = values
+        sizes = np.bincount(codes, minlength=1)
+        drawn = np.minimum(sizes, np.maximum(PREVIEW_MIN_STRATUM_ROWS,
+                                             np.round(sizes * target / max(n_rows, 1)).astype(np.int64)))
+        # Order rows by stratum, at random within each, and keep each stratum's first rows
+        order = np.lexsort((np.random.default_rng(0).random(n_rows), codes))
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        ranks = np.arange(n_rows) - starts[codes[order]]
+        self.positions = np.sort(order[ranks < drawn[codes[order]]])
+        self.strata = codes[self.positions].astype(np.int32)
+        self.sizes = sizes  # rows per stratum
+        self.drawn = drawn  # sampled rows per stratum
+        self.weights = (sizes / np.maximum(drawn, 1))[self.strata]
+        self._columns = {}  # col: the sampled rows, typed
+        self._lock = threading.Lock()
+    
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            columns = list(self._columns.values())
+        return (self.positions.nbytes + self.strata.nbytes + self.weights.nbytes
+                + sum(frame_nbytes(series) for series in columns))
+    
+    def frame(self, dataset: 'Dataset', columns: List[str]) -> pd.DataFrame:
+        """The sampled rows of the given columns, typed"""
+        with self._lock:
+            missing = [col for col in dict.fromkeys(columns) if col not in self._columns]
+        if missing:
+            rows = dataset.rows(self.positions, missing)
+            with self._lock:
+                for col in missing:
+                    self._columns.setdefault(col, rows[col])
+        with self._lock:
+            data = {col: self._columns[col] for col in dict.fromkeys(columns)}
+        return pd.DataFrame(data, index=dataset.index.take(self.positions), copy=False)
+    
+    def variance(self, z: pd.DataFrame, keys: List[pd.Series], rows: np.ndarray) -> pd.DataFrame:
+        """Variance of the estimated totals of each column of z (one value per
+        sampled row in rows, 0 for rows outside the cell) for every cell of keys.
+        
+        Sums the stratified estimator's variance over strata, with the finite
+        population correction; strata drawn whole contribute nothing.
+        """
+        strata = pd.Series(self.strata[rows], index=z.index, name='__stratum__')
+        grouped = pd.concat([z, z * z], axis=1, keys=['s1', 's2']).groupby(keys + [strata], observed=True)
+        sums = grouped.sum()
+        drawn = self.drawn[sums.index.get_level_values(-1)].astype(float)
+        sizes = self.sizes[sums.index.get_level_values(-1)].astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = np.where(drawn > 1, sizes ** 2 * (1 - drawn / sizes) / (drawn * (drawn - 1)), 0.0)
+        terms = (sums['s2'] - sums['s1'] ** 2 / drawn[:, None]) * factor[:, None]
+        return terms.groupby(level=list(range(len(keys))), observed=True).sum()
+
+sample_cache = LRUCache(SAMPLE_CACHE_MAX_BYTES, lambda sample: sample.nbytes)
+
+def sampled_rows(dataset: 'Dataset', strata: Optional[str],
+                 columns: List[str]) -> Tuple[StratifiedSample, pd.DataFrame]:
+    """The dataset's sample stratified by a column (drawn once) and its typed rows"""
+    key = (dataset.version, strata)
+    sample = sample_cache.get(key)
+    if sample is None:
+        sample = StratifiedSample(dataset, strata)
+    rows = sample.frame(dataset, columns)
+    # Stored again, so the cache accounts for the columns converted since
+    sample_cache.put(key, sample)
+    return sample, rows
+
+def preview_pivot_table(dataset: 'Dataset', config: Dict,
+                        progress: Optional[Callable[[float, str], None]] = None) -> Optional[Dict]:
+    """Estimate of a pivot table from a stratified sample of the rows.
+    
+    Returns what create_pivot_table does plus 'error_bounds': a frame laid
+    out like the pivot holding the half-width of each count, size, sum and
+    mean's 95% confidence interval (min and max are the sample's). Counts,
+    sizes and sums are scaled up to the whole dataset. The sample is
+    stratified by the pivot's first grouping column. None when the dataset
+    is too small for previews or the pivot asks for what a sample cannot
+    estimate (totals, other aggregations).
+    """
+    if progress is None:
+        progress = lambda fraction, stage: None
+    if (dataset.shape[0] < PREVIEW_MIN_ROWS or config.get('margins_enabled', False)
+            or config.get('subtotals_enabled', False)):
+        return None
+    index_cols, column_cols = config.get('index_cols', []), config.get('column_cols', [])
+    groups = index_cols + column_cols
+    agg_dict = {}
+    for item in config.get('value_agg_list', []):
+        if item.get('value_col'):
+            agg_dict[item['value_col']] = item.get('agg_func', 'sum')
+    if (not groups or not agg_dict or any(not dataset.has_column(col) for col in groups + list(agg_dict))
+            or any(col in groups or func not in PREVIEW_AGGREGATIONS for col, func in agg_dict.items())):
+        return None
+    
+    progress(0.0, 'Sampling')
+    columns = [col for col in config_columns(config) if dataset.has_column(col)]
+    sample, rows = sampled_rows(dataset, groups[0], columns)
+    progress(0.5, 'Estimating')
+    mask = filter_mask(rows, config.get('filters', []))
+    kept = np.flatnonzero(mask) if mask is not None else np.arange(len(rows))
+    if not len(kept):
+        return None  # rare rows may pass; only the exact pivot can tell
+    rows = rows.take(kept)
+    weights = pd.Series(sample.weights[kept], index=rows.index)
+    keys = [rows[col] for col in groups]
+    
+    def pivot(values: Dict[str, pd.Series], aggfunc) -> pd.DataFrame:
+        frame = pd.DataFrame({**{col: rows[col] for col in groups}, **values}, copy=False)
+        return pd.pivot_table(frame, values=list(values), index=index_cols or None,
+                              columns=column_cols or None, aggfunc=aggfunc, observed=True)
+    
+    try:
+        # Per value: what each sampled row adds to its cell's estimate, unweighted (z)
+        estimated, z, means = {}, {}, {}
+        for col, func in agg_dict.items():
+            series = rows[col]
+            present = series.notna().astype(float)
+            if func in ('min', 'max'):
+                estimated[col] = series
+                continue
+            if func == 'size':
+                z[col] = pd.Series(1.0, index=rows.index)
+            elif func == 'count':
+                z[col] = present
+            else:
+                z[col] = pd.Series(series.to_numpy(dtype=float, na_value=np.nan), index=rows.index).fillna(0.0)
+            estimated[col] = weights * z[col]
+            if func == 'mean':
+                # Ratio of the estimated sum to the estimated count, linearized for its variance
+                means[col] = weights * present
+                total = estimated[col].groupby(keys, observed=True).transform('sum')
+                count = means[col].groupby(keys, observed=True).transform('sum')
+                z[col] = (present * (z[col] - total / count) / count).fillna(0.0)
+        
+        pivot_df = pivot(estimated, {col: 'min' if func == 'min' else 'max' if func == 'max' else 'sum'
+                                     for col, func in agg_dict.items()})
+        if means:
+            counts = pivot(means, 'sum')
+            for key in counts.columns:
+                pivot_df[key] = pivot_df[key] / counts[key]
+        for col, func in agg_dict.items():
+            if func in ('count', 'size'):
+                for key in pivot_df.columns:
+                    if key == col or (isinstance(key, tuple) and key[0] == col):
+                        pivot_df[key] = pivot_df[key].round()
+        
+        bounds = pd.DataFrame(np.nan, index=pivot_df.index, columns=pivot_df.columns)
+        if z:
+            variances = sample.variance(pd.DataFrame(z), keys, kept).reset_index()
+            variances.columns = groups + list(z)
+            spread = pd.pivot_table(variances, values=list(z), index=index_cols or None,
+                                    columns=column_cols or None, aggfunc='sum', observed=True)
+            bounds = (PREVIEW_Z * np.sqrt(spread.clip(lower=0))).reindex(index=pivot_df.index,
+                                                                        columns=pivot_df.columns)
+    except Exception as e:
+        print(f"Error previewing pivot: {e}")
+        return None
+    
+    if config.get('fill_value_enabled'):
+        pivot_df = pivot_df.fillna(config.get('custom_fill_value'))
+    return {'success': True, 'pivot_df': pivot_df, 'selection': None, 'error': None, 'error_bounds': bounds}
+
+# Every server-side cache, by the name its statistics are reported under
+CACHES = {
+    'pivot_results': pivot_cache,
+    'filter_masks': mask_cache,
+    'row_orders': row_order_cache,
+    'value_indexes': value_index_cache,
+    'samples': sample_cache
+}
+
+def value_index(dataset: 'Dataset', col: str) -> Optional[ValueIndex]:
+    """A column's value index, built (and the column converted) on first use"""
+    key = (dataset.version, col)
+    index = value_index_cache.get(key)
+    if index is None:
+        index = ValueIndex.build(dataset.column(col))
+        if index is not None:
+            value_index_cache.put(key, index)
+    return index
+
+def canonical_pivot_config(config: Dict) -> Dict:
+    """The parts of a pivot configuration that determine its result.
+    
+    Names, ids, timestamps and incomplete filters are left out, and filters
+    are sorted since they are ANDed together.
+    """
+    filters = [{'column': f['column'], 'operator': f['operator'], 'value': f.get('value', '')}
+               for f in config.get('filters', []) if f.get('column') and f.get('operator')]
+    filters.sort(key=lambda f: json.dumps(f, sort_keys=True, default=str))
+    
+    agg_dict = {}
+    for item in config.get('value_agg_list', []):
+        if item.get('value_col'):
+            agg_dict[item['value_col']] = item.get('agg_func', 'sum')
+    
+    margins = bool(config.get('margins_enabled', False))
+    subtotals = bool(config.get('subtotals_enabled', False))
+    return {
+        'filters': filters,
+        'index_cols': list(config.get('index_cols') or []),
+        'column_cols': list(config.get('column_cols') or []),
+        'aggs': list(agg_dict.items()),
+        'fill_value': config.get('custom_fill_value') if config.get('fill_value_enabled') else None,
+        'margins': margins,
+        'subtotals': subtotals,
+        'margins_name': config.get('margins_name', 'All_Totals') if margins or subtotals else None
+    }
+
+def pivot_cache_key(dataset_version: str, config: Dict) -> str:
+    """Content address of a pivot result: dataset version plus normalized config"""
+    canonical = json.dumps(canonical_pivot_config(config), sort_keys=True, default=str)
+    return f"{dataset_version}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+# Session memory management
+MEMORY_BUDGET_BYTES = int(os.environ.get('PIVOT_MEMORY_BUDGET_MB', '2048')) * 1024 * 1024
+SESSION_TTL_SECONDS = float(os.environ.get('PIVOT_SESSION_TTL_MINUTES', '60')) * 60
+SPILL_TTL_SECONDS = float(os.environ.get('PIVOT_SPILL_TTL_HOURS', '24')) * 3600
+SPILL_DIR = Path(os.environ.get('PIVOT_SPILL_DIR', Path(tempfile.gettempdir()) / 'pivot_codex_v5_spill'))
+MEMORY_SWEEP_SECONDS = 60
+
+# Per-pivot results held in memory alongside the configuration
+PIVOT_RESULT_KEYS = ('pivot_df', 'selection', 'error_bounds')
+
+def spill_path(suffix: str) -> Path:
+    """A new file in the spill directory (session ids come from clients, so they stay out of paths)"""
+    SPILL_DIR.mkdir(parents=True, exist_ok=True)
+    return SPILL_DIR / (uuid.uuid4().hex + suffix)
+
+class SpilledDataset:
+    """A dataset written to disk with its columns as stored (Parquet, or pickle without pyarrow)"""
+    def __init__(self, dataset: 'Dataset'):
+        self.path = spill_path('.parquet' if HAS_PYARROW else '.pkl')
+        try:
+            self.meta = dataset.to_file(self.path)
+        except Exception:
+            self.remove()
+            raise
+    
+    def nbytes(self) -> int:
+        """Disk space used"""
+        return self.path.stat().st_size if self.path.exists() else 0
+    
+    def load(self) -> 'Dataset':
+        return Dataset.from_file(self.path, **self.meta)
+    
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+
+class SpilledSession:
+    """A session's pivot results written to disk (pickle); nothing is written without results"""
+    def __init__(self, results: Dict[str, Dict]):
+        self.path = spill_path('.results.pkl') if results else None
+        try:
+            if results:
+                pd.to_pickle(results, self.path)
+        except Exception:
+            self.remove()
+            raise
+    
+    def nbytes(self) -> int:
+        """Disk space used"""
+        return self.path.stat().st_size if self.path is not None and self.path.exists() else 0
+    
+    def load(self) -> Dict[str, Dict]:
+        return pd.read_pickle(self.path) if self.path is not None else {}
+    
+    def remove(self):
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+# Result serialization
+ARROW_STREAM_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+
+def flatten_column_names(columns: pd.Index) -> List:
+    """Display names of pivot columns, joining MultiIndex levels with ' | '"""
+    if isinstance(columns, pd.MultiIndex):
+        return [' | '.join(map(str, col)).strip() for col in columns.values]
+    return columns.tolist()
+
+def select_columns(names: List, requested: Optional[List[str]]) -> List[int]:
+    """Positions of the requested (flattened) column names, all columns by default"""
+    if not requested:
+        return list(range(len(names)))
+    lookup = {str(name): i for i, name in enumerate(names)}
+    positions = []
+    for name in requested:
+        name = name.strip()
+        if not name:
+            continue
+        if name not in lookup:
+            raise KeyError(name)
+        positions.append(lookup[name])
+    return positions
+
+def order_rows(df: pd.DataFrame, names: List, sort_by: Optional[str], ascending: bool = True) -> np.ndarray:
+    """Row positions of df, sorted by one (flattened) column if requested"""
+    if not sort_by:
+        return np.arange(len(df))
+    position = select_columns(names, [sort_by])[0]
+    key = df.iloc[:, position].reset_index(drop=True)
+    return key.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+
+def json_safe_values(series: pd.Series) -> List:
+    """Column values as a JSON-serializable list (missing values become None)"""
+    return series.astype(object).where(series.notna(), None).tolist()
+
+def frame_to_arrow_stream(df: pd.DataFrame, names: List) -> bytes:
+    """Serialize a frame (index included) as an Arrow IPC stream"""
+    df = df.copy(deep=False)
+    df.columns = [str(name) for name in names]
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+# Row browsing
+# Largest window of dataset rows returned per request
+ROWS_MAX_LIMIT = 10_000
+
+def row_order_key(dataset: 'Dataset', filters: List[Dict], sort_by: Optional[str],
+                  ascending: bool) -> Optional[Tuple]:
+    """Cache key of a filtered and/or sorted row order, None for all rows in order"""
+    filters = canonical_pivot_config({'filters': filters})['filters']
+    if not filters and not sort_by:
+        return None
+    return (dataset.version, json.dumps(filters, sort_keys=True, default=str), sort_by, ascending)
+
+def compute_row_order(dataset: 'Dataset', filters: List[Dict], sort_by: Optional[str],
+                      ascending: bool) -> np.ndarray:
+    """Positions of the rows passing the filters, in sort order.
+    
+    Filters go through the same engine and mask cache as pivots; the sort is
+    stable with missing values last, like the pivot table endpoint.
+    """
+    n_rows = len(dataset.index)
+    columns = [f['column'] for f in filters if f.get('column') and dataset.has_column(f['column'])]
+    with STAGE_SECONDS.time('get_rows', 'filter'):
+        mask = filter_mask(dataset.frame(columns), filters, dataset.version) if columns else None
+        positions = np.flatnonzero(mask) if mask is not None else None
+    if sort_by:
+        key = dataset.column(sort_by)
+        if positions is not None:
+            key = key.take(positions)
+        with STAGE_SECONDS.time('get_rows', 'sort'):
+            order = key.reset_index(drop=True).sort_values(
+                ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+        positions = positions[order] if positions is not None else order
+    if positions is None:
+        positions = np.arange(n_rows)
+    return positions.astype(np.int32 if n_rows < 2 ** 31 else np.int64)
+
+# Exports
+# Rows per chunk when streaming exports
+EXPORT_CHUNK_ROWS = 50_000
+# Bytes per block when streaming a finished export file
+EXPORT_BLOCK_BYTES = 1024 * 1024
+# Largest sheet Excel can open
+XLSX_MAX_ROWS = 1_048_576
+
+EXPORT_MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def frame_chunks(df: pd.DataFrame, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Consecutive row slices of a frame (views, no copies)"""
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+def iter_csv(frames: Iterator[pd.DataFrame], index: bool,
+             date_formats: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+    """Encode frames as one CSV document, writing the header only once"""
+    header = True
+    for frame in frames:
+        if date_formats:
+            frame = frame.copy(deep=False)
+            for col, fmt in date_formats.items():
+                if col in frame.columns:
+                    frame[col] = frame[col].dt.strftime(fmt)
+        yield frame.to_csv(index=index, header=header).encode('utf-8')
+        header = False
+
+def gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Compress a byte stream incrementally into a gzip container"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_file(fh) -> Iterator[bytes]:
+    """Stream a finished temporary file from the start and close it"""
+    try:
+        fh.seek(0)
+        while True:
+            block = fh.read(EXPORT_BLOCK_BYTES)
+            if not block:
+                break
+            yield block
+    finally:
+        fh.close()
+
+def write_parquet(frames: Iterator[pd.DataFrame], index: bool):
+    """Write frames as row groups of one Parquet file; returns the (temporary) file"""
+    import pyarrow.parquet as pq
     
-    # Clean and convert date columns
-    for col in df_processed.columns:
-        if df_processed[col].dtype == object:
-            # Replace invalid dates
-            df_processed[col] = df_processed[col].replace("0000-00-00", pd.NA)
-            # Try to convert to datetime
-            try:
-                df_processed[col] = pd.to_datetime(df_processed[col], errors='ignore')
-            except Exception:
-                pass
+    fh = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    writer = None
+    try:
+        for frame in frames:
+            # Parquet wants flat string column names; pivot columns are often tuples
+            frame = frame.set_axis([str(name) for name in flatten_column_names(frame.columns)], axis=1)
+            if writer is None:
+                schema = pa.Schema.from_pandas(frame, preserve_index=index)
+                # A column that is empty in the first chunk must still accept text later
+                for i, field in enumerate(schema):
+                    if pa.types.is_null(field.type):
+                        schema = schema.set(i, field.with_type(pa.string()))
+                writer = pq.ParquetWriter(fh, schema)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=index))
+    finally:
+        if writer is not None:
+            writer.close()
+    return fh
+
+def excel_value(value):
+    """Cell value openpyxl can store (missing values become empty cells)"""
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def excel_sheet_title(name: str, used: set) -> str:
+    """Unique sheet title within Excel's 31 character limit and allowed characters"""
+    base = re.sub(r'[\[\]:*?/\\]', '_', str(name)).strip() or 'Sheet'
+    title = base[:31]
+    n = 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title = base[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(title.lower())
+    return title
+
+def write_xlsx(sheets: List[Tuple[str, Iterator[pd.DataFrame], bool]]):
+    """Write (name, frames, index) sheets into one workbook; returns the (temporary) file.
     
-    return df_processed
+    Uses openpyxl's write-only mode, which streams rows to disk.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    used_titles = set()
+    for name, frames, index in sheets:
+        ws = workbook.create_sheet(excel_sheet_title(name, used_titles))
+        rows_written = 0
+        header = True
+        for frame in frames:
+            if header:
+                names = [str(n) for n in flatten_column_names(frame.columns)]
+                index_names = [str(n) if n is not None else '' for n in frame.index.names] if index else []
+                ws.append(index_names + names)
+                header = False
+            rows_written += len(frame)
+            if rows_written >= XLSX_MAX_ROWS:
+                raise ValueError(f"Sheet '{name}' has more rows than Excel supports")
+            index_values = frame.index.tolist() if index else [None] * len(frame)
+            for label, row in zip(index_values, frame.itertuples(index=False, name=None)):
+                labels = list(label) if isinstance(label, tuple) else [label]
+                cells = (labels if index else []) + list(row)
+                ws.append([excel_value(v) for v in cells])
+    
+    fh = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    workbook.save(fh)
+    return fh
+
+def export_response(chunks: Iterator[bytes], filename: str, media_type: str,
+                    compression: Optional[str] = None) -> StreamingResponse:
+    """Stream an export as a file download, optionally gzip-compressed"""
+    if compression == 'gzip':
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        media_type = 'application/gzip'
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+# Background jobs: CPU-bound work (parsing uploads, filtering, pivoting) runs
+# in a pool of worker threads, so the event loop keeps serving other requests
+JOB_WORKERS = int(os.environ.get('PIVOT_JOB_WORKERS', str(min(4, os.cpu_count() or 1))))
+JOB_RETENTION_SECONDS = 600  # finished jobs stay queryable this long
+JOB_EVENTS_INTERVAL_SECONDS = 0.25
+JOB_FINISHED = ('done', 'failed', 'cancelled')
+
+class JobCancelled(Exception):
+    """Raised inside a job's work once the job has been cancelled"""
 
-def apply_filters(df: pd.DataFrame, filters: List[Dict]) -> pd.DataFrame:
-    """Apply filters to dataframe"""
-    filtered_df = df.copy()
+class Job:
+    """One piece of background work, its progress and its outcome"""
+    def __init__(self, kind: str, session_id: str, pivot_id: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.session_id = session_id
+        self.pivot_id = pivot_id
+        self.status = 'queued'
+        self.progress = 0.0
+        self.stage = 'Queued'
+        self.error = None
+        self.outcome = None  # JSON-friendly summary of the result
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        self._future = None  # the work, running in the pool
+        self._task = None  # awaits the work, then finishes the job on the event loop
     
-    for f in filters:
-        if not f.get('column') or not f.get('operator'):
-            continue
-            
-        col = f['column']
-        op = f['operator']
-        value = f.get('value', '')
-        
-        if col not in filtered_df.columns:
-            continue
-            
+    @property
+    def finished(self) -> bool:
+        return self.status in JOB_FINISHED
+    
+    def report(self, progress: float, stage: str):
+        """Record progress (called by the work); raises JobCancelled once cancelled"""
+        if self._cancelled.is_set():
+            raise JobCancelled()
+        self.progress = progress
+        self.stage = stage
+    
+    def cancel(self):
+        """Ask the work to stop at its next progress report (a queued job never starts)"""
+        self._cancelled.set()
+        if self.status == 'queued' and self._future is not None:
+            self._future.cancel()
+    
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'session_id': self.session_id,
+            'pivot_id': self.pivot_id,
+            'status': self.status,
+            'progress': round(self.progress, 3),
+            'stage': self.stage,
+            'error': self.error,
+            'outcome': self.outcome,
+            'created_at': datetime.fromtimestamp(self.created_at).isoformat(),
+            'finished_at': datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None
+        }
+
+class JobManager:
+    """Runs jobs in the worker pool and keeps track of them.
+    
+    Only the newest job of a pivot counts: submitting one cancels the
+    previous job of the same pivot, and a superseded job's result is
+    discarded. on_done callbacks run on the event loop, so they may touch
+    the application state.
+    """
+    def __init__(self, workers: int):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pivot-job')
+        self._jobs = {}  # job_id: Job
+        self._latest = {}  # (session_id, pivot_id): id of the newest job for that pivot
+    
+    def submit(self, job: Job, work: Callable[[Job], Any],
+               on_done: Optional[Callable[[Job], Optional[Dict]]] = None) -> Job:
+        """Start work(job) in the pool; must be called from the event loop"""
+        self._prune()
+        if job.pivot_id is not None:
+            key = (job.session_id, job.pivot_id)
+            previous = self._jobs.get(self._latest.get(key))
+            if previous is not None and not previous.finished:
+                previous.cancel()
+            self._latest[key] = job.id
+        self._jobs[job.id] = job
+        job._future = asyncio.get_running_loop().run_in_executor(self._pool, self._run, job, work)
+        job._task = asyncio.ensure_future(self._finish(job, on_done))
+        return job
+    
+    def _run(self, job: Job, work: Callable[[Job], Any]):
+        job.report(0.0, 'Starting')
+        job.status = 'running'
+        result = work(job)
+        job.report(1.0, 'Finishing')
+        return result
+    
+    async def _finish(self, job: Job, on_done: Optional[Callable[[Job], Optional[Dict]]]):
         try:
-            if op == '==':
-                if pd.api.types.is_datetime64_any_dtype(filtered_df[col]):
-                    filtered_df = filtered_df[filtered_df[col] == pd.to_datetime(value)]
-                else:
-                    filtered_df = filtered_df[filtered_df[col] == value]
-            elif op == '!=':
-                if pd.api.types.is_datetime64_any_dtype(filtered_df[col]):
-                    filtered_df = filtered_df[filtered_df[col] != pd.to_datetime(value)]
-                else:
-                    filtered_df = filtered_df[filtered_df[col] != value]
-            elif op == '>':
-                if pd.api.types.is_datetime64_any_dtype(filtered_df[col]):
-                    filtered_df = filtered_df[filtered_df[col] > pd.to_datetime(value)]
-                else:
-                    filtered_df = filtered_df[filtered_df[col] > float(value)]
-            elif op == '<':
-                if pd.api.types.is_datetime64_any_dtype(filtered_df[col]):
-                    filtered_df = filtered_df[filtered_df[col] < pd.to_datetime(value)]
-                else:
-                    filtered_df = filtered_df[filtered_df[col] < float(value)]
-            elif op == '>=':
-                if pd.api.types.is_datetime64_any_dtype(filtered_df[col]):
-                    filtered_df = filtered_df[filtered_df[col] >= pd.to_datetime(value)]
-                else:
-                    filtered_df = filtered_df[filtered_df[col] >= float(value)]
-            elif op == '<=':
-                if pd.api.types.is_datetime64_any_dtype(filtered_df[col]):
-                    filtered_df = filtered_df[filtered_df[col] <= pd.to_datetime(value)]
-                else:
-                    filtered_df = filtered_df[filtered_df[col] <= float(value)]
-            elif op == 'contains':
-                filtered_df = filtered_df[filtered_df[col].astype(str).str.contains(str(value), na=False)]
-            elif op == 'not_contains':
-                filtered_df = filtered_df[~filtered_df[col].astype(str).str.contains(str(value), na=False)]
-            elif op == 'in':
-                values = [v.strip() for v in str(value).split(',')]
-                filtered_df = filtered_df[filtered_df[col].isin(values)]
-            elif op == 'not_in':
-                values = [v.strip() for v in str(value).split(',')]
-                filtered_df = filtered_df[~filtered_df[col].isin(values)]
-                
+            job.result = await job._future
+            if on_done is not None and self.is_latest(job):
+                job.outcome = on_done(job)
+            job.status = 'done'
+            job.stage = 'Done'
+        except (JobCancelled, asyncio.CancelledError):
+            job.status = 'cancelled'
+            job.stage = 'Cancelled'
         except Exception as e:
-            print(f"Error applying filter {f}: {e}")
-            continue
+            traceback.print_exc()
+            job.status = 'failed'
+            job.stage = 'Failed'
+            job.error = str(e)
+        job.finished_at = time.time()
+    
+    def supersede(self, session_id: str, pivot_id: str):
+        """Cancel a pivot's pending job, whose result is no longer wanted"""
+        job = self._jobs.get(self._latest.pop((session_id, pivot_id), None))
+        if job is not None and not job.finished:
+            job.cancel()
+    
+    def is_latest(self, job: Job) -> bool:
+        return job.pivot_id is None or self._latest.get((job.session_id, job.pivot_id)) == job.id
+    
+    async def wait(self, job: Job) -> Job:
+        """Wait for a job to finish; the job is not cancelled if the waiter is"""
+        await asyncio.shield(job._task)
+        return job
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+    
+    def list(self, session_id: Optional[str] = None) -> List[Job]:
+        return [job for job in self._jobs.values() if session_id is None or job.session_id == session_id]
     
-    return filtered_df
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self._jobs[job_id]
+                if job.pivot_id is not None and self._latest.get((job.session_id, job.pivot_id)) == job_id:
+                    del self._latest[(job.session_id, job.pivot_id)]
+    
+    def shutdown(self):
+        for job in self._jobs.values():
+            if not job.finished:
+                job.cancel()
+        self._pool.shutdown(wait=False)
 
-def create_pivot_table(df: pd.DataFrame, config: Dict) -> Dict:
-    """Create pivot table based on configuration"""
-    try:
-        # Apply filters first
-        filtered_df = apply_filters(df, config.get('filters', []))
-        
-        if filtered_df.empty:
-            return {
-                'success': False,
-                'error': 'No data after applying filters',
-                'pivot_df': None,
-                'filtered_df': filtered_df
-            }
-        
-        # Prepare aggregation dictionary
-        agg_dict = {}
-        for item in config.get('value_agg_list', []):
-            if item.get('value_col'):
-                agg_dict[item['value_col']] = item.get('agg_func', 'sum')
-        
-        if not agg_dict:
-            return {
-                'success': False,
-                'error': 'No value columns specified',
-                'pivot_df': None,
-                'filtered_df': filtered_df
-            }
-        
-        # Create pivot table
-        pivot_df = pd.pivot_table(
-            filtered_df,
-            values=list(agg_dict.keys()),
-            index=config.get('index_cols', []) or None,
-            columns=config.get('column_cols', []) or None,
-            aggfunc=agg_dict,
-            fill_value=config.get('custom_fill_value') if config.get('fill_value_enabled') else None,
-            margins=config.get('margins_enabled', False),
-            margins_name=config.get('margins_name', 'All_Totals')
-        )
-        
+jobs = JobManager(JOB_WORKERS)
+
+# Pivot computation: cached results are applied directly, everything else
+# runs as a job
+def cached_pivot_result(session_id: str, pivot_id: str, dataset: 'Dataset', config: Dict) -> Optional[Dict]:
+    """Apply the cached result of an identical pivot over the same data, if any"""
+    result = pivot_cache.get(pivot_cache_key(dataset.version, config))
+    if result is not None:
+        jobs.supersede(session_id, pivot_id)
+        state.set_pivot_result(session_id, pivot_id, result)
+        state.schedule_memory_limits(keep=session_id)
+    return result
+
+class SharedSelection:
+    """Rows passing a filter set, computed once for every pivot that uses it"""
+    def __init__(self, dataset: 'Dataset', filters: List[Dict]):
+        self.dataset = dataset
+        self.filters = filters
+        self._lock = threading.Lock()
+        self._selection = None
+    
+    def get(self, job: Job) -> RowSelection:
+        with self._lock:
+            if self._selection is None:
+                columns = [f['column'] for f in self.filters if f.get('column') and self.dataset.has_column(f['column'])]
+                job.report(0.0, 'Filtering')
+                frame = self.dataset.frame(columns)
+                mask = filter_mask(frame, self.filters, self.dataset.version)
+                self._selection = RowSelection(mask, len(frame), self.dataset.version)
+            return self._selection
+
+def start_pivot_job(session_id: str, pivot_id: str, dataset: 'Dataset', config: Dict,
+                    shared: Optional[SharedSelection] = None) -> Job:
+    """Compute a pivot in the job pool and record the result on it when done"""
+    config = {k: v for k, v in config.items() if k not in PIVOT_RESULT_KEYS}
+    cache_key = pivot_cache_key(dataset.version, config)
+    # Generate pivot table from just the columns this pivot refers to
+    columns = [col for col in config_columns(config) if dataset.has_column(col)]
+    # Datasets loaded from disk or from another worker get their cube now
+    start_cube_job(session_id, dataset)
+    
+    def compute(job: Job) -> Dict:
+        result = rollup_pivot_table(dataset.cube, config) if dataset.cube is not None else None
+        if result is not None:
+            if result['success']:
+                pivot_cache.put(cache_key, result)
+            return result
+        selection = shared.get(job) if shared is not None else None
+        for i, col in enumerate(columns):
+            job.report(0.5 * i / len(columns), f'Converting {col}')
+            dataset.column(col)
+        result = create_pivot_table(dataset.frame(columns), config, dataset.version,
+                                    progress=lambda fraction, stage: job.report(0.5 + fraction / 2, stage),
+                                    selection=selection)
+        if result['success']:
+            pivot_cache.put(cache_key, result)
+        return result
+    
+    def finish(job: Job) -> Dict:
+        state.set_pivot_result(session_id, pivot_id, job.result)
+        state.schedule_memory_limits(keep=session_id)
+        return {'success': job.result['success'], 'error': job.result.get('error')}
+    
+    return jobs.submit(Job('pivot', session_id, pivot_id), compute, finish)
+
+async def ensure_pivot_result(session_id: str, config: Dict):
+    """Regenerate a pivot that was generated before but whose result this
+    process does not hold, e.g. because another worker computed it"""
+    if config.get('pivot_df') is not None or not config.get('generated_code'):
+        return
+    dataset = state.get_session_data(session_id)
+    if dataset is not None and cached_pivot_result(session_id, config['id'], dataset, config) is None:
+        await jobs.wait(start_pivot_job(session_id, config['id'], dataset, config))
+
+def pivot_job_response(job: Job) -> Dict:
+    """API response for a finished pivot job"""
+    if job.outcome is None:
+        error = 'Superseded by a newer update' if job.status in ('done', 'cancelled') else job.error
+        return {'success': False, 'error': error, 'cached': False, 'job_id': job.id}
+    return {**job.outcome, 'cached': False, 'job_id': job.id}
+
+# Running jobs that compute something once per dataset, by (kind, dataset version)
+dataset_jobs: Dict[Tuple[str, str], Job] = {}
+
+def start_dataset_job(kind: str, session_id: str, dataset: 'Dataset',
+                      work: Callable[[Job], Any]) -> Job:
+    """Run work for a dataset in the job pool, joining a job of the same kind
+    already running for it"""
+    for key in [key for key, job in dataset_jobs.items() if job.finished]:
+        del dataset_jobs[key]
+    job = dataset_jobs.get((kind, dataset.version))
+    if job is None:
+        job = jobs.submit(Job(kind, session_id), work)
+        dataset_jobs[(kind, dataset.version)] = job
+    return job
+
+def start_profile_job(session_id: str, dataset: 'Dataset') -> Optional[Job]:
+    """Profile a dataset in the job pool; None when it is profiled already"""
+    if dataset.profiled:
+        return None
+    return start_dataset_job('profile', session_id, dataset, lambda job: dataset.profile(job.report))
+
+def start_cube_job(session_id: str, dataset: 'Dataset') -> Optional[Job]:
+    """Build a dataset's rollup cube in the job pool; None when it is built
+    already or no cube is configured"""
+    if dataset.cubed or not CUBE_DIMENSIONS:
+        return None
+    return start_dataset_job('cube', session_id, dataset, lambda job: dataset.build_cube(job.report))
+
+# Pivot push channel: results set on a session's pivots are pushed to its
+# subscribers (GET /api/events/{session_id}) as they finish, as the whole
+# table the first time and then as the rows and cells that changed
+# Pivots with more cells than this are only announced; clients fetch them in windows
+PUSH_MAX_CELLS = 200_000
+# An idle channel gets a comment this often, so that proxies keep it open
+PUSH_KEEPALIVE_SECONDS = 15
+
+def json_cells(series: pd.Series) -> List:
+    """Column values as JSON values, dates as ISO strings"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return [None if pd.isna(value) else value.isoformat() for value in series]
+    return json_safe_values(series)
+
+class PushedTable:
+    """A pivot table as pushed on one channel, as JSON-ready row keys and cells"""
+    def __init__(self, version: int, pivot_df: pd.DataFrame, bounds: Optional[pd.DataFrame]):
+        self.version = version
+        self.columns = flatten_column_names(pivot_df.columns)
+        self.index = jsonable_encoder(pivot_df.index.tolist())
+        self.keys = [json.dumps(key) for key in self.index]
+        self.rows = [list(row) for row in zip(*(json_cells(pivot_df.iloc[:, i])
+                                                for i in range(pivot_df.shape[1])))]
+        self.bounds = None  # error bounds of a preview
+        if bounds is not None:
+            self.bounds = [list(row) for row in zip(*(json_safe_values(bounds.iloc[:, i])
+                                                      for i in range(bounds.shape[1])))]
+    
+    def full(self) -> Dict:
         return {
-            'success': True,
-            'pivot_df': pivot_df,
-            'filtered_df': filtered_df,
-            'error': None
+            'type': 'full',
+            'version': self.version,
+            'columns': self.columns,
+            'index': self.index,
+            'rows': self.rows,
+            'estimate': self.bounds is not None,
+            'error_bounds': self.bounds,
+            'total_rows': len(self.rows)
         }
-        
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e),
-            'pivot_df': None,
-            'filtered_df': None
+    
+    def delta(self, previous: 'PushedTable') -> Optional[Dict]:
+        """The rows added and removed and the cells changed since previous;
+        None when the whole table is about as small (or either is a preview)"""
+        if previous.columns != self.columns or self.bounds is not None or previous.bounds is not None:
+            return None
+        before = dict(zip(previous.keys, previous.rows))
+        current = set(self.keys)
+        changed, added, size = [], [], 0
+        for key, index, row in zip(self.keys, self.index, self.rows):
+            old = before.get(key)
+            if old is None:
+                added.append([index, row])
+                size += len(row)
+            elif old != row:
+                cells = [[i, value] for i, (was, value) in enumerate(zip(old, row)) if was != value]
+                changed.append([index, cells])
+                size += len(cells)
+        if size * 2 > len(self.rows) * len(self.columns):
+            return None
+        message = {
+            'type': 'delta',
+            'base_version': previous.version,
+            'version': self.version,
+            'changed': changed,  # [row key, [[column position, value], ...]]
+            'added': added,  # [row key, row], appended in order
+            'removed': [index for key, index in zip(previous.keys, previous.index) if key not in current],
+            'total_rows': len(self.rows)
         }
+        # Rows move only when the pivot's row order changed
+        added_keys = [json.dumps(index) for index, _ in added]
+        if [key for key in previous.keys if key in current] + added_keys != self.keys:
+            message['index'] = self.index
+        return message
 
-def generate_python_code(config: Dict) -> str:
-    """Generate Python code for the pivot configuration"""
-    code_lines = [
-        "import pandas as pd",
-        "",
-        "# Load your data",
-        "df = pd.read_csv('your_file.csv')",
-        "",
-        "# Process data (date parsing, etc.)",
-        "for col in df.columns:",
-        "    if df[col].dtype == object:",
-        "        df[col] = df[col].replace('0000-00-00', pd.NA)",
-        "        try:",
-        "            df[col] = pd.to_datetime(df[col], errors='ignore')",
-        "        except Exception:",
-        "            pass",
-        ""
-    ]
+def push_message(pivot_id: str, config: Dict, previous: Optional[PushedTable],
+                 version: int) -> Tuple[Dict, Optional[PushedTable]]:
+    """Message telling a channel about a pivot's current result, and the table
+    the channel then holds"""
+    pivot_df = config.get('pivot_df')
+    if config.get('error_log') or pivot_df is None:
+        message = {'type': 'error', 'error': config.get('error_log') or 'No pivot table generated'}
+        return {'pivot_id': pivot_id, **message}, previous
+    if pivot_df.size > PUSH_MAX_CELLS:
+        return {'pivot_id': pivot_id, 'type': 'changed', 'total_rows': len(pivot_df)}, None
+    table = PushedTable(version, pivot_df, config.get('error_bounds'))
+    message = table.delta(previous) if previous is not None else None
+    return {'pivot_id': pivot_id, **(message or table.full())}, table
+
+class PivotEvents:
+    """The push channels subscribed to each session, as queues of pivot ids.
     
-    # Add filters
-    if config.get('filters'):
-        code_lines.append("# Apply filters")
-        for f in config['filters']:
-            if f.get('column') and f.get('operator') and f.get('value'):
-                col = f['column']
-                op = f['operator']
-                value = f['value']
-                
-                if op == '==':
-                    code_lines.append(f"df = df[df['{col}'] == '{value}']")
-                elif op == '!=':
-                    code_lines.append(f"df = df[df['{col}'] != '{value}']")
-                elif op == 'contains':
-                    code_lines.append(f"df = df[df['{col}'].str.contains('{value}', na=False)]")
-                # Add more operators as needed
-        code_lines.append("")
+    Used from the event loop only.
+    """
+    def __init__(self):
+        self._channels = {}  # session_id: set of asyncio.Queue
     
-    # Add pivot table creation
-    agg_dict = {}
-    for item in config.get('value_agg_list', []):
-        if item.get('value_col'):
-            agg_dict[item['value_col']] = item.get('agg_func', 'sum')
+    def subscribe(self, session_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._channels.setdefault(session_id, set()).add(queue)
+        return queue
     
-    code_lines.extend([
-        "# Create pivot table",
-        "pivot_df = pd.pivot_table(",
-        "    df,",
-        f"    values={list(agg_dict.keys())},",
-        f"    index={config.get('index_cols', [])},",
-        f"    columns={config.get('column_cols', [])},",
-        f"    aggfunc={agg_dict},",
-        f"    fill_value={config.get('custom_fill_value') if config.get('fill_value_enabled') else None},",
-        f"    margins={config.get('margins_enabled', False)},",
-        f"    margins_name='{config.get('margins_name', 'All_Totals')}'",
-        ")",
-        "",
-        "print(pivot_df)"
-    ])
+    def unsubscribe(self, session_id: str, queue: asyncio.Queue):
+        channels = self._channels.get(session_id, set())
+        channels.discard(queue)
+        if not channels:
+            self._channels.pop(session_id, None)
     
-    return "\n".join(code_lines)
+    def publish(self, session_id: str, pivot_id: str):
+        for queue in self._channels.get(session_id, ()):
+            queue.put_nowait(pivot_id)
+    
+    def count(self) -> int:
+        return sum(len(channels) for channels in self._channels.values())
+
+pivot_events = PivotEvents()
+
+# Global application state (its dataset store is defined above)
+state = AppState()
 
 # API Routes
+@app.on_event("startup")
+async def start_memory_sweeper():
+    """Apply the idle TTLs periodically, not only when requests come in"""
+    async def sweep():
+        while True:
+            await asyncio.sleep(MEMORY_SWEEP_SECONDS)
+            try:
+                await state.enforce_memory_limits()
+            except Exception:
+                traceback.print_exc()
+    app.state.memory_sweeper = asyncio.create_task(sweep())
+
+@app.on_event("shutdown")
+async def remove_spill_files():
+    """Spilled data is only readable by this process, so it goes with it"""
+    for session_id in list(state.spilled):
+        state.spilled.pop(session_id).remove()
+    state.datasets.remove_spilled()
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    jobs.shutdown()
+
 @app.get("/", response_class=HTMLResponse)
 async def get_index():
     return FileResponse(str(static_dir / 'index.html'))
@@ -337,49 +3355,140 @@ async def upload_file(file: UploadFile = File(...), session_id: str = "default")
             raise HTTPException(status_code=400, detail="Only CSV files are supported")
         
         content = await file.read()
-        df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-        df_processed = process_dataframe(df)
-        
-        state.set_session_data(session_id, df_processed)
+        await state.load_session(session_id)
+        # Identical files share one dataset (and its cached results) across sessions
+        version = await asyncio.to_thread(lambda: hashlib.sha256(content).hexdigest()[:32])
+        await state.datasets.load(version)
+        dataset = state.datasets.get(version)
+        if dataset is None:
+            def parse(job: Job) -> Dataset:
+                # Read everything as compact strings; columns are typed lazily on first use
+                job.report(0.0, 'Reading CSV')
+                with STAGE_SECONDS.time('upload_file', 'read_csv'):
+                    raw = pd.read_csv(io.BytesIO(content), dtype=RAW_STRING_DTYPE, encoding='utf-8')
+                job.report(0.7, 'Inferring schema')
+                with STAGE_SECONDS.time('upload_file', 'infer_schema'):
+                    schema = infer_schema(raw)
+                dataset = Dataset(raw, schema, version)
+                # Written to the state backend here, so storing it below finds it saved
+                job.report(0.9, 'Saving')
+                state.backend.save_dataset(dataset)
+                return dataset
+            
+            job = await jobs.wait(jobs.submit(Job('upload', session_id), parse))
+            if job.status != 'done':
+                raise ValueError(job.error or 'Upload cancelled')
+            dataset = job.result
+        state.set_session_data(session_id, dataset)
+        state.schedule_memory_limits(keep=session_id)
+        # Profile the columns for the filter UI while the user sets up pivots
+        profile_job = start_profile_job(session_id, dataset)
+        cube_job = start_cube_job(session_id, dataset)
         
         return {
             'success': True,
+            'profile_job_id': profile_job.id if profile_job is not None else None,
+            'cube_job_id': cube_job.id if cube_job is not None else None,
             'filename': file.filename,
-            'shape': df_processed.shape,
-            'columns': df_processed.columns.tolist(),
-            'dtypes': {col: str(dtype) for col, dtype in df_processed.dtypes.items()}
+            'shape': dataset.shape,
+            'columns': dataset.columns,
+            'date_buckets': dataset.bucket_columns(),
+            'dtypes': dataset.dtypes(),
+            'schema': dataset.schema
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
 
 @app.get("/api/data/{session_id}")
 async def get_data_info(session_id: str):
-    df = state.get_session_data(session_id)
-    if df is None:
+    await state.load_session(session_id)
+    dataset = state.get_session_data(session_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="No data found for session")
+    
+    return {
+        'shape': dataset.shape,
+        'columns': dataset.columns,
+        'date_buckets': dataset.bucket_columns(),
+        'dtypes': dataset.dtypes(),
+        'sample_data': dataset.head().to_dict('records')
+    }
+
+@app.get("/api/profile/{session_id}")
+async def get_profile(session_id: str, columns: Optional[str] = None):
+    """Column profiles (type, null count, distinct values, top values, min/max
+    and histogram), computed once per uploaded file"""
+    await state.load_session(session_id)
+    dataset = state.get_session_data(session_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="No data found for session")
+    
+    try:
+        col_positions = select_columns(dataset.columns, columns.split(',') if columns else None)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown column: {e.args[0]}")
+    
+    job = start_profile_job(session_id, dataset)
+    if job is not None:
+        await jobs.wait(job)
+        if not dataset.profiled:
+            raise HTTPException(status_code=500, detail=job.error or "Profiling was cancelled")
+    profile = dataset.profile()
+    return {
+        'rows': dataset.shape[0],
+        'columns': {dataset.columns[i]: profile[dataset.columns[i]] for i in col_positions}
+    }
+
+@app.get("/api/values/{session_id}/{column}")
+async def get_column_values(session_id: str, column: str, prefix: str = '',
+                            limit: int = Query(20, ge=1, le=1000)):
+    """Distinct values of a text column starting with prefix (case-insensitive),
+    for filter autocompletion, with the number of rows holding each"""
+    await state.load_session(session_id)
+    dataset = state.get_session_data(session_id)
+    if dataset is None:
         raise HTTPException(status_code=404, detail="No data found for session")
+    if not dataset.has_column(column):
+        raise HTTPException(status_code=400, detail=f"Unknown column: {column}")
+    
+    index = value_index_cache.get((dataset.version, column))
+    if index is None:
+        job = await jobs.wait(jobs.submit(Job('index', session_id), lambda job: value_index(dataset, column)))
+        if job.status != 'done':
+            raise HTTPException(status_code=500, detail=job.error or "Indexing was cancelled")
+        index = job.result
+    if index is None:
+        raise HTTPException(status_code=400, detail=f"Column {column} is not a text column "
+                                                    f"with at most {VALUE_INDEX_MAX_DISTINCT} distinct values")
     
+    start, stop = index.search(prefix)
+    end = min(stop, start + limit)
     return {
-        'shape': df.shape,
-        'columns': df.columns.tolist(),
-        'dtypes': {col: str(dtype) for col, dtype in df.dtypes.items()},
-        'sample_data': df.head().to_dict('records')
+        'column': column,
+        'prefix': prefix,
+        'values': [{'value': value, 'count': int(count)} for value, count in
+                   zip(index.labels[start:end].tolist(), index.counts[start:end].tolist())],
+        'matches': stop - start,
+        'distinct': len(index.labels)
     }
 
 @app.get("/api/pivots/{session_id}")
 async def get_pivots(session_id: str):
+    await state.load_session(session_id)
     configs = state.get_pivot_configs(session_id)
     # Remove non-serializable data for API response
     clean_configs = []
     for config in configs:
         clean_config = {k: v for k, v in config.items() 
-                      if k not in ['pivot_df', 'filtered_df']}
+                      if k not in PIVOT_RESULT_KEYS}
         clean_configs.append(clean_config)
     return clean_configs
 
 @app.post("/api/pivots/{session_id}")
 async def create_pivot(session_id: str):
-    df = state.get_session_data(session_id)
-    if df is None:
+    await state.load_session(session_id)
+    dataset = state.get_session_data(session_id)
+    if dataset is None:
         raise HTTPException(status_code=404, detail="No data found for session")
     
     configs = state.get_pivot_configs(session_id)
@@ -390,9 +3499,20 @@ async def create_pivot(session_id: str):
     return {'success': True, 'pivot_id': new_config['id']}
 
 @app.put("/api/pivots/{session_id}/{pivot_id}")
-async def update_pivot(session_id: str, pivot_id: str, config_update: Dict):
-    df = state.get_session_data(session_id)
-    if df is None:
+async def update_pivot(session_id: str, pivot_id: str, config_update: Dict, background: bool = False,
+                       preview: bool = False):
+    """Update a pivot's configuration and regenerate it.
+    
+    The pivot is computed in the job pool. By default the response waits for
+    the result; with background=true it returns a job_id right away (see
+    /api/jobs). With preview=true it returns once an estimate from a sample
+    is in place (estimate=true), which the exact result then replaces;
+    pivots that cannot be previewed wait for the exact result. A newer
+    update of the same pivot cancels an older one.
+    """
+    await state.load_session(session_id)
+    dataset = state.get_session_data(session_id)
+    if dataset is None:
         raise HTTPException(status_code=404, detail="No data found for session")
     
     configs = state.get_pivot_configs(session_id)
@@ -409,22 +3529,81 @@ async def update_pivot(session_id: str, pivot_id: str, config_update: Dict):
     configs[config_index].update(config_update)
     configs[config_index]['updated_at'] = datetime.now().isoformat()
     
-    # Generate pivot table
-    result = create_pivot_table(df, configs[config_index])
-    if result['success']:
-        configs[config_index]['pivot_df'] = result['pivot_df']
-        configs[config_index]['filtered_df'] = result['filtered_df']
-        configs[config_index]['error_log'] = ''
-        configs[config_index]['generated_code'] = generate_python_code(configs[config_index])
-    else:
-        configs[config_index]['error_log'] = result.get('error', 'Unknown error')
-    
     state.set_pivot_configs(session_id, configs)
     
-    return {'success': result['success'], 'error': result.get('error')}
+    # Reuse the result of an identical pivot over the same data if one is cached
+    result = cached_pivot_result(session_id, pivot_id, dataset, configs[config_index])
+    if result is not None:
+        return {'success': result['success'], 'error': result.get('error'), 'cached': True, 'job_id': None}
+    
+    preview_job = None
+    if preview and not background:
+        # Submitted first, so that a busy pool starts it before the exact pivot
+        config = dict(configs[config_index])
+        preview_job = jobs.submit(Job('preview', session_id),
+                                  lambda job: preview_pivot_table(dataset, config, job.report))
+    job = start_pivot_job(session_id, pivot_id, dataset, configs[config_index])
+    if background:
+        return {'success': True, 'error': None, 'cached': False, 'job_id': job.id}
+    
+    if preview_job is not None:
+        await jobs.wait(preview_job)
+        if preview_job.result is not None and not job.finished and jobs.is_latest(job):
+            state.set_pivot_result(session_id, pivot_id, preview_job.result)
+            return {'success': True, 'error': None, 'cached': False, 'job_id': job.id, 'estimate': True}
+    
+    await jobs.wait(job)
+    return pivot_job_response(job)
+
+@app.post("/api/pivots/{session_id}/compute-all")
+async def compute_all_pivots(session_id: str, request_data: Optional[Dict] = None, background: bool = False):
+    """Regenerate every pivot of a session (or the given pivot_ids) in one go.
+    
+    Pivots are grouped by their filter set: each group filters the data once
+    and its pivots share the selected rows. Groups run in parallel in the
+    job pool. Returns one entry per pivot, with a job_id for those computed.
+    """
+    await state.load_session(session_id)
+    dataset = state.get_session_data(session_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="No data found for session")
+    
+    pivot_ids = (request_data or {}).get('pivot_ids')
+    configs = [c for c in state.get_pivot_configs(session_id) if pivot_ids is None or c['id'] in pivot_ids]
+    
+    results = {}
+    groups = {}  # canonical filter set: configs using it
+    for config in configs:
+        result = cached_pivot_result(session_id, config['id'], dataset, config)
+        if result is not None:
+            results[config['id']] = {'success': result['success'], 'error': result.get('error'),
+                                     'cached': True, 'job_id': None}
+        else:
+            key = json.dumps(canonical_pivot_config(config)['filters'], sort_keys=True, default=str)
+            groups.setdefault(key, []).append(config)
+    
+    started = []
+    for group in groups.values():
+        shared = SharedSelection(dataset, group[0].get('filters', []))
+        for config in group:
+            started.append(start_pivot_job(session_id, config['id'], dataset, config, shared))
+    
+    if background:
+        for job in started:
+            results[job.pivot_id] = {'success': True, 'error': None, 'cached': False, 'job_id': job.id}
+    else:
+        for job in await asyncio.gather(*(jobs.wait(job) for job in started)):
+            results[job.pivot_id] = pivot_job_response(job)
+    
+    return {
+        'success': all(r['success'] for r in results.values()),
+        'filter_groups': len(groups),
+        'results': [{'pivot_id': c['id'], 'name': c.get('name'), **results[c['id']]} for c in configs]
+    }
 
 @app.delete("/api/pivots/{session_id}/{pivot_id}")
 async def delete_pivot(session_id: str, pivot_id: str):
+    await state.load_session(session_id)
     configs = state.get_pivot_configs(session_id)
     configs = [c for c in configs if c['id'] != pivot_id]
     state.set_pivot_configs(session_id, configs)
@@ -433,6 +3612,7 @@ async def delete_pivot(session_id: str, pivot_id: str):
 @app.post("/api/copy-filters/{session_id}")
 async def copy_filters(session_id: str, request_data: Dict):
     """Copy filters from one pivot to another"""
+    await state.load_session(session_id)
     source_pivot_id = request_data.get('source_pivot_id')
     target_pivot_ids = request_data.get('target_pivot_ids', [])
     
@@ -461,8 +3641,16 @@ async def copy_filters(session_id: str, request_data: Dict):
     return {'success': True, 'updated_count': updated_count}
 
 @app.get("/api/pivot-table/{session_id}/{pivot_id}")
-async def get_pivot_table(session_id: str, pivot_id: str):
-    """Get pivot table data as JSON"""
+async def get_pivot_table(session_id: str, pivot_id: str, request: Request,
+                          offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=0),
+                          columns: Optional[str] = None, sort_by: Optional[str] = None,
+                          ascending: bool = True, format: str = 'records'):
+    """Get pivot table data as JSON (records or columnar) or as an Arrow IPC stream.
+    
+    Supports a row window (offset/limit), a comma-separated column projection
+    and sorting by one column. The stored pivot frame is never modified.
+    """
+    await state.load_session(session_id)
     configs = state.get_pivot_configs(session_id)
     config = None
     for c in configs:
@@ -470,35 +3658,346 @@ async def get_pivot_table(session_id: str, pivot_id: str):
             config = c
             break
     
+    if config:
+        await ensure_pivot_result(session_id, config)
     if not config or config.get('pivot_df') is None:
         raise HTTPException(status_code=404, detail="Pivot table not found")
     
+    if ARROW_STREAM_MEDIA_TYPE in request.headers.get('accept', ''):
+        format = 'arrow'
+    if format not in ('records', 'columnar', 'arrow'):
+        raise HTTPException(status_code=400, detail="format must be 'records', 'columnar' or 'arrow'")
+    
     pivot_df = config['pivot_df']
+    bounds = config.get('error_bounds')  # only while a preview is shown
+    with STAGE_SECONDS.time('get_pivot_table', 'flatten'):
+        names = flatten_column_names(pivot_df.columns)
+    try:
+        with STAGE_SECONDS.time('get_pivot_table', 'select'):
+            col_positions = select_columns(names, columns.split(',') if columns else None)
+            row_positions = order_rows(pivot_df, names, sort_by, ascending)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown pivot column: {e.args[0]}")
+    
+    total_rows = len(pivot_df)
+    window = row_positions[offset:offset + limit if limit is not None else None]
+    page = pivot_df.iloc[window, col_positions]
+    page_names = [names[i] for i in col_positions]
+    
+    if format == 'arrow':
+        if not HAS_PYARROW:
+            raise HTTPException(status_code=400, detail="Arrow format requires pyarrow on the server")
+        with STAGE_SECONDS.time('get_pivot_table', 'serialize'):
+            content = frame_to_arrow_stream(page, page_names)
+        return Response(
+            content=content,
+            media_type=ARROW_STREAM_MEDIA_TYPE,
+            headers={'X-Total-Rows': str(total_rows), 'X-Estimate': str(bounds is not None).lower()}
+        )
+    
+    # Encoded here rather than by FastAPI, so that the timing covers it
+    with STAGE_SECONDS.time('get_pivot_table', 'serialize'):
+        def layout(frame: pd.DataFrame):
+            values = [json_safe_values(frame.iloc[:, i]) for i in range(len(page_names))]
+            if format == 'columnar':
+                return dict(zip(page_names, values))
+            return [dict(zip(page_names, row)) for row in zip(*values)]
+        
+        return JSONResponse(jsonable_encoder({
+            'data': layout(page),
+            'columns': page_names,
+            'index': page.index.tolist(),
+            'total_rows': total_rows,
+            'offset': offset,
+            'limit': limit,
+            'estimate': bounds is not None,
+            'error_bounds': layout(bounds.iloc[window, col_positions]) if bounds is not None else None
+        }))
+
+@app.get("/api/rows/{session_id}")
+async def get_rows(session_id: str, request: Request,
+                   offset: int = Query(0, ge=0), limit: int = Query(100, ge=0, le=ROWS_MAX_LIMIT),
+                   columns: Optional[str] = None, sort_by: Optional[str] = None,
+                   ascending: bool = True, filters: Optional[str] = None,
+                   pivot_id: Optional[str] = None, format: str = 'records'):
+    """Browse a window of the session's rows as JSON (records or columnar) or Arrow.
+    
+    Rows can be filtered by a JSON list of filters, or by the filters of a
+    pivot (pivot_id), and sorted by one column. The filtered and sorted row
+    order is computed once in the job pool and cached, so each further page
+    only costs the rows on it. 'index' holds the rows' positions in the dataset.
+    """
+    await state.load_session(session_id)
+    dataset = state.get_session_data(session_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="No data found for session")
     
-    # Convert to JSON-serializable format
-    if isinstance(pivot_df.columns, pd.MultiIndex):
-        # Handle MultiIndex columns
-        pivot_df.columns = [' | '.join(map(str, col)).strip() for col in pivot_df.columns.values]
+    if ARROW_STREAM_MEDIA_TYPE in request.headers.get('accept', ''):
+        format = 'arrow'
+    if format not in ('records', 'columnar', 'arrow'):
+        raise HTTPException(status_code=400, detail="format must be 'records', 'columnar' or 'arrow'")
     
+    if pivot_id is not None:
+        config = next((c for c in state.get_pivot_configs(session_id) if c['id'] == pivot_id), None)
+        if config is None:
+            raise HTTPException(status_code=404, detail="Pivot not found")
+        filter_list = config.get('filters', [])
+    else:
+        try:
+            filter_list = json.loads(filters) if filters else []
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"filters must be a JSON list: {e}")
+        if not isinstance(filter_list, list) or not all(isinstance(f, dict) for f in filter_list):
+            raise HTTPException(status_code=400, detail="filters must be a JSON list of filter objects")
+    
+    try:
+        col_positions = select_columns(dataset.columns, columns.split(',') if columns else None)
+        if sort_by:
+            select_columns(dataset.columns, [sort_by])
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown column: {e.args[0]}")
+    page_names = [dataset.columns[i] for i in col_positions]
+    
+    key = row_order_key(dataset, filter_list, sort_by, ascending)
+    if key is None:
+        total_rows = len(dataset.index)
+        window = np.arange(min(offset, total_rows), min(offset + limit, total_rows))
+    else:
+        positions = row_order_cache.get(key)
+        if positions is None:
+            job = jobs.submit(Job('rows', session_id),
+                              lambda job: compute_row_order(dataset, filter_list, sort_by, ascending))
+            await jobs.wait(job)
+            if job.status != 'done':
+                raise HTTPException(status_code=500, detail=job.error or "Row browsing was cancelled")
+            positions = job.result
+            row_order_cache.put(key, positions)
+        total_rows = len(positions)
+        window = positions[offset:offset + limit]
+    page = dataset.rows(window, page_names)
+    
+    if format == 'arrow':
+        if not HAS_PYARROW:
+            raise HTTPException(status_code=400, detail="Arrow format requires pyarrow on the server")
+        return Response(
+            content=frame_to_arrow_stream(page, page_names),
+            media_type=ARROW_STREAM_MEDIA_TYPE,
+            headers={'X-Total-Rows': str(total_rows)}
+        )
+    
+    values = [json_safe_values(page.iloc[:, i]) for i in range(len(page_names))]
+    if format == 'columnar':
+        data = dict(zip(page_names, values))
+    else:
+        data = [dict(zip(page_names, row)) for row in zip(*values)]
+    
+    return {
+        'data': data,
+        'columns': page_names,
+        'index': window.tolist(),
+        'total_rows': total_rows,
+        'offset': offset,
+        'limit': limit
+    }
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters and memory use of the server-side caches"""
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+@app.get("/api/admin/memory")
+async def get_memory_usage():
+    """Memory held by each dataset, session and pivot, and the limits applied"""
+    now = time.monotonic()
+    sessions = []
+    for session_id in sorted(set(state.pivot_configs) | set(state.session_versions)):
+        spilled = state.spilled.get(session_id)
+        sessions.append({
+            'session_id': session_id,
+            'status': state.session_status(session_id),
+            'idle_seconds': round(now - state.last_access.get(session_id, now), 1),
+            **state.session_memory(session_id),
+            'spilled_bytes': spilled.nbytes() if spilled is not None else 0
+        })
     return {
-        'data': pivot_df.to_dict('records'),
-        'columns': pivot_df.columns.tolist(),
-        'index': pivot_df.index.tolist() if hasattr(pivot_df, 'index') else []
+        'total_bytes': state.memory_in_use(),
+        'budget_bytes': MEMORY_BUDGET_BYTES,
+        'session_ttl_seconds': SESSION_TTL_SECONDS,
+        'spill_ttl_seconds': SPILL_TTL_SECONDS,
+        'spill_dir': str(SPILL_DIR),
+        'datasets': state.datasets.stats(),
+        'sessions': sessions,
+        'caches': {name: cache.stats() for name, cache in CACHES.items()}
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    """Request and stage timings, cache, session, memory and job figures of
+    this worker process, in the Prometheus text format"""
+    session_counts = {'loaded': 0, 'spilled': 0, 'no data': 0}
+    for session_id in set(state.pivot_configs) | set(state.session_versions):
+        session_counts[state.session_status(session_id)] += 1
+    job_counts = {}
+    for job in jobs.list():
+        job_counts[(job.kind, job.status)] = job_counts.get((job.kind, job.status), 0) + 1
+    datasets = state.datasets.stats()
+    caches = {name: cache.stats() for name, cache in CACHES.items()}
+    
+    lines = REQUEST_SECONDS.render() + STAGE_SECONDS.render()
+    for name, kind, documentation, key in [
+            ('pivot_cache_hits_total', 'counter', 'Lookups answered by the cache', 'hits'),
+            ('pivot_cache_misses_total', 'counter', 'Lookups not answered by the cache', 'misses'),
+            ('pivot_cache_evictions_total', 'counter', 'Entries evicted to stay within budget', 'evictions'),
+            ('pivot_cache_hit_ratio', 'gauge', 'Share of lookups answered by the cache', 'hit_ratio'),
+            ('pivot_cache_entries', 'gauge', 'Entries held by the cache', 'entries'),
+            ('pivot_cache_bytes', 'gauge', 'Memory held by the cache', 'bytes'),
+            ('pivot_cache_max_bytes', 'gauge', 'Memory budget of the cache', 'max_bytes')]:
+        lines += render_metric(name, kind, documentation,
+                               [({'cache': cache}, stats[key]) for cache, stats in caches.items()])
+    lines += render_metric('pivot_sessions', 'gauge', 'Sessions known to this worker',
+                           [({'status': status}, count) for status, count in session_counts.items()])
+    lines += render_metric('pivot_datasets', 'gauge', 'Uploaded datasets held by this worker',
+                           [({'status': status}, sum(d['status'] == status for d in datasets))
+                            for status in ('loaded', 'spilled')])
+    lines += render_metric('pivot_dataset_bytes', 'gauge', 'Memory held by datasets',
+                           [({}, sum(d['bytes'] for d in datasets))])
+    lines += render_metric('pivot_dataset_spilled_bytes', 'gauge', 'Disk held by spilled datasets',
+                           [({}, sum(d['spilled_bytes'] for d in datasets))])
+    lines += render_metric('pivot_memory_bytes', 'gauge', 'Memory held by datasets and pivot results',
+                           [({}, state.memory_in_use())])
+    lines += render_metric('pivot_memory_budget_bytes', 'gauge', 'Memory budget before sessions are spilled',
+                           [({}, MEMORY_BUDGET_BYTES)])
+    lines += render_metric('pivot_jobs', 'gauge', 'Recent and running jobs',
+                           [({'kind': kind, 'status': status}, count)
+                            for (kind, status), count in sorted(job_counts.items())])
+    return Response(content='\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.get("/api/jobs")
+async def list_jobs(session_id: Optional[str] = None):
+    """Recent and running jobs, optionally of one session"""
+    return [job.to_dict() for job in jobs.list(session_id)]
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the job's state whenever it changes, until it finishes"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def events():
+        last = None
+        while True:
+            current = job.to_dict()
+            if current != last:
+                yield f"data: {json.dumps(current)}\n\n"
+                last = current
+            if job.finished:
+                break
+            await asyncio.sleep(JOB_EVENTS_INTERVAL_SECONDS)
+    
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.get("/api/events/{session_id}")
+async def session_events(session_id: str):
+    """Server-sent events with each pivot result of the session as it is set.
+    
+    A pivot's first message on the channel holds the whole table (type
+    full); later ones hold only the changes since the previous message
+    (type delta, against base_version) when they are smaller. Pivots too
+    large to push come as type changed, failures as type error.
+    """
+    await state.load_session(session_id)
+    queue = pivot_events.subscribe(session_id)
+    
+    async def events():
+        sent = {}  # pivot_id: PushedTable last sent on this channel
+        versions = iter(range(1, 2**63))
+        try:
+            yield ': connected\n\n'
+            while True:
+                try:
+                    pivot_ids = [await asyncio.wait_for(queue.get(), PUSH_KEEPALIVE_SECONDS)]
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                # Only the latest result of a pivot updated repeatedly meanwhile is sent
+                while not queue.empty():
+                    pivot_ids.append(queue.get_nowait())
+                configs = {c['id']: c for c in state.get_pivot_configs(session_id)}
+                for pivot_id in dict.fromkeys(pivot_ids):
+                    if pivot_id not in configs:
+                        continue
+                    message, sent[pivot_id] = await asyncio.to_thread(
+                        push_message, pivot_id, configs[pivot_id], sent.get(pivot_id), next(versions))
+                    yield f"data: {json.dumps(message, default=str)}\n\n"
+        finally:
+            pivot_events.unsubscribe(session_id, queue)
+    
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job.finished:
+        job.cancel()
+    return {'success': True, 'status': job.status}
+
 @app.post("/api/save-views/{session_id}")
-async def save_views(session_id: str):
-    success = state.save_views(session_id)
-    return {'success': success}
+async def save_views(session_id: str, name: str = 'default', namespace: Optional[str] = None):
+    """Save the session's pivots as a named view. Views live in the session's
+    namespace unless another one (e.g. a user name, or 'shared') is given."""
+    await state.load_session(session_id)
+    version = state.save_views(session_id, name, namespace)
+    return {'success': version is not None, 'name': name, 'version': version}
 
 @app.post("/api/load-views/{session_id}")
-async def load_views(session_id: str):
-    success = state.load_views(session_id)
+async def load_views(session_id: str, name: str = 'default', namespace: Optional[str] = None,
+                     version: Optional[int] = None):
+    """Replace the session's pivots by a saved view (a given version of it, or the latest)"""
+    await state.load_session(session_id)
+    success = state.load_views(session_id, name, namespace, version)
     return {'success': success}
 
+@app.get("/api/views/{session_id}")
+async def list_views(session_id: str, namespace: Optional[str] = None,
+                     limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    """Saved views, most recently saved first"""
+    return state.views.list(namespace or session_id, limit, offset)
+
+@app.get("/api/views/{session_id}/{name}/history")
+async def get_view_history(session_id: str, name: str, namespace: Optional[str] = None):
+    """Versions kept of a saved view, newest first"""
+    history = state.views.history(namespace or session_id, name)
+    if not history:
+        raise HTTPException(status_code=404, detail="View not found")
+    return history
+
+@app.delete("/api/views/{session_id}/{name}")
+async def delete_view(session_id: str, name: str, namespace: Optional[str] = None):
+    if not state.views.delete(namespace or session_id, name):
+        raise HTTPException(status_code=404, detail="View not found")
+    return {'success': True}
+
 @app.get("/api/download/{session_id}/{pivot_id}/{file_type}")
-async def download_file(session_id: str, pivot_id: str, file_type: str):
-    """Download pivot table, filtered data, or generated code"""
+async def download_file(session_id: str, pivot_id: str, file_type: str, compression: Optional[str] = None):
+    """Download pivot table, filtered data, or generated code.
+    
+    Tables are available as csv, parquet or xlsx (pivot_csv, filtered_parquet, ...)
+    and are generated in chunks; compression=gzip compresses the stream.
+    """
+    await state.load_session(session_id)
+    if compression not in (None, 'gzip'):
+        raise HTTPException(status_code=400, detail="compression must be 'gzip'")
+    
     configs = state.get_pivot_configs(session_id)
     config = None
     for c in configs:
@@ -510,41 +4009,91 @@ async def download_file(session_id: str, pivot_id: str, file_type: str):
         raise HTTPException(status_code=404, detail="Pivot not found")
     
     pivot_name = config['name'].replace(' ', '_')
+    if file_type != 'python_code':
+        await ensure_pivot_result(session_id, config)
     
-    if file_type == 'pivot_csv':
-        if config.get('pivot_df') is None:
-            raise HTTPException(status_code=404, detail="No pivot table generated")
+    if file_type == 'python_code':
+        if not config.get('generated_code'):
+            raise HTTPException(status_code=404, detail="No generated code available")
         
-        csv_data = config['pivot_df'].to_csv()
-        return Response(
-            content=csv_data,
-            media_type='text/csv',
-            headers={'Content-Disposition': f'attachment; filename=pivot_{pivot_name}.csv'}
-        )
+        return export_response(iter([config['generated_code'].encode('utf-8')]),
+                               f'pivot_code_{pivot_name}.py', 'text/x-python', compression)
+    
+    table, _, fmt = file_type.partition('_')
+    if table not in ('pivot', 'filtered') or fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid file type")
+    if fmt == 'parquet' and not HAS_PYARROW:
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow on the server")
+    if fmt == 'xlsx' and not HAS_OPENPYXL:
+        raise HTTPException(status_code=400, detail="XLSX export requires openpyxl on the server")
     
-    elif file_type == 'filtered_csv':
-        if config.get('filtered_df') is None:
+    if table == 'pivot':
+        if config.get('pivot_df') is None:
+            raise HTTPException(status_code=404, detail="No pivot table generated")
+        frames = frame_chunks(config['pivot_df'])
+        index = True
+        date_formats = None
+        filename = f'pivot_{pivot_name}.{fmt}'
+    else:
+        selection = config.get('selection')
+        if selection is None and config.get('pivot_df') is None:
             raise HTTPException(status_code=404, detail="No filtered data available")
         
-        csv_data = config['filtered_df'].to_csv(index=False)
-        return Response(
-            content=csv_data,
-            media_type='text/csv',
-            headers={'Content-Disposition': f'attachment; filename=filtered_{pivot_name}.csv'}
-        )
+        # Materialize every column of the selected rows, a chunk at a time
+        dataset = state.get_session_data(session_id)
+        if dataset is None:
+            raise HTTPException(status_code=404, detail="No data found for session")
+        if selection is not None and getattr(selection, 'dataset_version', None) != dataset.version:
+            # The pivot on screen was computed from data the session no longer holds
+            raise HTTPException(status_code=409, detail="Data changed since the pivot was updated")
+        if selection is None:
+            # A pivot rolled up from the cube never selected its rows
+            shared = SharedSelection(dataset, config.get('filters', []))
+            job = await jobs.wait(jobs.submit(Job('filter', session_id), shared.get))
+            if job.status != 'done':
+                raise HTTPException(status_code=500, detail=job.error or "Filtering was cancelled")
+            selection = job.result
+        frames = dataset.iter_chunks(selection.positions())
+        index = False
+        date_formats = dataset.csv_date_formats()
+        filename = f'filtered_{pivot_name}.{fmt}'
     
-    elif file_type == 'python_code':
-        if not config.get('generated_code'):
-            raise HTTPException(status_code=404, detail="No generated code available")
-        
-        return Response(
-            content=config['generated_code'],
-            media_type='text/x-python',
-            headers={'Content-Disposition': f'attachment; filename=pivot_code_{pivot_name}.py'}
-        )
+    # CSV is encoded chunk by chunk as the response is sent (in Starlette's
+    # thread pool); Parquet and XLSX files are written whole first, off the event loop
+    try:
+        if fmt == 'csv':
+            chunks = iter_csv(frames, index, date_formats)
+        elif fmt == 'parquet':
+            chunks = stream_file(await asyncio.to_thread(write_parquet, frames, index))
+        else:
+            chunks = stream_file(await asyncio.to_thread(write_xlsx, [(config['name'], frames, index)]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    else:
-        raise HTTPException(status_code=400, detail="Invalid file type")
+    return export_response(chunks, filename, EXPORT_MEDIA_TYPES[fmt], compression)
+
+@app.get("/api/download/{session_id}/workbook")
+async def download_workbook(session_id: str, compression: Optional[str] = None):
+    """Download every generated pivot of a session as one XLSX workbook (one sheet per pivot)"""
+    await state.load_session(session_id)
+    if compression not in (None, 'gzip'):
+        raise HTTPException(status_code=400, detail="compression must be 'gzip'")
+    if not HAS_OPENPYXL:
+        raise HTTPException(status_code=400, detail="XLSX export requires openpyxl on the server")
+    
+    configs = state.get_pivot_configs(session_id)
+    for config in configs:
+        await ensure_pivot_result(session_id, config)
+    configs = [c for c in configs if c.get('pivot_df') is not None]
+    if not configs:
+        raise HTTPException(status_code=404, detail="No pivot tables generated")
+    
+    sheets = [(c['name'], frame_chunks(c['pivot_df']), True) for c in configs]
+    try:
+        chunks = stream_file(await asyncio.to_thread(write_xlsx, sheets))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return export_response(chunks, f'pivots_{session_id}.xlsx', EXPORT_MEDIA_TYPES['xlsx'], compression)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
@@ -558,10 +4107,17 @@ if __name__ == "__main__":
     print("🌐 Access at: http://localhost:8000")
     print("⚡ Press Ctrl+C to stop")
     
+    # Several workers need state they can share (PIVOT_STATE_BACKEND=disk)
+    workers = int(os.environ.get('PIVOT_WORKERS', '1'))
+    if workers > 1 and STATE_BACKEND != 'disk':
+        print("⚠️  PIVOT_WORKERS > 1 needs PIVOT_STATE_BACKEND=disk; starting a single worker")
+        workers = 1
+    
     uvicorn.run(
         "pivot_by_codex_v5:app", 
         host="0.0.0.0", 
         port=8000, 
-        reload=True,
+        reload=workers == 1,
+        workers=workers,
         log_level="info"
     )
\ No newline at end of file
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Pivot Codex V5 Batch Runner
+===========================
+
+Replays saved pivot views against one or more CSV files without the web UI,
+e.g. the monthly Appointments / Showups / Opportunity / Closed pivots for
+every department in one command. Each CSV is loaded once and its pivots are
+grouped by filter set, so every distinct filter set is evaluated once per
+dataset; datasets are spread across a pool of processes.
+
+Results go to one directory per dataset (a CSV per pivot) or to one XLSX
+workbook per dataset, plus a JSON summary of the run.
+
+Usage:
+    python batch_pivot_v5.py saved_pivot_views_v5.json exports/*.csv
+    python batch_pivot_v5.py saved_pivot_views_v5.sqlite3 --view monthly --namespace shared \\
+        exports/*.csv --format xlsx --output commission_2025_06
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT / 'CodexV2'))
+import pivot_by_codex_v5 as pivots
+
+# Files read as a views database rather than a JSON list of pivot configs
+VIEWS_DB_SUFFIXES = ('.sqlite3', '.sqlite', '.db')
+HASH_BLOCK_BYTES = 1024 * 1024
+
+def load_configs(path: Path, view: str, namespace: str, version: Optional[int]) -> List[Dict]:
+    """Pivot configs of a views JSON file (a list of configs) or of a view in a views database"""
+    if path.suffix in VIEWS_DB_SUFFIXES:
+        configs = pivots.ViewStore(path).load(namespace, view, version)
+        if configs is None:
+            raise ValueError(f"No view '{view}' in namespace '{namespace}' of {path}")
+    else:
+        try:
+            configs = json.loads(path.read_text())
+        except ValueError as e:
+            raise ValueError(f"{path} is not valid JSON ({e})")
+    if not isinstance(configs, list) or not all(isinstance(c, dict) for c in configs):
+        raise ValueError(f"{path} does not hold a list of pivot configs")
+    return configs
+
+def file_version(path: Path) -> str:
+    """Content hash of a file, the dataset version the web app would give it"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+def load_dataset(path: Path) -> 'pivots.Dataset':
+    """Read a CSV the way an upload does: compact strings, typed lazily on first use"""
+    raw = pd.read_csv(path, dtype=pivots.RAW_STRING_DTYPE, encoding='utf-8')
+    return pivots.Dataset(raw, pivots.infer_schema(raw), file_version(path))
+
+def ignored_filters(dataset: 'pivots.Dataset', config: Dict) -> List[str]:
+    """Filters of a config that do not apply to this dataset (unknown column or
+    operator); the web app skips them silently, a batch run should say so"""
+    active = [f for f in config.get('filters', []) if f.get('column') and f.get('operator')]
+    columns = [f['column'] for f in active if dataset.has_column(f['column'])]
+    frame = dataset.frame(list(dict.fromkeys(columns)))
+    compiled = {id(f) for f, _, _ in pivots.compile_filters(frame, active)}
+    return [f"{f['column']} {f['operator']} {f.get('value', '')}" for f in active if id(f) not in compiled]
+
+def output_name(name: str, used: set) -> str:
+    """File name of a pivot's CSV, as the web app's download names it, made unique"""
+    base = 'pivot_' + (str(name).replace(' ', '_').replace('/', '_') or 'Pivot')
+    filename = base
+    n = 2
+    while filename.lower() in used:
+        filename = f'{base}_{n}'
+        n += 1
+    used.add(filename.lower())
+    return filename + '.csv'
+
+def run_dataset(csv_path: str, configs: List[Dict], output: str, fmt: str,
+                allow_ignored_filters: bool = False) -> Dict:
+    """Evaluate every pivot config against one CSV and write the results.
+
+    Runs in a worker process. Pivots sharing a filter set share one row
+    selection; the typed columns are converted once for all pivots. A pivot
+    with a filter that does not apply fails (and is not written) unless
+    allow_ignored_filters is set, as its totals would include rows the
+    filter was meant to leave out.
+    """
+    start = time.perf_counter()
+    path = Path(csv_path)
+    summary = {'dataset': str(path), 'rows': None, 'pivots': [], 'outputs': [], 'error': None}
+    try:
+        dataset = load_dataset(path)
+    except Exception as e:
+        summary['error'] = f"Error reading {path}: {e}"
+        summary['seconds'] = round(time.perf_counter() - start, 3)
+        return summary
+    summary['rows'] = dataset.shape[0]
+
+    groups = {}  # canonical filter set: configs using it
+    for config in configs:
+        key = json.dumps(pivots.canonical_pivot_config(config)['filters'], sort_keys=True, default=str)
+        groups.setdefault(key, []).append(config)
+
+    results = {}
+    for group in groups.values():
+        filters = group[0].get('filters', [])
+        columns = [f['column'] for f in filters if f.get('column') and dataset.has_column(f['column'])]
+        frame = dataset.frame(list(dict.fromkeys(columns)))
+        selection = pivots.RowSelection(pivots.filter_mask(frame, filters, dataset.version), len(frame))
+        ignored = ignored_filters(dataset, group[0])
+        for config in group:
+            pivot_start = time.perf_counter()
+            columns = [col for col in pivots.config_columns(config) if dataset.has_column(col)]
+            result = pivots.create_pivot_table(dataset.frame(columns), config, dataset.version,
+                                               selection=selection)
+            results[id(config)] = (result, ignored, time.perf_counter() - pivot_start)
+
+    sheets = []
+    used = set()
+    directory = Path(output) / path.stem
+    for config in configs:
+        result, ignored, seconds = results[id(config)]
+        pivot_df = result['pivot_df']
+        success, error = result['success'], result.get('error')
+        if ignored and not allow_ignored_filters:
+            pivot_df = None
+            success, error = False, "filters cannot be applied (see --allow-ignored-filters)"
+        entry = {
+            'name': config.get('name'),
+            'success': success,
+            'error': error,
+            'selected_rows': len(result['selection']) if result.get('selection') is not None else None,
+            'shape': list(pivot_df.shape) if pivot_df is not None else None,
+            'ignored_filters': ignored,
+            'seconds': round(seconds, 3)
+        }
+        summary['pivots'].append(entry)
+        if pivot_df is None:
+            continue
+        if fmt == 'xlsx':
+            sheets.append((config.get('name') or 'Pivot', pivots.frame_chunks(pivot_df), True))
+        else:
+            directory.mkdir(parents=True, exist_ok=True)
+            target = directory / output_name(config.get('name') or 'Pivot', used)
+            # An empty pivot still gets its header row
+            frames = pivots.frame_chunks(pivot_df) if len(pivot_df) else iter([pivot_df])
+            with open(target, 'wb') as f:
+                for chunk in pivots.iter_csv(frames, index=True):
+                    f.write(chunk)
+            summary['outputs'].append(str(target))
+
+    if sheets:
+        target = Path(output) / f'{path.stem}.xlsx'
+        try:
+            fh = pivots.write_xlsx(sheets)
+            with open(target, 'wb') as f:
+                for block in pivots.stream_file(fh):
+                    f.write(block)
+            summary['outputs'].append(str(target))
+        except ValueError as e:
+            summary['error'] = f"Error writing {target}: {e}"
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+def print_summary(summaries: List[Dict]):
+    for summary in summaries:
+        if summary['error'] and summary['rows'] is None:
+            print(f"❌ {summary['dataset']}: {summary['error']}")
+            continue
+        failed = [p for p in summary['pivots'] if not p['success']]
+        mark = '❌' if failed or summary['error'] else '✅'
+        print(f"{mark} {summary['dataset']}: {summary['rows']:,} rows, "
+              f"{len(summary['pivots']) - len(failed)}/{len(summary['pivots'])} pivots in {summary['seconds']:.1f}s")
+        for pivot in summary['pivots']:
+            if not pivot['success']:
+                print(f"     {pivot['name']}: {pivot['error']}")
+            state = 'ignored' if pivot['success'] else 'cannot be applied'
+            for f in pivot['ignored_filters']:
+                print(f"     ⚠️  {pivot['name']}: filter {state} ({f})")
+        if summary['error']:
+            print(f"     {summary['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run saved Pivot Codex V5 views against CSV files")
+    parser.add_argument('views', help="views JSON file (a list of pivot configs) or views database (.sqlite3)")
+    parser.add_argument('csv', nargs='+', help="CSV files to run the views against")
+    parser.add_argument('--view', default='default', help="view to run, when reading a views database")
+    parser.add_argument('--namespace', default=pivots.SHARED_VIEWS_NAMESPACE,
+                        help="namespace of the view, when reading a views database")
+    parser.add_argument('--version', type=int, help="version of the view (default: latest)")
+    parser.add_argument('--format', choices=('csv', 'xlsx'), default='csv',
+                        help="a directory of CSVs or one workbook per dataset")
+    parser.add_argument('--output', default='batch_output', help="directory the results are written to")
+    parser.add_argument('--jobs', type=int, help="datasets processed in parallel (default: CPU count)")
+    parser.add_argument('--allow-ignored-filters', action='store_true',
+                        help="compute pivots whose filters do not all apply, without those filters "
+                             "(by default such pivots fail)")
+    args = parser.parse_args()
+
+    if args.format == 'xlsx' and not pivots.HAS_OPENPYXL:
+        print("❌ XLSX output requires openpyxl: pip install openpyxl")
+        sys.exit(1)
+    try:
+        configs = load_configs(Path(args.views), args.view, args.namespace, args.version)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    # Drop results and other state a saved session may have carried along
+    configs = [{k: v for k, v in c.items() if k not in pivots.PIVOT_RESULT_KEYS} for c in configs]
+
+    stems = [Path(p).stem for p in args.csv]
+    if len(set(stems)) != len(stems):
+        print("❌ CSV files need distinct names: each gets its own output")
+        sys.exit(1)
+
+    Path(args.output).mkdir(parents=True, exist_ok=True)
+    workers = max(1, min(args.jobs or os.cpu_count() or 1, len(args.csv)))
+    print(f"🚀 {len(configs)} pivots x {len(args.csv)} datasets on {workers} processes", file=sys.stderr)
+    start = time.perf_counter()
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_dataset, p, configs, args.output, args.format,
+                               args.allow_ignored_filters): p for p in args.csv}
+        for future in as_completed(futures):
+            summaries[futures[future]] = future.result()
+    summaries = [summaries[p] for p in args.csv]
+
+    summary_path = Path(args.output) / 'batch_summary.json'
+    summary_path.write_text(json.dumps({'views': args.views, 'seconds': round(time.perf_counter() - start, 3),
+                                        'datasets': summaries}, indent=2, default=str))
+    print_summary(summaries)
+    print(f"\n💾 Results written to {args.output} in {time.perf_counter() - start:.1f}s")
+
+    if any(s['error'] or not all(p['success'] for p in s['pivots']) for s in summaries):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
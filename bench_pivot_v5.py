@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Pivot Codex V5 Benchmark
+========================
+
+End-to-end load test of the Pivot Codex V5 server. Generates tracker-shaped
+CSV files, runs scripted user sessions against the app (in-process, or a
+server already running on localhost) and reports latency percentiles per
+operation, throughput and peak memory as JSON, so runs can be compared
+across commits.
+
+Usage:
+    python bench_pivot_v5.py --rows 1k,100k --sessions 4
+    python bench_pivot_v5.py --rows 1m --output after.json --compare before.json
+    python bench_pivot_v5.py --url http://localhost:8000 --server-pid 1234
+
+Requires httpx (installed with FastAPI's test client).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import resource  # Unix only: peak memory where /proc is not available
+except ImportError:
+    resource = None
+
+ROOT = Path(__file__).resolve().parent
+DATA_DIR = Path(tempfile.gettempdir()) / "pivot_bench_v5"
+
+# Dataset shape, modelled on the tracker export: tens of projects, agents and
+# countries (the same number at every size), skewed towards the busiest ones
+PROJECTS = ['MM', 'Payoneer', 'ENT', 'Payoneer-Bangladesh', 'Payoneer Philippines', 'Payoneer Singapore',
+            'Avibra', 'Payactiv', 'ABCL', 'Canopy Connect'] + [f'Client {i:02d}' for i in range(24)]
+COUNTRIES = ['United States', 'Pakistan', 'Bangladesh', '0', 'India', 'Saudi Arabia', 'United Arab Emirates',
+             'Canada', 'United Kingdom', 'Philippines'] + [f'Country {i:02d}' for i in range(35)]
+AGENTS = [f'Agent {i:02d}' for i in range(86)]
+MANAGERS = [f'Manager {i:02d}' for i in range(51)]
+INDUSTRIES = ['IT', 'Manufacturing', 'Retail', 'Insurance'] + [f'Industry {i:03d}' for i in range(300)]
+CATEGORIES = {
+    'Status': {'New': 0.985, 'Rescheduled': 0.015},
+    'ShowedUp': {'Yes': 0.49, '0': 0.41, 'No': 0.097, 'Cancelled': 0.003},
+    'Opportunity': {'0': 0.65, 'No': 0.18, 'Yes': 0.16, 'Pending': 0.01},
+    'Closed': {'0': 0.79, 'No': 0.13, 'Yes': 0.07, 'Pending': 0.01},
+    'LeadSource': {'Call': 0.76, 'Other': 0.07, 'LinkedIn': 0.055, '0': 0.05, 'Email': 0.045, 'Referral': 0.02},
+    'ProspectLevel': {'C level': 0.27, 'Manager': 0.19, 'Director': 0.17, '0': 0.11, 'VP': 0.1,
+                      'Owner': 0.08, 'Head': 0.05, 'Other': 0.03},
+}
+START_DATE = np.datetime64('2025-01-01')
+DAYS = 175
+SIZES = {'k': 1_000, 'm': 1_000_000}
+
+def parse_size(text: str) -> int:
+    """Row count from '1k', '100k', '1m', '5m' or a plain number"""
+    text = text.strip().lower()
+    if text[-1:] in SIZES:
+        return int(float(text[:-1]) * SIZES[text[-1]])
+    return int(text)
+
+def skewed_positions(rng: np.random.Generator, n_values: int, n: int, skew: float = 1.1) -> np.ndarray:
+    """n positions below n_values drawn with Zipf-like weights (the first ones are the most common)"""
+    weights = 1.0 / np.arange(1, n_values + 1) ** skew
+    return rng.choice(n_values, size=n, p=weights / weights.sum())
+
+def skewed_choice(rng: np.random.Generator, values: List[str], n: int, skew: float = 1.1) -> np.ndarray:
+    return np.asarray(values, dtype=object)[skewed_positions(rng, len(values), n, skew)]
+
+def category_choice(rng: np.random.Generator, shares: Dict[str, float], n: int) -> np.ndarray:
+    probabilities = np.array(list(shares.values()))
+    return np.asarray(list(shares), dtype=object)[rng.choice(len(shares), size=n, p=probabilities / probabilities.sum())]
+
+def date_strings(days: np.ndarray, missing: np.ndarray) -> np.ndarray:
+    """YYYY-MM-DD strings, with the tracker's zero date where missing"""
+    text = np.datetime_as_string(START_DATE + days, unit='D').astype(object)
+    text[missing] = '0000-00-00'
+    return text
+
+def generate_tracker_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Tracker-shaped data: ids, dates with zero-date placeholders, skewed
+    project/agent/country columns, yes/no outcome columns and a
+    high-cardinality company column"""
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, DAYS, n_rows)
+    seconds = rng.integers(0, 86_400, n_rows)
+    created = START_DATE.astype('datetime64[s]') + days * 86_400 + seconds
+    dates = START_DATE + days
+
+    project = skewed_positions(rng, len(PROJECTS), n_rows)
+    agent = skewed_positions(rng, len(AGENTS), n_rows, 0.8)
+    frame = pd.DataFrame({
+        'Id': np.arange(1, n_rows + 1),
+        'Date': date_strings(days, np.zeros(n_rows, dtype=bool)),
+        'CreateDt': np.char.replace(np.datetime_as_string(created, unit='s'), 'T', ' ').astype(object),
+        'ScheduledFor': date_strings(np.minimum(days + rng.integers(0, 30, n_rows), DAYS - 1), rng.random(n_rows) < 0.1),
+        'ClosedDate': date_strings(np.minimum(days + rng.integers(0, 60, n_rows), DAYS - 1), rng.random(n_rows) < 0.92),
+        'Month': pd.DatetimeIndex(dates).strftime('%b').to_numpy(dtype=object),
+        'Year': '2025',
+        'Country': skewed_choice(rng, COUNTRIES, n_rows, 1.4),
+        'Extra1': (project + 20).astype(str).astype(object),
+        'Extra2': np.asarray(PROJECTS, dtype=object)[project],
+        'Extra4': np.char.add('NNT0', (agent * 7 + 21).astype(str)).astype(object),
+        'Extra5': np.asarray(AGENTS, dtype=object)[agent],
+        'Extra11': np.asarray(MANAGERS, dtype=object)[agent % len(MANAGERS)],
+        'SDR': (agent * 7 + 21).astype(str).astype(object),
+        'CompanyName': np.char.add('Company ', rng.integers(0, max(n_rows // 2, 1), n_rows).astype(str)).astype(object),
+        'Industry': skewed_choice(rng, INDUSTRIES, n_rows),
+        'EmployeeCount': rng.choice([0, 10, 50, 100, 500, 1000, 2000, 10000], size=n_rows).astype(str).astype(object),
+        'Revenue': np.where(rng.random(n_rows) < 0.8, ' - 0', rng.choice([5000, 10000, 20000], n_rows).astype(str)).astype(object),
+    })
+    frame.loc[rng.random(n_rows) < 0.4, 'Industry'] = None
+    for col, shares in CATEGORIES.items():
+        frame[col] = category_choice(rng, shares, n_rows)
+    return frame
+
+def dataset_path(n_rows: int, seed: int) -> Path:
+    """CSV of n_rows generated rows, generated once and reused by later runs"""
+    path = DATA_DIR / f"tracker_{n_rows}_{seed}.csv"
+    if not path.exists():
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        print(f"📝 Generating {n_rows:,} rows -> {path}", file=sys.stderr)
+        partial = path.with_suffix('.partial')
+        generate_tracker_frame(n_rows, seed).to_csv(partial, index=False)
+        partial.replace(path)
+    return path
+
+def peak_rss_bytes(pid: Optional[int] = None) -> Optional[int]:
+    """Peak resident memory of a process (this one by default), None if unknown"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None and resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+class Recorder:
+    """Latency (seconds) and success of every request, by operation"""
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def request(self, client: 'httpx.AsyncClient', operation: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.latencies.setdefault(operation, []).append(time.perf_counter() - start)
+        if not ok:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+        return response
+
+    def summary(self) -> Dict[str, Dict]:
+        summary = {}
+        for operation, values in sorted(self.latencies.items()):
+            ms = np.array(values) * 1000
+            summary[operation] = {
+                'count': len(values),
+                'errors': self.errors.get(operation, 0),
+                'p50_ms': round(float(np.percentile(ms, 50)), 3),
+                'p90_ms': round(float(np.percentile(ms, 90)), 3),
+                'p99_ms': round(float(np.percentile(ms, 99)), 3),
+                'mean_ms': round(float(ms.mean()), 3),
+                'max_ms': round(float(ms.max()), 3)
+            }
+        return summary
+
+def pivot_configs(project: str) -> List[Dict]:
+    """The pivots a session builds, modelled on the saved filter scripts"""
+    return [
+        {   # Show-ups per agent for one project
+            'name': 'Showups',
+            'index_cols': ['Extra5'],
+            'column_cols': [],
+            'value_agg_list': [{'value_col': 'CompanyName', 'agg_func': 'count'}],
+            'filters': [{'column': 'Extra2', 'operator': '==', 'value': project},
+                        {'column': 'ShowedUp', 'operator': '==', 'value': 'Yes'},
+                        {'column': 'ScheduledFor', 'operator': 'contains', 'value': '-05-'}]
+        },
+        {   # Closed deals per project and month, with totals
+            'name': 'Closed',
+            'index_cols': ['Extra2'],
+            'column_cols': ['Month'],
+            'value_agg_list': [{'value_col': 'Id', 'agg_func': 'count'}],
+            'filters': [{'column': 'Closed', 'operator': '==', 'value': 'Yes'}],
+            'margins_enabled': True
+        },
+        {   # Recent appointments per country
+            'name': 'Countries',
+            'index_cols': ['Country', 'LeadSource'],
+            'column_cols': [],
+            'value_agg_list': [{'value_col': 'Id', 'agg_func': 'count'}],
+            'filters': [{'column': 'CreateDt', 'operator': '>=', 'value': '2025-03-01'},
+                        {'column': 'Extra2', 'operator': 'in', 'value': 'Payoneer, Payoneer Singapore, MM'}]
+        },
+    ]
+
+async def run_session(client: 'httpx.AsyncClient', recorder: Recorder, session_id: str,
+                      csv_path: Path, iterations: int, seed: int):
+    """One user: upload, build pivots, edit filters, browse tables and rows, download"""
+    rng = random.Random(seed)
+    with open(csv_path, 'rb') as f:
+        content = f.read()
+    response = await recorder.request(client, 'upload', 'POST', '/api/upload', params={'session_id': session_id},
+                                      files={'file': (csv_path.name, content, 'text/csv')})
+    if response is None or response.status_code >= 400:
+        return
+    await recorder.request(client, 'profile', 'GET', f'/api/profile/{session_id}')
+
+    pivot_ids = []
+    for config in pivot_configs(rng.choice(PROJECTS[:6])):
+        response = await recorder.request(client, 'create_pivot', 'POST', f'/api/pivots/{session_id}')
+        if response is None or response.status_code >= 400:
+            return
+        pivot_id = response.json()['pivot_id']
+        pivot_ids.append(pivot_id)
+        await recorder.request(client, 'update_pivot', 'PUT', f'/api/pivots/{session_id}/{pivot_id}', json=config)
+        await recorder.request(client, 'pivot_table', 'GET', f'/api/pivot-table/{session_id}/{pivot_id}',
+                               params={'limit': 100})
+
+    showups = pivot_ids[0]
+    for _ in range(iterations):
+        # Pick another project the way a user would: autocomplete, then edit the filter
+        prefix = rng.choice(['Pay', 'A', 'M', 'Cl'])
+        await recorder.request(client, 'values', 'GET', f'/api/values/{session_id}/Extra2',
+                               params={'prefix': prefix, 'limit': 20})
+        config = pivot_configs(rng.choice(PROJECTS))[0]
+        await recorder.request(client, 'edit_filter', 'PUT', f'/api/pivots/{session_id}/{showups}', json=config)
+        await recorder.request(client, 'pivot_table', 'GET', f'/api/pivot-table/{session_id}/{showups}',
+                               params={'limit': 100, 'sort_by': 'CompanyName', 'ascending': 'false'})
+        await recorder.request(client, 'rows', 'GET', f'/api/rows/{session_id}',
+                               params={'pivot_id': showups, 'sort_by': 'CreateDt', 'limit': 100,
+                                       'offset': rng.randrange(0, 1000), 'columns': 'Id,CreateDt,Extra2,Extra5'})
+
+    await recorder.request(client, 'compute_all', 'POST', f'/api/pivots/{session_id}/compute-all')
+    for file_type in ('pivot_csv', 'filtered_csv'):
+        await recorder.request(client, f'download_{file_type}', 'GET',
+                               f'/api/download/{session_id}/{pivot_ids[1]}/{file_type}')
+
+async def run_sessions(base_url: Optional[str], csv_path: Path, n_sessions: int,
+                       iterations: int, seed: int) -> Dict:
+    """Run concurrent sessions; returns per-operation latencies and throughput"""
+    recorder = Recorder()
+    timeout = httpx.Timeout(600.0)
+    if base_url:
+        client = httpx.AsyncClient(base_url=base_url, timeout=timeout)
+        lifespan = contextlib.nullcontext()
+    else:
+        sys.path.insert(0, str(ROOT / 'CodexV2'))
+        from pivot_by_codex_v5 import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench', timeout=timeout)
+        # Run the app's startup and shutdown handlers, as a server would
+        lifespan = app.router.lifespan_context(app)
+    run_id = datetime.now().strftime('%H%M%S')
+    async with lifespan, client:
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(client, recorder, f'bench-{run_id}-{i}', csv_path, iterations, seed + i)
+                               for i in range(n_sessions)))
+        wall = time.perf_counter() - start
+    requests = sum(len(v) for v in recorder.latencies.values())
+    return {
+        'wall_seconds': round(wall, 3),
+        'requests': requests,
+        'errors': sum(recorder.errors.values()),
+        'throughput_rps': round(requests / wall, 3) if wall else None,
+        'operations': recorder.summary()
+    }
+
+def environment() -> Dict:
+    """Versions and hardware a result was measured with"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    try:
+        import pyarrow
+        pyarrow_version = pyarrow.__version__
+    except ImportError:
+        pyarrow_version = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'pyarrow': pyarrow_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+def benchmark_size(args, n_rows: int) -> Dict:
+    """Benchmark one dataset size, in a fresh process when running in-process
+    so that peak memory and caches are those of this size alone"""
+    csv_path = dataset_path(n_rows, args.seed)
+    if not args.url and not args.child:
+        command = [sys.executable, __file__, '--rows', str(n_rows), '--sessions', str(args.sessions),
+                   '--iterations', str(args.iterations), '--seed', str(args.seed), '--child']
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        return json.loads(output)
+
+    result = asyncio.run(run_sessions(args.url, csv_path, args.sessions, args.iterations, args.seed))
+    return {
+        'rows': n_rows,
+        'csv_bytes': csv_path.stat().st_size,
+        **result,
+        'peak_rss_bytes': peak_rss_bytes(args.server_pid if args.url else None)
+    }
+
+def print_summary(result: Dict):
+    for size in result['sizes']:
+        rss = size['peak_rss_bytes']
+        print(f"\n📊 {size['rows']:,} rows: {size['requests']} requests in {size['wall_seconds']}s "
+              f"({size['throughput_rps']} req/s), {size['errors']} errors, "
+              f"peak RSS {f'{rss / 2 ** 20:.0f} MB' if rss else 'unknown'}")
+        print(f"   {'operation':<24}{'count':>7}{'p50 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+        for operation, stats in size['operations'].items():
+            print(f"   {operation:<24}{stats['count']:>7}{stats['p50_ms']:>11.1f}{stats['p99_ms']:>11.1f}{stats['max_ms']:>11.1f}")
+
+def compare(baseline: Dict, result: Dict, threshold: float) -> List[str]:
+    """Print how result differs from baseline; returns the regressions found"""
+    regressions = []
+    previous = {size['rows']: size for size in baseline['sizes']}
+    print(f"\n🔍 Compared with {baseline['environment'].get('commit')} "
+          f"({baseline['environment'].get('timestamp')}), regression threshold {threshold:.0f}%")
+    if baseline.get('parameters') != result.get('parameters'):
+        print(f"   ⚠️  Parameters differ: {baseline.get('parameters')} vs {result.get('parameters')}")
+    for size in result['sizes']:
+        before = previous.get(size['rows'])
+        if before is None:
+            continue
+        print(f"   {size['rows']:,} rows")
+        for operation, stats in size['operations'].items():
+            old = before['operations'].get(operation)
+            if old is None:
+                continue
+            for key in ('p50_ms', 'p99_ms'):
+                change = (stats[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                flag = ''
+                if change > threshold:
+                    flag = ' ⚠️'
+                    regressions.append(f"{size['rows']} rows {operation} {key} +{change:.0f}%")
+                print(f"     {operation:<24}{key:<8}{old[key]:>10.1f} -> {stats[key]:>10.1f} ({change:+.0f}%){flag}")
+        if before.get('peak_rss_bytes') and size.get('peak_rss_bytes'):
+            change = (size['peak_rss_bytes'] - before['peak_rss_bytes']) / before['peak_rss_bytes'] * 100
+            print(f"     {'peak RSS':<32}{before['peak_rss_bytes'] / 2 ** 20:>10.0f} -> "
+                  f"{size['peak_rss_bytes'] / 2 ** 20:>10.0f} MB ({change:+.0f}%)")
+            if change > threshold:
+                regressions.append(f"{size['rows']} rows peak RSS +{change:.0f}%")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the Pivot Codex V5 server")
+    parser.add_argument('--rows', default='1k,100k', help="comma-separated dataset sizes, e.g. 1k,100k,1m,5m")
+    parser.add_argument('--sessions', type=int, default=4, help="concurrent user sessions")
+    parser.add_argument('--iterations', type=int, default=5, help="filter edits per session")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the generated data and sessions")
+    parser.add_argument('--url', help="benchmark a running server (e.g. http://localhost:8000) instead of in-process")
+    parser.add_argument('--server-pid', type=int, help="pid of the server given by --url, to report its peak RSS")
+    parser.add_argument('--output', default='bench_pivot_v5.json', help="where to write the JSON result")
+    parser.add_argument('--compare', help="JSON result of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=10.0, help="slowdown (%%) reported as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit with status 1 on regressions")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if httpx is None:
+        print("❌ httpx is required: pip install httpx")
+        sys.exit(1)
+
+    sizes = [parse_size(size) for size in args.rows.split(',') if size.strip()]
+    if args.child:
+        # One size, measured in this process; the parent collects the JSON
+        print(json.dumps(benchmark_size(args, sizes[0])))
+        return
+
+    print("🚀 Pivot Codex V5 Benchmark", file=sys.stderr)
+    result = {
+        'environment': environment(),
+        'parameters': {'sessions': args.sessions, 'iterations': args.iterations, 'seed': args.seed,
+                       'target': args.url or 'in-process'},
+        'sizes': []
+    }
+    for n_rows in sizes:
+        print(f"⏱️  {n_rows:,} rows, {args.sessions} sessions...", file=sys.stderr)
+        result['sizes'].append(benchmark_size(args, n_rows))
+
+    Path(args.output).write_text(json.dumps(result, indent=2))
+    print_summary(result)
+    print(f"\n💾 Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), result, args.threshold)
+        if regressions and args.fail_on_regression:
+            print(f"\n❌ {len(regressions)} regression(s)")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
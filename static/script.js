@@ -7,6 +7,15 @@ class PivotCodex {
         this.currentData = null;
         this.pivotConfigs = [];
         this.activePivotId = null;
+        this.columnProfiles = {};  // column: profile from /api/profile
+        this.pushChannel = null;  // EventSource of /api/events
+        this.pushConnected = false;
+        this.pushedTables = {};  // pivotId: table as last pushed (version, columns, index, rows)
+        this.pushSeq = 0;  // pushes received so far
+        this.pivotPushSeq = {};  // pivotId: pushSeq of its latest push
+        this.pushWaiters = {};  // pivotId: called with the next push of that pivot
+        this.renderedRows = null;  // row key: <tr> of the rendered pivot, for patching cells
+        this.renderedPivotId = null;
         
         this.init();
     }
@@ -67,8 +76,12 @@ class PivotCodex {
             document.getElementById('customFillValue').disabled = !e.target.checked;
         });
         
-        document.getElementById('marginsEnabled').addEventListener('change', (e) => {
-            document.getElementById('marginsName').disabled = !e.target.checked;
+        document.getElementById('marginsEnabled').addEventListener('change', () => {
+            this.updateTotalsNameState();
+        });
+        
+        document.getElementById('subtotalsEnabled').addEventListener('change', () => {
+            this.updateTotalsNameState();
         });
         
         // Value aggregation
@@ -185,6 +198,9 @@ class PivotCodex {
             
             if (result.success) {
                 this.currentData = result;
+                this.columnProfiles = {};
+                this.loadColumnProfiles();
+                this.connectPushChannel();
                 this.updateDataInfo(result);
                 this.showWelcomeScreen(false);
                 this.showToast(`File uploaded successfully! ${result.shape[0]} rows, ${result.shape[1]} columns`, 'success');
@@ -198,6 +214,21 @@ class PivotCodex {
         }
     }
     
+    async loadColumnProfiles() {
+        // Top values and ranges for the filter value pickers, computed once on the server
+        try {
+            const response = await fetch(`/api/profile/${this.sessionId}`);
+            if (response.ok) {
+                const profile = await response.json();
+                this.columnProfiles = profile.columns;
+                const config = this.pivotConfigs.find(p => p.id === this.activePivotId);
+                if (config) this.updateFilterList(config.filters);
+            }
+        } catch (error) {
+            // Filters still work without value suggestions
+        }
+    }
+    
     updateDataInfo(data) {
         document.getElementById('fileName').textContent = data.filename;
         document.getElementById('dataRows').textContent = data.shape[0].toLocaleString();
@@ -328,8 +359,8 @@ class PivotCodex {
         document.getElementById('pivotNameInput').value = config.name;
         
         // Setup column selects
-        this.setupMultiSelect('indexSelect', this.currentData.columns, config.index_cols);
-        this.setupMultiSelect('columnSelect', this.currentData.columns, config.column_cols);
+        this.setupMultiSelect('indexSelect', this.groupingColumns(), config.index_cols);
+        this.setupMultiSelect('columnSelect', this.groupingColumns(), config.column_cols);
         
         // Setup value aggregations
         this.updateValueAggregationList(config.value_agg_list);
@@ -344,7 +375,8 @@ class PivotCodex {
         
         document.getElementById('marginsEnabled').checked = config.margins_enabled;
         document.getElementById('marginsName').value = config.margins_name || 'All_Totals';
-        document.getElementById('marginsName').disabled = !config.margins_enabled;
+        document.getElementById('subtotalsEnabled').checked = Boolean(config.subtotals_enabled);
+        this.updateTotalsNameState();
         
         // Show configuration
         document.getElementById('pivotConfig').style.display = 'block';
@@ -578,10 +610,17 @@ class PivotCodex {
             'Not In List': 'not_in'
         };
         
+        const profile = this.columnProfiles[filter.column];
+        const listId = `filterValues${index}`;
+        let placeholder = 'Filter value...';
+        if (profile && profile.min !== null) {
+            placeholder = `${profile.min} … ${profile.max}`;
+        }
+        
         itemDiv.innerHTML = `
             <select class="filter-col-select" onchange="app.updateFilter(${index}, 'column', this.value)">
                 <option value="">Select column...</option>
-                ${this.currentData.columns.map(col => 
+                ${this.groupingColumns().map(col => 
                     `<option value="${col}" ${col === filter.column ? 'selected' : ''}>${col}</option>`
                 ).join('')}
             </select>
@@ -590,9 +629,15 @@ class PivotCodex {
                     `<option value="${op}" ${op === filter.operator ? 'selected' : ''}>${name}</option>`
                 ).join('')}
             </select>
-            <input type="text" class="filter-value-input" placeholder="Filter value..." 
-                   value="${filter.value || ''}" 
+            <input type="text" class="filter-value-input" placeholder="${placeholder}" 
+                   value="${filter.value || ''}" list="${listId}"
+                   oninput="app.suggestFilterValues(${index}, this.value)"
                    onchange="app.updateFilter(${index}, 'value', this.value)">
+            <datalist id="${listId}">
+                ${(profile ? profile.top_values : []).map(item => 
+                    `<option value="${item.value}">${item.count.toLocaleString()} rows</option>`
+                ).join('')}
+            </datalist>
             <button onclick="app.removeFilter(${index})" title="Remove filter">
                 <i class="fas fa-trash"></i>
             </button>
@@ -605,6 +650,31 @@ class PivotCodex {
         const config = this.pivotConfigs.find(p => p.id === this.activePivotId);
         if (config && config.filters[index]) {
             config.filters[index][field] = value;
+            if (field === 'column') {
+                // Refresh the value suggestions for the new column
+                this.updateFilterList(config.filters);
+            }
+        }
+    }
+    
+    async suggestFilterValues(index, text) {
+        // Complete the value being typed (the last one of a list) from the server's value index
+        const config = this.pivotConfigs.find(p => p.id === this.activePivotId);
+        const filter = config && config.filters[index];
+        if (!filter || !filter.column) return;
+        
+        const isList = filter.operator === 'in' || filter.operator === 'not_in';
+        const head = isList ? text.slice(0, text.lastIndexOf(',') + 1) : '';
+        const prefix = text.slice(head.length).trimStart();
+        try {
+            const response = await fetch(`/api/values/${this.sessionId}/${encodeURIComponent(filter.column)}?prefix=${encodeURIComponent(prefix)}&limit=20`);
+            if (!response.ok) return;
+            const result = await response.json();
+            document.getElementById(`filterValues${index}`).innerHTML = result.values.map(item =>
+                `<option value="${head}${item.value}">${item.count.toLocaleString()} rows</option>`
+            ).join('');
+        } catch (error) {
+            // Keep the current suggestions
         }
     }
     
@@ -643,10 +713,18 @@ class PivotCodex {
         config.custom_fill_value = document.getElementById('customFillValue').value;
         config.margins_enabled = document.getElementById('marginsEnabled').checked;
         config.margins_name = document.getElementById('marginsName').value;
+        config.subtotals_enabled = document.getElementById('subtotalsEnabled').checked;
         
         this.updatePivotList();
     }
     
+    updateTotalsNameState() {
+        // Totals and subtotals are both labelled with the margins name
+        document.getElementById('marginsName').disabled =
+            !document.getElementById('marginsEnabled').checked &&
+            !document.getElementById('subtotalsEnabled').checked;
+    }
+    
     async generatePivot() {
         if (!this.activePivotId) {
             this.showToast('No active pivot selected', 'warning');
@@ -658,8 +736,11 @@ class PivotCodex {
         
         this.showLoading('Generating pivot table...');
         
+        const pivotId = this.activePivotId;
+        const since = this.pushSeq;
         try {
-            const response = await fetch(`/api/pivots/${this.sessionId}/${this.activePivotId}`, {
+            // Large uploads answer first with an estimate from a sample
+            const response = await fetch(`/api/pivots/${this.sessionId}/${pivotId}?preview=true`, {
                 method: 'PUT',
                 headers: {
                     'Content-Type': 'application/json'
@@ -669,8 +750,23 @@ class PivotCodex {
             
             const result = await response.json();
             
-            if (result.success) {
-                await this.displayPivotTable();
+            if (result.success && result.estimate) {
+                await this.showPivotResult(pivotId, since);
+                const shown = this.pivotPushSeq[pivotId] || 0;
+                this.hideLoading();
+                this.showToast('Showing an estimate; computing the exact pivot...', 'info');
+                const job = await this.waitForJob(result.job_id);
+                if (this.activePivotId !== pivotId || job.status === 'cancelled') {
+                    return;  // superseded by another pivot or update
+                }
+                if (job.status === 'done' && job.outcome && job.outcome.success) {
+                    await this.showPivotResult(pivotId, shown);
+                    this.showToast('Pivot table generated successfully', 'success');
+                } else {
+                    this.showError(`Failed to generate pivot: ${(job.outcome && job.outcome.error) || job.error}`);
+                }
+            } else if (result.success) {
+                await this.showPivotResult(pivotId, since);
                 this.showToast('Pivot table generated successfully', 'success');
             } else {
                 this.showError(`Failed to generate pivot: ${result.error}`);
@@ -682,6 +778,166 @@ class PivotCodex {
         }
     }
     
+    waitForJob(jobId) {
+        // Resolves with the job's final state, pushed by the server as it changes
+        return new Promise((resolve, reject) => {
+            const events = new EventSource(`/api/jobs/${jobId}/events`);
+            events.onmessage = (event) => {
+                const job = JSON.parse(event.data);
+                if (['done', 'failed', 'cancelled'].includes(job.status)) {
+                    events.close();
+                    resolve(job);
+                }
+            };
+            events.onerror = () => {
+                events.close();
+                reject(new Error('Lost connection to the server'));
+            };
+        });
+    }
+    
+    connectPushChannel() {
+        // Pivot results are pushed as they finish: a whole table first, then only what changed
+        if (this.pushChannel) {
+            this.pushChannel.close();
+        }
+        this.pushChannel = new EventSource(`/api/events/${this.sessionId}`);
+        this.pushChannel.onopen = () => {
+            // A new channel starts each pivot over with a whole table
+            this.pushConnected = true;
+            this.pushedTables = {};
+        };
+        this.pushChannel.onerror = () => {
+            this.pushConnected = false;  // EventSource reconnects by itself
+        };
+        this.pushChannel.onmessage = (event) => this.handlePivotPush(JSON.parse(event.data));
+    }
+    
+    handlePivotPush(message) {
+        const pivotId = message.pivot_id;
+        let table = this.pushedTables[pivotId];
+        let changedCells = null;  // set when only cells changed, so they can be patched in place
+        if (message.type === 'full') {
+            table = {
+                version: message.version,
+                columns: message.columns,
+                index: message.index,
+                rows: message.rows,
+                estimate: message.estimate,
+                errorBounds: message.error_bounds
+            };
+        } else if (message.type === 'delta' && table && table.version === message.base_version) {
+            changedCells = this.applyPivotDelta(table, message);
+        } else if (message.type !== 'error') {
+            table = null;  // too large to push, or out of step: fetched instead
+        }
+        if (table) {
+            this.pushedTables[pivotId] = table;
+        } else {
+            delete this.pushedTables[pivotId];
+        }
+        
+        if (pivotId === this.activePivotId && message.type !== 'error') {
+            if (!table) {
+                this.displayPivotTable();
+            } else if (!changedCells || !this.patchPivotTable(pivotId, table, changedCells)) {
+                this.renderPivotTable(this.pushedTableData(table), pivotId);
+            }
+        }
+        
+        this.pushSeq += 1;
+        this.pivotPushSeq[pivotId] = this.pushSeq;
+        const waiter = this.pushWaiters[pivotId];
+        if (waiter) {
+            delete this.pushWaiters[pivotId];
+            waiter();
+        }
+    }
+    
+    applyPivotDelta(table, delta) {
+        // Returns the changed cells as [row key, column position, value] when no row moved
+        const key = (index) => JSON.stringify(index);
+        const rows = new Map(table.index.map((index, i) => [key(index), table.rows[i]]));
+        delta.removed.forEach(index => rows.delete(key(index)));
+        const changedCells = [];
+        delta.changed.forEach(([index, cells]) => {
+            const row = rows.get(key(index));
+            cells.forEach(([position, value]) => {
+                row[position] = value;
+                changedCells.push([key(index), position, value]);
+            });
+        });
+        let order = table.index.filter(index => rows.has(key(index)));
+        delta.added.forEach(([index, row]) => {
+            rows.set(key(index), row);
+            order.push(index);
+        });
+        if (delta.index) {
+            order = delta.index;
+        }
+        table.version = delta.version;
+        table.index = order;
+        table.rows = order.map(index => rows.get(key(index)));
+        table.estimate = false;
+        table.errorBounds = null;
+        const moved = delta.removed.length || delta.added.length || delta.index;
+        return moved ? null : changedCells;
+    }
+    
+    pushedTableData(table) {
+        // A pushed table in the layout /api/pivot-table returns
+        const records = (rows) => rows.map(row => Object.fromEntries(table.columns.map((col, i) => [col, row[i]])));
+        return {
+            columns: table.columns,
+            index: table.index,
+            data: records(table.rows),
+            estimate: table.estimate,
+            error_bounds: table.errorBounds ? records(table.errorBounds) : null
+        };
+    }
+    
+    patchPivotTable(pivotId, table, changedCells) {
+        // Update only the changed cells of the rendered table; false if it shows something else
+        if (this.renderedPivotId !== pivotId || !this.renderedRows ||
+            document.getElementById('pivotTable').classList.contains('estimate')) {
+            return false;
+        }
+        for (const [rowKey, position, value] of changedCells) {
+            const tr = this.renderedRows.get(rowKey);
+            const td = tr && tr.children[position + (tr.dataset.hasIndex ? 1 : 0)];
+            if (!td) {
+                return false;
+            }
+            this.fillPivotCell(td, value);
+        }
+        this.displayStatistics(this.pushedTableData(table));
+        return true;
+    }
+    
+    async showPivotResult(pivotId, since) {
+        // A pushed result is rendered as it arrives; fetch the table only when none comes
+        if ((this.pivotPushSeq[pivotId] || 0) > since) {
+            return;
+        }
+        if (this.pushConnected && await this.waitForPush(pivotId, 1000)) {
+            return;
+        }
+        await this.displayPivotTable();
+    }
+    
+    waitForPush(pivotId, timeout) {
+        return new Promise(resolve => {
+            const timer = setTimeout(() => {
+                delete this.pushWaiters[pivotId];
+                resolve(false);
+            }, timeout);
+            this.pushWaiters[pivotId] = () => {
+                clearTimeout(timer);
+                resolve(true);
+            };
+        });
+    }
+    
     async displayPivotTable() {
         try {
             const response = await fetch(`/api/pivot-table/${this.sessionId}/${this.activePivotId}`);
@@ -690,79 +946,99 @@ class PivotCodex {
                 throw new Error('Failed to load pivot table data');
             }
             
-            const tableData = await response.json();
+            this.renderPivotTable(await response.json(), this.activePivotId);
+        } catch (error) {
+            this.showError(`Failed to display pivot table: ${error.message}`);
+        }
+    }
+    
+    fillPivotCell(td, value, bound) {
+        if (typeof value === 'number') {
+            td.textContent = value.toLocaleString();
+        } else {
+            td.textContent = value || '';
+        }
+        
+        td.title = '';
+        if (typeof bound === 'number') {
+            td.textContent = `≈ ${td.textContent}`;
+            td.title = `± ${bound.toLocaleString(undefined, {maximumFractionDigits: 2})}`;
+        }
+    }
+    
+    renderPivotTable(tableData, pivotId) {
+        // Display the pivot table
+        const table = document.getElementById('pivotTable');
+        table.innerHTML = '';
+        table.classList.toggle('estimate', Boolean(tableData.estimate));
+        this.renderedPivotId = pivotId;
+        this.renderedRows = new Map();
+        
+        if (tableData.data && tableData.data.length > 0) {
+            if (tableData.estimate) {
+                const caption = document.createElement('caption');
+                caption.textContent = 'Estimated from a sample of the rows (± 95% error bounds); the exact pivot replaces it when ready';
+                table.appendChild(caption);
+            }
+            
+            // Create header
+            const thead = document.createElement('thead');
+            const headerRow = document.createElement('tr');
             
-            // Display the pivot table
-            const table = document.getElementById('pivotTable');
-            table.innerHTML = '';
+            // Add index column headers if present
+            if (tableData.index && tableData.index.length > 0) {
+                const indexHeader = document.createElement('th');
+                indexHeader.textContent = '';
+                headerRow.appendChild(indexHeader);
+            }
+            
+            // Add column headers
+            tableData.columns.forEach(col => {
+                const th = document.createElement('th');
+                th.textContent = col;
+                headerRow.appendChild(th);
+            });
+            
+            thead.appendChild(headerRow);
+            table.appendChild(thead);
             
-            if (tableData.data && tableData.data.length > 0) {
-                // Create header
-                const thead = document.createElement('thead');
-                const headerRow = document.createElement('tr');
+            // Create body
+            const tbody = document.createElement('tbody');
+            
+            tableData.data.forEach((row, rowIndex) => {
+                const tr = document.createElement('tr');
                 
-                // Add index column headers if present
-                if (tableData.index && tableData.index.length > 0) {
-                    const indexHeader = document.createElement('th');
-                    indexHeader.textContent = '';
-                    headerRow.appendChild(indexHeader);
+                // Add index cell if present
+                if (tableData.index && tableData.index[rowIndex] !== undefined) {
+                    const indexCell = document.createElement('td');
+                    indexCell.textContent = tableData.index[rowIndex];
+                    indexCell.style.fontWeight = 'bold';
+                    tr.appendChild(indexCell);
+                    tr.dataset.hasIndex = 'true';
+                    this.renderedRows.set(JSON.stringify(tableData.index[rowIndex]), tr);
                 }
                 
-                // Add column headers
+                // Add data cells
                 tableData.columns.forEach(col => {
-                    const th = document.createElement('th');
-                    th.textContent = col;
-                    headerRow.appendChild(th);
-                });
-                
-                thead.appendChild(headerRow);
-                table.appendChild(thead);
-                
-                // Create body
-                const tbody = document.createElement('tbody');
-                
-                tableData.data.forEach((row, rowIndex) => {
-                    const tr = document.createElement('tr');
-                    
-                    // Add index cell if present
-                    if (tableData.index && tableData.index[rowIndex] !== undefined) {
-                        const indexCell = document.createElement('td');
-                        indexCell.textContent = tableData.index[rowIndex];
-                        indexCell.style.fontWeight = 'bold';
-                        tr.appendChild(indexCell);
-                    }
-                    
-                    // Add data cells
-                    tableData.columns.forEach(col => {
-                        const td = document.createElement('td');
-                        const value = row[col];
-                        
-                        if (typeof value === 'number') {
-                            td.textContent = value.toLocaleString();
-                        } else {
-                            td.textContent = value || '';
-                        }
-                        
-                        tr.appendChild(td);
-                    });
-                    
-                    tbody.appendChild(tr);
+                    const td = document.createElement('td');
+                    const bound = tableData.error_bounds && tableData.error_bounds[rowIndex][col];
+                    this.fillPivotCell(td, row[col], bound);
+                    tr.appendChild(td);
                 });
                 
-                table.appendChild(tbody);
-                
-                // Show results section
-                document.getElementById('pivotResults').style.display = 'block';
-                
-                // Calculate and display statistics
-                this.displayStatistics(tableData);
-                
-            } else {
-                table.innerHTML = '<tr><td colspan="100%">No data to display</td></tr>';
-            }
+                tbody.appendChild(tr);
+            });
             
-        } catch (error) {
-            this.showError(`Failed to display pivot table: ${error.message}`);
+            table.appendChild(tbody);
+            
+            // Show results section
+            document.getElementById('pivotResults').style.display = 'block';
+            
+            // Calculate and display statistics
+            this.displayStatistics(tableData);
+            
+        } else {
+            table.innerHTML = '<tr><td colspan="100%">No data to display</td></tr>';
         }
     }
     
@@ -831,6 +1107,7 @@ class PivotCodex {
         
         this.showLoading('Copying filters...');
         
+        const since = this.pushSeq;
         try {
             const response = await fetch(`/api/copy-filters/${this.sessionId}`, {
                 method: 'POST',
@@ -846,8 +1123,21 @@ class PivotCodex {
             const result = await response.json();
             
             if (result.success) {
+                // Regenerate the target pivots together: pivots sharing filters filter the data once
+                this.showLoading('Regenerating pivots...');
+                await fetch(`/api/pivots/${this.sessionId}/compute-all`, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({ pivot_ids: targetPivotIds })
+                });
+                
                 await this.loadPivots();
                 this.loadPivotConfiguration();
+                if (targetPivotIds.includes(this.activePivotId)) {
+                    await this.showPivotResult(this.activePivotId, since);
+                }
                 this.showToast(`Filters copied to ${result.updated_count} pivot(s)`, 'success');
             } else {
                 throw new Error('Failed to copy filters');
@@ -999,12 +1289,20 @@ class PivotCodex {
         this.checkForExistingData();
     }
     
+    groupingColumns() {
+        // Columns plus the periods of date columns (e.g. "CreateDt@month")
+        return this.currentData.columns.concat(this.currentData.date_buckets || []);
+    }
+    
     async checkForExistingData() {
         try {
             const response = await fetch(`/api/data/${this.sessionId}`);
             if (response.ok) {
                 const data = await response.json();
                 this.currentData = data;
+                this.columnProfiles = {};
+                this.loadColumnProfiles();
+                this.connectPushChannel();
                 this.updateDataInfo(data);
                 this.showWelcomeScreen(false);
                 await this.loadPivots();